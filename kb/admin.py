@@ -1,10 +1,61 @@
 from django.contrib import admin
+from django.urls import reverse
+from django.contrib.admin import helpers
+from django.contrib.admin.views.main import ChangeList
 from django.contrib.auth.admin import UserAdmin
 from django.utils.translation import gettext_lazy as _
 from django.utils.html import format_html
-from .models import CustomUser, Department, Category, Document, Comment
+from django.template.response import TemplateResponse
+from . import bulk
+from .access import get_policy
+from .forms import MoveDocumentsForm
+from .models import BulkAction, CustomUser, Department, Category, Document, Comment
+from .pagination import EstimatedCountPaginator
+from .routers import reading_from_replica
+from .search import get_search_backend
 
-class CustomUserAdmin(UserAdmin):
+class DepartmentScopedAdminMixin:
+    """Менеджер видит в админке только записи своего отдела."""
+    department_field = 'department'
+
+    def get_queryset(self, request):
+        return get_policy(request).admin_scope(super().get_queryset(request), self.department_field)
+
+
+class ReplicaChangelistMixin:
+    """Списки админки читаются с реплики (см. kb.routers)."""
+
+    def changelist_view(self, request, extra_context=None):
+        with reading_from_replica(request):
+            response = super().changelist_view(request, extra_context)
+            # Результаты выбираются при рендеринге шаблона: рендерим внутри того же контекста
+            if hasattr(response, 'render'):
+                response.render()
+        return response
+
+
+class LargeChangelistMixin:
+    """Список большой таблицы: без COUNT(*) по всей выборке и без поиска подстрокой.
+
+    Число строк выше порога берется из оценки (``EstimatedCountPaginator``),
+    общее число без фильтров не показывается.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class BulkActionsMixin:
+    """Массовые действия выполняются в фоне по частям (см. kb.bulk)."""
+
+    def enqueue_bulk_action(self, request, queryset, action, description, params=None):
+        bulk_action = bulk.enqueue(action, queryset, request.user, description, params)
+        self.message_user(request, format_html(
+            '{}: объектов в очереди — {}. <a href="{}">Ход выполнения</a>',
+            description, bulk_action.total, reverse('admin:kb_bulkaction_change', args=[bulk_action.pk]),
+        ))
+
+
+class CustomUserAdmin(DepartmentScopedAdminMixin, UserAdmin):
     list_display = ('username', 'email', 'user_type', 'department', 'position', 'is_staff')
     list_filter = ('user_type', 'department', 'is_staff')
     fieldsets = UserAdmin.fieldsets + (
@@ -17,24 +68,19 @@ class CustomUserAdmin(UserAdmin):
     )
     search_fields = ('username', 'email', 'position')
 
-    def get_queryset(self, request):
-        qs = super().get_queryset(request)
-        if request.user.user_type == 'MANAGER':
-            return qs.filter(department=request.user.department)
-        return qs
-
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
-        if db_field.name == "department" and request.user.user_type == 'MANAGER':
-            kwargs["queryset"] = Department.objects.filter(id=request.user.department.id)
+        policy = get_policy(request)
+        if db_field.name == "department" and policy.is_manager:
+            kwargs["queryset"] = Department.objects.filter(id=policy.department_id)
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
-class DepartmentAdmin(admin.ModelAdmin):
+class DepartmentAdmin(ReplicaChangelistMixin, admin.ModelAdmin):
     list_display = ('name', 'slug', 'description')
     search_fields = ('name', 'slug', 'description')
     prepopulated_fields = {'slug': ('name',)}
     list_per_page = 20
 
-class CategoryAdmin(admin.ModelAdmin):
+class CategoryAdmin(ReplicaChangelistMixin, DepartmentScopedAdminMixin, admin.ModelAdmin):
     list_display = ('name', 'department', 'description')
     list_filter = ('department',)
     search_fields = ('name', 'department__name', 'description')
@@ -42,73 +88,156 @@ class CategoryAdmin(admin.ModelAdmin):
     raw_id_fields = ('department',)
     list_per_page = 20
 
-    def get_queryset(self, request):
-        qs = super().get_queryset(request)
-        if request.user.user_type == 'MANAGER':
-            return qs.filter(department=request.user.department)
-        return qs
+class DocumentChangeList(ChangeList):
+    """Список документов в админке без загрузки полного текста."""
+
+    def get_queryset(self, request, *args, **kwargs):
+        return super().get_queryset(request, *args, **kwargs).defer('content', 'content_html')
+
+
+class CommentCountFilter(admin.SimpleListFilter):
+    """Фильтр по числу комментариев (по индексу kb_document_comments_idx)."""
+    title = _('Комментарии')
+    parameter_name = 'comments'
+    RANGES = {
+        '0': {'comment_count': 0},
+        '1-10': {'comment_count__range': (1, 10)},
+        '11+': {'comment_count__gt': 10},
+    }
+
+    def lookups(self, request, model_admin):
+        return (
+            ('0', _('Без комментариев')),
+            ('1-10', _('От 1 до 10')),
+            ('11+', _('Больше 10')),
+        )
+
+    def queryset(self, request, queryset):
+        if self.value() in self.RANGES:
+            return queryset.filter(**self.RANGES[self.value()])
+        return queryset
+
 
-class DocumentAdmin(admin.ModelAdmin):
+class DocumentAdmin(BulkActionsMixin, LargeChangelistMixin, ReplicaChangelistMixin, DepartmentScopedAdminMixin,
+                    admin.ModelAdmin):
     list_display = ('title', 'author', 'category', 'department', 'created_at', 
                     'is_published', 'comment_count', 'file_link')
-    list_filter = ('department', 'category', 'is_published', 'created_at')
-    search_fields = ('title', 'content', 'author__username', 'category__name')
-    list_select_related = ('author', 'category', 'department')
+    list_filter = ('department', 'category', 'is_published', CommentCountFilter, 'created_at')
+    # Поиск — в get_search_results; search_fields описывают его для поля поиска
+    search_fields = ('title', 'content', 'author__username__istartswith', 'category__name__istartswith')
+    search_help_text = _('Слова из заголовка, текста и вложений; начало логина автора или названия категории.')
+    list_select_related = ('author', 'category__department', 'department')
     date_hierarchy = 'created_at'
     raw_id_fields = ('author',)
     list_per_page = 20
-    actions = ['publish_documents', 'unpublish_documents']
+    actions = ['publish_documents', 'unpublish_documents', 'move_documents']
     
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        if request.user.user_type == 'MANAGER':
-            return qs.filter(department=request.user.department)
-        elif request.user.user_type == 'EMPLOYEE':
-            return qs.filter(department=request.user.department, is_published=True)
+        policy = get_policy(request)
+        if policy.user_type == 'EMPLOYEE':
+            return qs.filter(department_id=policy.department_id, is_published=True)
         return qs
     
+    def get_changelist(self, request, **kwargs):
+        return DocumentChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        # Заголовок, текст и вложения — через индекс поискового бэкенда, автор и категория —
+        # по началу имени. Пользователи и категории — небольшие таблицы, а условия на id
+        # и внешних ключах, без JOIN, обслуживает каждое свой индекс документов
+        results = (
+            get_search_backend().filter(queryset, search_term)
+            | queryset.filter(author__in=CustomUser.objects.filter(username__istartswith=search_term))
+            | queryset.filter(category__in=Category.objects.filter(name__istartswith=search_term))
+        )
+        return results, False
+
     def comment_count(self, obj):
-        return obj.comments.count()
+        return obj.comment_count
     comment_count.short_description = _('Комментарии')
+    comment_count.admin_order_field = 'comment_count'
     
     def file_link(self, obj):
         if obj.file:
-            return format_html('<a href="{}">Скачать</a>', obj.file.url)
+            return format_html('<a href="{}">Скачать</a>', reverse('document_download', args=[obj.slug]))
         return "-"
     file_link.short_description = _('Файл')
     
     def publish_documents(self, request, queryset):
-        updated = queryset.update(is_published=True)
-        self.message_user(request, f'Опубликовано документов: {updated}')
+        self.enqueue_bulk_action(request, queryset, 'publish_documents', 'Публикация документов')
     publish_documents.short_description = _('Опубликовать выбранные документы')
-    
+
     def unpublish_documents(self, request, queryset):
-        updated = queryset.update(is_published=False)
-        self.message_user(request, f'Снято с публикации документов: {updated}')
+        self.enqueue_bulk_action(request, queryset, 'unpublish_documents', 'Снятие документов с публикации')
     unpublish_documents.short_description = _('Снять с публикации выбранные документы')
 
+    def move_documents(self, request, queryset):
+        # Промежуточная страница выбора категории отправляет форму обратно в список с тем же выбором
+        categories = get_policy(request).admin_scope(
+            Category.objects.select_related('department'), 'department',
+        ).order_by('department__name', 'name')
+        form = MoveDocumentsForm(request.POST if 'apply' in request.POST else None, categories=categories)
+        if form.is_valid():
+            category = form.cleaned_data['category']
+            self.enqueue_bulk_action(
+                request, queryset, 'move_documents', f'Перемещение документов в «{category}»',
+                {'category': category.pk},
+            )
+            return None
+        selected = request.POST.getlist(helpers.ACTION_CHECKBOX_NAME)
+        return TemplateResponse(request, 'admin/kb/move_documents.html', {
+            **self.admin_site.each_context(request),
+            'title': _('Переместить документы'),
+            'opts': self.model._meta,
+            'form': form,
+            'action': 'move_documents',
+            'selected': selected,
+            'select_across': request.POST.get('select_across', '0'),
+        })
+    move_documents.short_description = _('Переместить выбранные документы в категорию или отдел')
+
     def save_model(self, request, obj, form, change):
         if not obj.slug:
             obj.slug = slugify(obj.title)
         super().save_model(request, obj, form, change)
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(BulkActionsMixin, LargeChangelistMixin, ReplicaChangelistMixin, DepartmentScopedAdminMixin,
+                   admin.ModelAdmin):
     list_display = ('truncated_text', 'author', 'document_link', 'department', 
                    'created_at', 'is_active')
     list_filter = ('is_active', 'document__department', 'created_at')
-    search_fields = ('text', 'author__username', 'document__title')
+    # Поиск — в get_search_results; search_fields описывают его для поля поиска
+    search_fields = ('text', 'document__title', 'author__username__istartswith', 'document__slug__istartswith')
+    search_help_text = _('Слова из текста комментария или заголовка документа; начало логина автора или slug документа.')
     list_editable = ('is_active',)
     list_select_related = ('author', 'document__department')
     date_hierarchy = 'created_at'
     actions = ['restore_comments', 'deactivate_comments']
     list_per_page = 20
-    
-    def get_queryset(self, request):
-        qs = super().get_queryset(request)
-        if request.user.user_type == 'MANAGER':
-            return qs.filter(document__department=request.user.department)
-        return qs
-    
+    department_field = 'document__department'
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        # Текст комментария и заголовок документа — через индекс поискового бэкенда,
+        # автор и slug документа — по началу (см. DocumentAdmin.get_search_results).
+        # Slug всегда в нижнем регистре; префикс задан диапазоном, его обслуживает уникальный индекс
+        backend = get_search_backend()
+        prefix = search_term.lower()
+        documents = (
+            backend.filter_titles(Document.objects.all(), search_term)
+            | Document.objects.filter(slug__gte=prefix, slug__lt=prefix + '\uffff')
+        )
+        results = (
+            backend.filter_comments(queryset, search_term)
+            | queryset.filter(document__in=documents)
+            | queryset.filter(author__in=CustomUser.objects.filter(username__istartswith=search_term))
+        )
+        return results, False
+
     def truncated_text(self, obj):
         return obj.text[:50] + '...' if len(obj.text) > 50 else obj.text
     truncated_text.short_description = _('Текст комментария')
@@ -124,17 +253,55 @@ class CommentAdmin(admin.ModelAdmin):
     department.short_description = _('Департамент')
     
     def restore_comments(self, request, queryset):
-        updated = queryset.update(is_active=True)
-        self.message_user(request, f'Восстановлено комментариев: {updated}')
+        self.enqueue_bulk_action(request, queryset, 'restore_comments', 'Восстановление комментариев')
     restore_comments.short_description = _('Восстановить выбранные комментарии')
-    
+
     def deactivate_comments(self, request, queryset):
-        updated = queryset.update(is_active=False)
-        self.message_user(request, f'Деактивировано комментариев: {updated}')
+        self.enqueue_bulk_action(request, queryset, 'deactivate_comments', 'Деактивация комментариев')
     deactivate_comments.short_description = _('Деактивировать выбранные комментарии')
 
+
+class BulkActionAdmin(admin.ModelAdmin):
+    """Ход выполнения массовых действий; страница обновляется, пока есть незавершенные."""
+    list_display = ('description', 'created_by', 'status', 'progress', 'changed', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    list_select_related = ('created_by',)
+    readonly_fields = (
+        'description', 'action', 'params', 'created_by', 'status', 'progress', 'total', 'processed',
+        'changed', 'last_error', 'created_at', 'started_at', 'finished_at',
+    )
+    exclude = ('lease_until',)
+    actions = ['cancel_bulk_actions']
+    list_per_page = 20
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request)
+        # Администратор видит все действия, остальные — только свои
+        if request.user.is_superuser or get_policy(request).is_admin:
+            return qs
+        return qs.filter(created_by_id=request.user.pk)
+
+    def has_add_permission(self, request):
+        return False
+
+    def progress(self, obj):
+        return format_html('<progress max="100" value="{}"></progress> {}%', obj.percent, obj.percent)
+    progress.short_description = _('Выполнено')
+
+    def cancel_bulk_actions(self, request, queryset):
+        cancelled = bulk.cancel(queryset)
+        self.message_user(request, f'Отменено действий: {cancelled}')
+    cancel_bulk_actions.short_description = _('Отменить выбранные действия')
+    cancel_bulk_actions.allowed_permissions = ('change',)
+
+    def changelist_view(self, request, extra_context=None):
+        active = self.get_queryset(request).filter(status__in=BulkAction.ACTIVE).exists()
+        return super().changelist_view(request, {**(extra_context or {}), 'refresh': active})
+
+
 admin.site.register(CustomUser, CustomUserAdmin)
 admin.site.register(Department, DepartmentAdmin)
 admin.site.register(Category, CategoryAdmin)
 admin.site.register(Document, DocumentAdmin)
-admin.site.register(Comment, CommentAdmin)
\ No newline at end of file
+admin.site.register(Comment, CommentAdmin)
+admin.site.register(BulkAction, BulkActionAdmin)
\ No newline at end of file
@@ -0,0 +1,320 @@
+"""Нагрузочные замеры (команды ``benchmark_servers`` и ``benchmark_views``).
+
+Серверы запускаются отдельными процессами gunicorn с теми же настройками,
+что и в эксплуатации; клиенты — корутины asyncio с минимальным клиентом
+HTTP/1.0, чтобы медленное чтение ответа управлялось точно: медленный клиент
+читает тело с ограниченной скоростью и маленьким буфером сокета, как
+мобильный браузер, и держит соединение занятым. Для замеров без сети
+страницы вызываются тестовым клиентом Django в текущем процессе, вместе
+с подсчетом SQL-запросов.
+"""
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from importlib import import_module
+from urllib.parse import quote, urlencode
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+HOST = '127.0.0.1'
+READ_SIZE = 16 * 1024
+
+
+@dataclass
+class Result:
+    status: int
+    elapsed: float
+    size: int
+    error: str = ''
+
+    @property
+    def ok(self):
+        return 200 <= self.status < 400 and not self.error
+
+
+@dataclass
+class Endpoint:
+    name: str
+    path: str
+    method: str = 'GET'
+    data: dict = field(default_factory=dict)
+    # Запрос от имени администратора (страницы админки)
+    admin: bool = False
+
+
+def create_session(user):
+    """Сессия с вошедшим пользователем: замерам не нужен пароль и страница входа."""
+    session = import_module(settings.SESSION_ENGINE).SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.save()
+    return session
+
+
+def database_url(settings_dict):
+    """URL для DATABASE_URL процесса сервера по настройкам соединения."""
+    engine = settings_dict['ENGINE'].rsplit('.', 1)[-1]
+    if engine == 'sqlite3':
+        return f"sqlite:///{settings_dict['NAME']}"
+    scheme = {'postgresql': 'postgres', 'mysql': 'mysql'}[engine]
+    credentials = quote(settings_dict['USER'] or '', safe='')
+    if settings_dict['PASSWORD']:
+        credentials += ':' + quote(settings_dict['PASSWORD'], safe='')
+    host = settings_dict['HOST'] or 'localhost'
+    port = f":{settings_dict['PORT']}" if settings_dict['PORT'] else ''
+    return f"{scheme}://{credentials}@{host}{port}/{settings_dict['NAME']}"
+
+
+async def fetch(port, path, cookie, rate=None, timeout=60.0, receive_buffer=None,
+                method='GET', body=b'', headers=None):
+    """HTTP-запрос; ``rate`` — скорость чтения тела в байтах в секунду."""
+    started = time.perf_counter()
+    writer = None
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if receive_buffer:
+            # Иначе ядро примет в буфер несколько мегабайт и сервер не заметит медленного клиента
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+        sock.setblocking(False)
+        await asyncio.wait_for(asyncio.get_running_loop().sock_connect(sock, (HOST, port)), timeout)
+        reader, writer = await asyncio.open_connection(sock=sock)
+        lines = [f'{method} {path} HTTP/1.0', f'Host: {HOST}:{port}', f'Cookie: {cookie}']
+        lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+        if body:
+            lines.append(f'Content-Length: {len(body)}')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + body)
+        await writer.drain()
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout)
+        status = int(head.split(b' ', 2)[1])
+        size = 0
+        while chunk := await asyncio.wait_for(reader.read(READ_SIZE), timeout):
+            size += len(chunk)
+            if rate:
+                await asyncio.sleep(len(chunk) / rate)
+        return Result(status, time.perf_counter() - started, size)
+    except (OSError, ValueError, IndexError, asyncio.TimeoutError, asyncio.IncompleteReadError) as error:
+        return Result(0, time.perf_counter() - started, 0, type(error).__name__)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[percent - 1]
+
+
+class Server:
+    """Процесс gunicorn на свободном порту."""
+
+    def __init__(self, name, args, settings_module, cwd, env=None):
+        self.name = name
+        self.args = args
+        self.settings_module = settings_module
+        self.cwd = cwd
+        self.env = env or {}
+        self.port = None
+        self.process = None
+
+    def start(self, timeout=30):
+        with socket.socket() as sock:
+            sock.bind((HOST, 0))
+            self.port = sock.getsockname()[1]
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=self.settings_module, **self.env)
+        env['KB_BIND'] = f'{HOST}:{self.port}'
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', *self.args, '--bind', env['KB_BIND']],
+            cwd=self.cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'{self.name}: сервер завершился с кодом {self.process.returncode}')
+            try:
+                socket.create_connection((HOST, self.port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f'{self.name}: сервер не запустился за {timeout} с')
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+    def rss(self):
+        """Суммарная резидентная память мастера и воркеров в байтах (только Linux)."""
+        if not os.path.isdir('/proc'):
+            return None
+        pids = {self.process.pid}
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat') as stat:
+                    # Имя процесса в скобках может содержать пробелы
+                    ppid = int(stat.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            if ppid == self.process.pid:
+                pids.add(int(entry))
+        return sum(process_rss(pid) or 0 for pid in pids)
+
+
+def process_rss(pid='self'):
+    """Резидентная память процесса в байтах или None (только Linux)."""
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+async def sample_rss(server, stop, interval=0.2):
+    peak = 0
+    while not stop.is_set():
+        peak = max(peak, server.rss() or 0)
+        await asyncio.sleep(interval)
+    return peak or None
+
+
+async def slow_clients_scenario(server, cookie, download_path, probe_path, clients, rate, duration):
+    """Медленные клиенты скачивают вложение, а быстрый клиент тем временем
+    запрашивает список документов: замеряются задержки быстрых запросов."""
+    slow = [
+        asyncio.create_task(fetch(server.port, download_path, cookie, rate=rate, receive_buffer=64 * 1024))
+        for _ in range(clients)
+    ]
+    # Даем медленным клиентам занять соединения
+    await asyncio.sleep(1)
+    probes = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        probes.append(await fetch(server.port, probe_path, cookie, timeout=max(deadline - time.monotonic(), 1)))
+    for task in slow:
+        task.cancel()
+    await asyncio.gather(*slow, return_exceptions=True)
+    latencies = [result.elapsed * 1000 for result in probes if result.ok]
+    return {
+        'probes': len(probes),
+        'probe_errors': sum(not result.ok for result in probes),
+        'probe_p50_ms': percentile(latencies, 50),
+        'probe_p95_ms': percentile(latencies, 95),
+    }
+
+
+async def download_scenario(server, cookie, download_path, downloads, concurrency):
+    """Параллельные скачивания большого вложения на полной скорости."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            return await fetch(server.port, download_path, cookie, timeout=300)
+
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_rss(server, stop))
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one() for _ in range(downloads)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    peak = await sampler
+    durations = [result.elapsed for result in results if result.ok]
+    transferred = sum(result.size for result in results if result.ok)
+    return {
+        'downloads': downloads,
+        'download_errors': sum(not result.ok for result in results),
+        'throughput_mb_s': transferred / elapsed / 2 ** 20 if elapsed else None,
+        'download_p50_s': percentile(durations, 50),
+        'download_p95_s': percentile(durations, 95),
+        'peak_rss_mb': peak / 2 ** 20 if peak else None,
+    }
+
+
+def summarize(latencies, errors, elapsed, queries=None, peak_rss=None):
+    """Сводка замера одной страницы; задержки в секундах."""
+    milliseconds = [value * 1000 for value in latencies]
+    summary = {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'p50_ms': percentile(milliseconds, 50),
+        'p95_ms': percentile(milliseconds, 95),
+        'p99_ms': percentile(milliseconds, 99),
+        'mean_ms': statistics.fmean(milliseconds) if milliseconds else None,
+        'throughput_rps': len(latencies) / elapsed if elapsed else None,
+        'peak_rss_mb': peak_rss / 2 ** 20 if peak_rss else None,
+    }
+    if queries is not None:
+        summary['queries'] = statistics.median(queries) if queries else None
+        summary['queries_max'] = max(queries, default=None)
+    return summary
+
+
+def measure_client(client, endpoint, iterations, warmup=3, before_request=None):
+    """Последовательные запросы тестовым клиентом в текущем процессе."""
+    request = getattr(client, endpoint.method.lower())
+    for _ in range(warmup):
+        request(endpoint.path, endpoint.data)
+    latencies, queries, errors, peak = [], [], 0, 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        if before_request:
+            before_request()
+        with CaptureQueriesContext(connection) as context:
+            request_started = time.perf_counter()
+            response = request(endpoint.path, endpoint.data)
+            elapsed = time.perf_counter() - request_started
+        if response.status_code >= 400:
+            errors += 1
+        else:
+            latencies.append(elapsed)
+            queries.append(len(context.captured_queries))
+        peak = max(peak, process_rss() or 0)
+    return summarize(latencies, errors, time.perf_counter() - started, queries, peak)
+
+
+async def measure_server(server, endpoint, cookie, concurrency, requests, headers=None):
+    """``requests`` запросов от ``concurrency`` виртуальных пользователей."""
+    body = b''
+    headers = dict(headers or {})
+    if endpoint.method == 'POST':
+        body = urlencode(endpoint.data).encode()
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    remaining = iter(range(requests))
+    results = []
+
+    async def virtual_user():
+        while next(remaining, None) is not None:
+            results.append(await fetch(
+                server.port, endpoint.path, cookie, method=endpoint.method, body=body, headers=headers,
+            ))
+
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_rss(server, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(virtual_user() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    return summarize(
+        [result.elapsed for result in results if result.ok],
+        sum(not result.ok for result in results), elapsed, peak_rss=await sampler,
+    )
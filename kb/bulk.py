@@ -0,0 +1,167 @@
+"""Массовые действия админки в фоне.
+
+Действие над выбранными документами или комментариями не выполняется одним
+UPDATE в запросе админки: на большой выборке это держит блокировку записи
+SQLite и останавливает добавление комментариев. Вместо этого ``enqueue``
+сохраняет id выбранных объектов частями по ``KB_BULK_ACTION_BATCH_SIZE``, а
+команда ``run_bulk_actions`` применяет действие к каждой части в отдельной
+короткой транзакции, делая паузу ``KB_BULK_ACTION_PAUSE`` между частями.
+Прогресс виден в админке (``BulkAction``); отмененное действие
+останавливается перед следующей частью, уже обработанные части остаются.
+"""
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .cache import bump_version
+from .models import BulkAction, BulkActionChunk, Category, Comment, Document
+from .queue import LEASE, claim as claim_rows
+
+
+class Cancelled(Exception):
+    """Действие отменено, пока обрабатывалась часть."""
+
+
+def batch_size():
+    return getattr(settings, 'KB_BULK_ACTION_BATCH_SIZE', 500)
+
+
+def pause():
+    return getattr(settings, 'KB_BULK_ACTION_PAUSE', 0.05)
+
+
+# === Операции ===
+# Принимают id части и параметры действия, возвращают число измененных
+# объектов и отделы, чей кэш нужно сбросить (update() не отправляет сигналы).
+
+def set_published(is_published):
+    def apply(ids, params):
+        documents = Document.objects.filter(pk__in=ids).exclude(is_published=is_published)
+        departments = set(documents.values_list('department_id', flat=True))
+        return documents.update(is_published=is_published), departments
+    return apply
+
+
+def set_comments_active(is_active):
+    def apply(ids, params):
+        comments = Comment.objects.filter(pk__in=ids)
+        departments = set(comments.exclude(is_active=is_active).values_list('document__department_id', flat=True))
+        return comments.set_active(is_active), departments
+    return apply
+
+
+def move_documents(ids, params):
+    # Категория принадлежит отделу: документ переезжает в ее отдел
+    category = Category.objects.get(pk=params['category'])
+    documents = Document.objects.filter(pk__in=ids).exclude(category=category)
+    departments = set(documents.values_list('department_id', flat=True)) | {category.department_id}
+    return documents.update(category=category, department_id=category.department_id), departments
+
+
+OPERATIONS = {
+    'publish_documents': set_published(True),
+    'unpublish_documents': set_published(False),
+    'restore_comments': set_comments_active(True),
+    'deactivate_comments': set_comments_active(False),
+    'move_documents': move_documents,
+}
+
+
+def enqueue(action, queryset, user, description, params=None):
+    """Ставит действие над объектами queryset в очередь и возвращает BulkAction."""
+    if action not in OPERATIONS:
+        raise ValueError(f'Неизвестное массовое действие: {action!r}')
+    # id читаются до транзакции: блокировка записи держится только на время вставки
+    ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+    size = batch_size()
+    with transaction.atomic():
+        bulk_action = BulkAction.objects.create(
+            action=action, params=params or {}, description=description,
+            created_by=user if user and user.pk else None, total=len(ids),
+        )
+        BulkActionChunk.objects.bulk_create(
+            [BulkActionChunk(bulk_action=bulk_action, ids=ids[start:start + size])
+             for start in range(0, len(ids), size)],
+            batch_size=100,
+        )
+    return bulk_action
+
+
+def cancel(queryset):
+    """Отменяет еще не завершенные действия; возвращает их число."""
+    return queryset.filter(status__in=BulkAction.ACTIVE).update(
+        status=BulkAction.CANCELLED, finished_at=timezone.now(), lease_until=None,
+    )
+
+
+def purge_chunks():
+    """Удаляет части завершенных, отмененных и упавших действий небольшими порциями."""
+    stale = BulkActionChunk.objects.exclude(bulk_action__status__in=BulkAction.ACTIVE)
+    removed = 0
+    while ids := list(stale.values_list('pk', flat=True)[:100]):
+        removed += BulkActionChunk.objects.filter(pk__in=ids).delete()[0]
+    return removed
+
+
+def claim():
+    """Забирает следующее действие из очереди (или брошенное упавшим воркером)."""
+    now = timezone.now()
+    queryset = BulkAction.objects.filter(
+        Q(status=BulkAction.PENDING) | Q(status=BulkAction.RUNNING, lease_until__lt=now),
+    ).order_by('created_at', 'id')
+    # Аренда продлевается с каждой частью; если воркер упал, действие вернется в очередь
+    rows = claim_rows(
+        queryset, 1, status=BulkAction.RUNNING, started_at=Coalesce('started_at', now), lease_until=now + LEASE,
+    )
+    return BulkAction.objects.get(pk=rows[0][0]) if rows else None
+
+
+def process_chunk(bulk_action, chunk):
+    """Применяет действие к одной части в одной транзакции; возвращает отделы."""
+    operation = OPERATIONS[bulk_action.action]
+    with transaction.atomic():
+        changed, departments = operation(chunk.ids, bulk_action.params)
+        chunk.delete()
+        # Прогресс пишется в той же транзакции; отмена откатывает обработку части
+        if not BulkAction.objects.filter(pk=bulk_action.pk, status=BulkAction.RUNNING).update(
+            processed=F('processed') + len(chunk.ids), changed=F('changed') + changed,
+            lease_until=timezone.now() + LEASE,
+        ):
+            raise Cancelled
+    return departments
+
+
+def run(bulk_action):
+    """Выполняет забранное действие до конца или до отмены; возвращает его статус."""
+    while True:
+        chunk = bulk_action.chunks.order_by('pk').first()
+        if chunk is None:
+            status = BulkAction.DONE
+            break
+        try:
+            departments = process_chunk(bulk_action, chunk)
+        except Cancelled:
+            status = BulkAction.CANCELLED
+            break
+        except Exception as exc:
+            BulkAction.objects.filter(pk=bulk_action.pk, status=BulkAction.RUNNING).update(
+                status=BulkAction.FAILED, last_error=f'{type(exc).__name__}: {exc}',
+                finished_at=timezone.now(), lease_until=None,
+            )
+            purge_chunks()
+            raise
+        bump_version(*departments)
+        # Между частями блокировка записи свободна: ждущие запросы успевают записать
+        time.sleep(pause())
+
+    BulkAction.objects.filter(pk=bulk_action.pk, status=BulkAction.RUNNING).update(
+        status=status, finished_at=timezone.now(), lease_until=None,
+    )
+    # Необработанные части отмененного действия больше не нужны
+    purge_chunks()
+    bulk_action.refresh_from_db()
+    return bulk_action.status
@@ -0,0 +1,109 @@
+"""Кэш фрагментов страниц с версиями по отделам.
+
+У каждого отдела есть счетчик версии; он входит в ключ всех фрагментов
+отдела. Любое изменение документов, комментариев или категорий отдела
+увеличивает счетчик (O(1)), и старые фрагменты просто перестают читаться,
+истекая по таймауту. Общий счетчик ``all`` увеличивается при любом
+изменении и используется для выборок по всем отделам (администраторы).
+Счетчики должны быть общими для всех воркеров, поэтому кэш в настройках —
+файловый или сервер кэша, а не память процесса.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+from .routers import current_replica, replica_lag, replicas
+
+GLOBAL_SCOPE = 'all'
+
+
+def get_cache():
+    return caches[getattr(settings, 'KB_CACHE_ALIAS', 'default')]
+
+
+def _version_key(scope):
+    return f'kb:version:{scope}'
+
+
+def _bumped_key(scope):
+    return f'kb:bumped:{scope}'
+
+
+def get_version(scope):
+    cache = get_cache()
+    version = cache.get(_version_key(scope))
+    if version is None:
+        # Начальное значение — время, а не 1: после вытеснения счетчика
+        # из кэша новая версия не совпадет ни с одной из прежних.
+        cache.add(_version_key(scope), time.time_ns(), None)
+        version = cache.get(_version_key(scope))
+    return version
+
+
+async def aget_version(scope):
+    cache = get_cache()
+    version = await cache.aget(_version_key(scope))
+    if version is None:
+        await cache.aadd(_version_key(scope), time.time_ns(), None)
+        version = await cache.aget(_version_key(scope))
+    return version
+
+
+def bump_scope(scope):
+    cache = get_cache()
+    try:
+        cache.incr(_version_key(scope))
+    except ValueError:
+        cache.set(_version_key(scope), time.time_ns(), None)
+    if replicas():
+        # Отметка «недавно изменялся» живет окно отставания реплик
+        cache.set(_bumped_key(scope), True, replica_lag())
+
+
+def bump_version(*department_ids):
+    """Инвалидирует фрагменты указанных отделов и общие фрагменты."""
+    for scope in {*department_ids, GLOBAL_SCOPE} - {None}:
+        bump_scope(scope)
+
+
+def _fragment_key(scope, version, name, parts):
+    digest = hashlib.md5(repr(parts).encode()).hexdigest()
+    return f'kb:fragment:{scope}:{version}:{name}:{digest}'
+
+
+def cached_fragment(scope, name, parts, builder):
+    """Значение фрагмента ``name`` для отдела ``scope``; ``builder`` вызывается при промахе.
+
+    ``parts`` — все, от чего еще зависит фрагмент (параметры запроса и т.п.).
+    """
+    cache = get_cache()
+    key = _fragment_key(scope, get_version(scope), name, parts)
+    value = cache.get(key)
+    metrics.inc('kb_fragment_cache_requests_total', fragment=name, result='miss' if value is None else 'hit')
+    if value is None:
+        value = builder()
+        timeout = getattr(settings, 'KB_FRAGMENT_CACHE_TIMEOUT', 600)
+        # Фрагмент, собранный по реплике вскоре после изменения, может его не содержать:
+        # такой живет не дольше окна отставания
+        if current_replica() and cache.get(_bumped_key(scope)):
+            timeout = replica_lag()
+        cache.set(key, value, timeout)
+    return value
+
+
+async def acached_fragment(scope, name, parts, builder):
+    """Асинхронный cached_fragment: ``builder`` — корутинная функция."""
+    cache = get_cache()
+    key = _fragment_key(scope, await aget_version(scope), name, parts)
+    value = await cache.aget(key)
+    metrics.inc('kb_fragment_cache_requests_total', fragment=name, result='miss' if value is None else 'hit')
+    if value is None:
+        value = await builder()
+        timeout = getattr(settings, 'KB_FRAGMENT_CACHE_TIMEOUT', 600)
+        if current_replica() and await cache.aget(_bumped_key(scope)):
+            timeout = replica_lag()
+        await cache.aset(key, value, timeout)
+    return value
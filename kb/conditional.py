@@ -0,0 +1,94 @@
+"""ETag и Last-Modified для условных GET-запросов.
+
+Состояние документа читается одним запросом (без рендеринга страницы) и
+запоминается в request, так что функции для ETag и Last-Modified не
+повторяют выборку. Если доступа к документу нет, ETag не вычисляется и
+view отвечает как обычно (403/404), не раскрывая состояние документа.
+Для async-представлений те же значения вычисляет ``adocument_validators``.
+"""
+import hashlib
+
+from django.conf import settings
+from django.contrib import messages
+from django.db.models import OuterRef, Subquery
+
+from .access import get_policy
+from .cache import aget_version, get_version
+from .models import Comment, Document
+from .rendering import renderer_key
+
+
+def _state_query(slug):
+    # Подзапрос читает одну запись индекса активных комментариев, а не все комментарии документа
+    last_comment = (
+        Comment.objects.filter(document=OuterRef('pk'), is_active=True)
+        .order_by('-created_at', '-id').values('created_at')[:1]
+    )
+    return (
+        Document.objects.filter(slug=slug)
+        .annotate(last_comment_at=Subquery(last_comment))
+        .values(
+            'id', 'updated_at', 'is_published', 'department_id',
+            'last_comment_at', 'comment_count',
+        )
+    )
+
+
+def document_state(request, slug):
+    if not hasattr(request, '_kb_document_state'):
+        request._kb_document_state = _state_query(slug).first()
+    return request._kb_document_state
+
+
+async def adocument_state(request, slug):
+    if not hasattr(request, '_kb_document_state'):
+        request._kb_document_state = await _state_query(slug).afirst()
+    return request._kb_document_state
+
+
+def _visible(request, state):
+    return state is not None and get_policy(request).can_view(state['department_id'], state['is_published'])
+
+
+def _last_modified(state):
+    return max(filter(None, [state['updated_at'], state['last_comment_at']]))
+
+
+def _etag(request, state, department_version):
+    # Страница с ожидающими сообщениями должна быть отрисована, иначе они потеряются
+    if len(messages.get_messages(request)):
+        return None
+    policy = get_policy(request)
+    parts = [
+        state['id'], state['updated_at'], state['last_comment_at'], state['comment_count'],
+        # Категории и названия отдела попадают на страницу и меняют версию отдела
+        department_version,
+        # Уровень прав: от него зависят кнопки на странице
+        policy.user_id, policy.user_type, policy.department_id, policy.can_manage_documents,
+        # Страница содержит CSRF-токен, привязанный к секрету из cookie
+        request.META.get('CSRF_COOKIE'),
+        renderer_key(), getattr(settings, 'KB_ETAG_VERSION', ''),
+    ]
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def document_last_modified(request, slug):
+    state = document_state(request, slug)
+    return _last_modified(state) if _visible(request, state) else None
+
+
+def document_etag(request, slug):
+    state = document_state(request, slug)
+    if not _visible(request, state):
+        return None
+    return _etag(request, state, get_version(state['department_id']))
+
+
+async def adocument_validators(request, slug):
+    """``(etag, last_modified)`` для async-представления; политика должна быть
+    уже загружена (см. ``aget_policy``)."""
+    state = await adocument_state(request, slug)
+    if not _visible(request, state):
+        return None, None
+    etag = _etag(request, state, await aget_version(state['department_id']))
+    return etag, _last_modified(state)
@@ -0,0 +1,349 @@
+"""Синтетический корпус документов для замеров производительности.
+
+Корпус детерминирован: один и тот же ``CorpusSpec`` (включая seed) дает те
+же отделы, пользователей, документы и комментарии, поэтому замеры на разных
+коммитах сравнимы. Распределения похожи на рабочие: размеры отделов и
+популярность документов подчиняются закону Ципфа (несколько больших отделов
+и обсуждаемых документов, длинный хвост), заголовки смешивают кириллицу и
+латиницу, даты растянуты на несколько лет.
+
+Строки вставляются пачками (комментарии — прямым executemany), каждая
+пачка документов с их комментариями в своей транзакции, поэтому память не растет с размером корпуса. Слаги выдает
+``SlugAllocator`` (без запроса к БД на каждый документ), счетчики
+комментариев и анонсы вычисляются здесь же, как при импорте. Без
+``render_html`` HTML документов не рендерится: он построится и сохранится
+при первом просмотре (см. ``Document.get_content_html``).
+"""
+import random
+import struct
+import zlib
+from bisect import bisect
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import accumulate, islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.db.models import F
+
+from .cache import bump_version
+from .importing import SlugAllocator
+from .models import (
+    AttachmentPreview, AttachmentText, Blob, Category, Comment, CustomUser, Department, Document,
+)
+from .previews import known_digest
+from .storage import attachment_storage
+
+USERNAME_PREFIX = 'bench'
+ADMIN_USERNAME = f'{USERNAME_PREFIX}-admin'
+DEPARTMENT_PREFIX = f'{USERNAME_PREFIX}-department-'
+
+WORDS = (
+    'отчет', 'инструкция', 'регламент', 'договор', 'поставка', 'склад', 'клиент', 'заявка',
+    'бюджет', 'проект', 'сервер', 'доступ', 'пароль', 'отпуск', 'график', 'приказ', 'счет',
+    'оплата', 'налог', 'аудит', 'качество', 'обучение', 'совещание', 'протокол', 'шаблон',
+    'policy', 'release', 'backup', 'deploy', 'invoice', 'roadmap', 'onboarding', 'security',
+    'квартал', 'годовой', 'новый', 'срочный', 'внутренний', 'основной', 'временный',
+    'ERP', 'VPN', 'CRM', '1С', 'API', 'SLA', 'KPI', 'Jira', 'Confluence', 'Wi-Fi',
+)
+
+# Даты фиксированы, а не отсчитываются от текущего момента: иначе корпус не детерминирован
+START = datetime(2022, 1, 1, tzinfo=dt_timezone.utc)
+END = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+# Готовые тексты выбираются из пула: генерация текста на каждую строку дороже вставки
+TEXT_POOL = 2000
+PUBLISHED_SHARE = 0.9
+ACTIVE_SHARE = 0.95
+# Среднее время до комментария после публикации, дней
+COMMENT_DELAY_DAYS = 20
+# Различных файлов-вложений: одинаковые вложения хранятся одним blob
+ATTACHMENT_VARIANTS = 50
+
+
+class CorpusExists(Exception):
+    """В БД уже есть корпус: имена отделов и пользователей заняты."""
+
+
+@dataclass(frozen=True)
+class CorpusSpec:
+    departments: int = 5
+    categories: int = 4  # в каждом отделе
+    users: int = 10  # в среднем на отдел
+    documents: int = 2000
+    comments: int = 20000
+    seed: int = 1
+    # Показатели степени закона Ципфа: 0 — равномерно
+    department_skew: float = 1.0
+    comment_skew: float = 1.1
+    # Доля документов с вложением
+    attachments: float = 0.0
+
+    def as_dict(self):
+        return asdict(self)
+
+
+def zipf_weights(count, exponent):
+    return [1 / rank ** exponent for rank in range(1, count + 1)]
+
+
+def split(total, weights, minimum=0):
+    """Делит ``total`` пропорционально весам (сумма может немного отличаться)."""
+    scale = total / sum(weights)
+    return [max(minimum, round(weight * scale)) for weight in weights]
+
+
+def _png(rng):
+    width, height = rng.randint(200, 800), rng.randint(150, 600)
+    row = b'\x00' + bytes(rng.randrange(256) for _ in range(3)) * width
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    return b''.join((
+        b'\x89PNG\r\n\x1a\n',
+        chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)),
+        chunk(b'IDAT', zlib.compress(row * height)),
+        chunk(b'IEND', b''),
+    ))
+
+
+def _pdf(rng):
+    text = ' '.join(rng.choice(WORDS[25:33]) for _ in range(8))
+    stream = f'BT /F1 18 Tf 40 700 Td ({text}) Tj ET'.encode()
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+        b'/Resources << /Font << /F1 5 0 R >> >> /Contents 4 0 R >>',
+        b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    body, offsets = b'%PDF-1.4\n', []
+    for number, content in enumerate(objects, 1):
+        offsets.append(len(body))
+        body += b'%d 0 obj\n%s\nendobj\n' % (number, content)
+    xref = len(body)
+    body += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    body += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    return body + b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    """Отключает auto_now/auto_now_add: даты корпуса задаются явно."""
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class CorpusGenerator:
+    """Заполняет БД корпусом по ``spec``; ``progress(модель, строк)`` вызывается после пачек."""
+
+    def __init__(self, spec, batch_size=1000, render_html=True, progress=None):
+        self.spec = spec
+        self.batch_size = batch_size
+        self.render_html = render_html
+        self.progress = progress or (lambda model, rows: None)
+        self.rng = random.Random(spec.seed)
+        self.counts = dict.fromkeys(('departments', 'categories', 'users', 'documents', 'comments'), 0)
+
+    def run(self):
+        if Department.objects.filter(slug__startswith=DEPARTMENT_PREFIX).exists():
+            raise CorpusExists('Корпус уже создан в этой БД')
+        rng = self.rng
+        self.texts = [self.sentence(rng.randint(5, 30)) for _ in range(TEXT_POOL)]
+        self.paragraphs = [
+            '. '.join(self.sentence(rng.randint(6, 14)) for _ in range(rng.randint(2, 5))) + '.'
+            for _ in range(TEXT_POOL)
+        ]
+
+        with transaction.atomic():
+            self.create_departments()
+            self.create_users()
+        self.files = self.create_files() if self.spec.attachments > 0 else []
+        self.references = {}
+
+        # Ранг популярности документа случаен и не связан с датой создания
+        self.ranks = list(range(self.spec.documents))
+        rng.shuffle(self.ranks)
+        weights = zipf_weights(self.spec.documents, self.spec.comment_skew)
+        self.comment_scale = self.spec.comments / sum(weights) if weights else 0
+        self.slugs = SlugAllocator()
+
+        with explicit_timestamps(Document._meta.get_field('created_at'), Document._meta.get_field('updated_at')):
+            for start in range(0, self.spec.documents, self.batch_size):
+                with transaction.atomic():
+                    self.create_documents(range(start, min(start + self.batch_size, self.spec.documents)))
+        self.register_files()
+
+        bump_version(*(department.pk for department in self.departments))
+        return dict(self.counts)
+
+    def words(self, count):
+        return ' '.join(self.rng.choices(WORDS, k=count))
+
+    def sentence(self, count):
+        # str.capitalize() испортил бы аббревиатуры: «SLA» превратилось бы в «Sla»
+        words = self.words(count)
+        return words[0].upper() + words[1:]
+
+    def insert_rows(self, model, fields, rows):
+        """Вставляет кортежи значений пачками через executemany.
+
+        Для самой большой таблицы построение объектов моделей и SQL в
+        bulk_create обходится дороже самой вставки.
+        """
+        quote = connection.ops.quote_name
+        columns = ', '.join(quote(model._meta.get_field(name).column) for name in fields)
+        sql = f"INSERT INTO {quote(model._meta.db_table)} ({columns}) VALUES ({', '.join(['%s'] * len(fields))})"
+        total = 0
+        with connection.cursor() as cursor:
+            while batch := list(islice(rows, self.batch_size)):
+                cursor.executemany(sql, batch)
+                total += len(batch)
+        return total
+
+    def create_departments(self):
+        spec, rng = self.spec, self.rng
+        self.departments = Department.objects.bulk_create([
+            Department(name=f'Отдел {number}', slug=f'{DEPARTMENT_PREFIX}{number}')
+            for number in range(1, spec.departments + 1)
+        ])
+        self.department_weights = list(accumulate(zipf_weights(spec.departments, spec.department_skew)))
+        categories = Category.objects.bulk_create([
+            Category(name=f'{self.sentence(2)} {number}', department=department)
+            for department in self.departments for number in range(1, spec.categories + 1)
+        ])
+        self.categories = {}
+        for category in categories:
+            self.categories.setdefault(category.department_id, []).append(category)
+        self.counts['departments'] = len(self.departments)
+        self.counts['categories'] = len(categories)
+
+    def create_users(self):
+        spec = self.spec
+        # Вход в корпус — через сессию (force_login), пароль не нужен; хеширование медленное
+        password = make_password(None)
+        sizes = split(
+            spec.users * spec.departments, zipf_weights(spec.departments, spec.department_skew), minimum=1,
+        )
+        users = CustomUser.objects.bulk_create([
+            CustomUser(
+                username=f'{USERNAME_PREFIX}-{department.pk}-{number}', password=password,
+                department=department, user_type='MANAGER' if number == 1 else 'EMPLOYEE',
+            )
+            for department, size in zip(self.departments, sizes) for number in range(1, size + 1)
+        ] + [CustomUser(
+            username=ADMIN_USERNAME, password=password, user_type='ADMIN', is_staff=True, is_superuser=True,
+        )], batch_size=self.batch_size)
+        self.users = {}
+        for user in users:
+            self.users.setdefault(user.department_id, []).append(user)
+        self.counts['users'] = len(users)
+        self.progress('users', len(users))
+
+    def create_files(self):
+        files = []
+        for number in range(ATTACHMENT_VARIANTS):
+            if number % 2:
+                content, extension = _pdf(self.rng), '.pdf'
+            else:
+                content, extension = _png(self.rng), '.png'
+            name = attachment_storage.save(f'corpus{extension}', ContentFile(content))
+            files.append((name, extension, len(content)))
+        return files
+
+    def comment_total(self, index):
+        expected = self.comment_scale / (self.ranks[index] + 1) ** self.spec.comment_skew
+        whole = int(expected)
+        return whole + (self.rng.random() < expected - whole)
+
+    def document(self, index):
+        rng, spec = self.rng, self.spec
+        department = self.departments[bisect(self.department_weights, rng.random() * self.department_weights[-1])]
+        # Документы создаются по порядку дат, как в рабочей базе
+        step = (END - START) / spec.documents
+        created_at = START + step * index + step * rng.random()
+        active = [rng.random() < ACTIVE_SHARE for _ in range(self.comment_total(index))]
+
+        title = self.sentence(rng.randint(3, 7))
+        if rng.random() < 0.2:
+            title += f' {rng.randint(2019, 2025)}'
+        document = Document(
+            title=title,
+            slug=self.slugs.allocate(title),
+            content='\n\n'.join(rng.choices(self.paragraphs, k=rng.randint(2, 8))),
+            author=rng.choice(self.users[department.pk]),
+            category=rng.choice(self.categories[department.pk]),
+            department=department,
+            is_published=rng.random() < PUBLISHED_SHARE,
+            comment_count=sum(active),
+            created_at=created_at,
+            updated_at=min(END, created_at + timedelta(days=rng.expovariate(1 / 30))),
+        )
+        if self.files and rng.random() < spec.attachments:
+            name, extension, _ = rng.choice(self.files)
+            document.file = name
+            document.file_name = document.slug + extension
+            self.references[name] = self.references.get(name, 0) + 1
+        document.update_excerpt()
+        if self.render_html:
+            document.render_content()
+        return document, active
+
+    def comment_rows(self, generated):
+        rng = self.rng
+        adapt = connection.ops.adapt_datetimefield_value
+        for document, active in generated:
+            authors = self.users[document.department_id]
+            for is_active in active:
+                created_at = document.created_at + timedelta(days=rng.expovariate(1 / COMMENT_DELAY_DAYS))
+                yield (
+                    document.pk, rng.choice(authors).pk, rng.choice(self.texts),
+                    adapt(min(END, created_at)), is_active,
+                )
+
+    def create_documents(self, indexes):
+        generated = [self.document(index) for index in indexes]
+        documents = Document.objects.bulk_create([document for document, _ in generated])
+        self.counts['documents'] += len(documents)
+        self.progress('documents', self.counts['documents'])
+        if self.files:
+            # Текст вложений извлечет команда extract_attachments
+            AttachmentText.objects.bulk_create([
+                AttachmentText(document_id=document.pk, file=document.file.name)
+                for document in documents if document.file
+            ])
+        self.counts['comments'] += self.insert_rows(
+            Comment, ('document', 'author', 'text', 'created_at', 'is_active'), self.comment_rows(generated),
+        )
+        self.progress('comments', self.counts['comments'])
+
+    def register_files(self):
+        """Ссылки на blob и очередь миниатюр — то, что при save делают сигналы."""
+        if not self.references:
+            return
+        sizes = {name: size for name, _, size in self.files}
+        with transaction.atomic():
+            Blob.objects.bulk_create(
+                [Blob(name=name, size=sizes[name], ref_count=0) for name in self.references],
+                ignore_conflicts=True,
+            )
+            for name, references in self.references.items():
+                Blob.objects.filter(name=name).update(ref_count=F('ref_count') + references)
+            AttachmentPreview.objects.bulk_create(
+                [AttachmentPreview(file=name, digest=known_digest(name)) for name in self.references],
+                ignore_conflicts=True,
+            )
+
+
+def seed_corpus(spec, batch_size=1000, **kwargs):
+    """Заполняет БД корпусом по ``spec``; возвращает число созданных строк по моделям."""
+    return CorpusGenerator(spec, batch_size, **kwargs).run()
@@ -0,0 +1,192 @@
+"""Отдача вложений документов после проверки доступа.
+
+Файл читается блоками (память не зависит от размера), поддерживаются
+запросы Range/If-Range и условные запросы. Если задан
+``KB_SENDFILE_BACKEND``, сама передача поручается фронтенд-серверу:
+``'nginx'`` — заголовок X-Accel-Redirect на ``KB_SENDFILE_URL_PREFIX`` +
+имя файла (internal location), ``'xsendfile'`` — X-Sendfile с абсолютным
+путем (Apache mod_xsendfile, lighttpd).
+
+Под ASGI ответ с синхронным итератором Django 4.2 целиком читает в память
+перед отправкой, поэтому async-представления передают ``asynchronous=True``:
+файл читается блоками в пуле потоков и отдается асинхронным итератором.
+
+Открываются в браузере (inline) только PDF и растровые изображения из
+``INLINE_TYPES``; остальное, в том числе HTML и SVG, отдается на скачивание
+с ``X-Content-Type-Options: nosniff``, чтобы содержимое вложения не
+исполнялось в происхождении приложения.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe, quote_etag
+
+from . import metrics
+
+CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+INLINE_TYPES = {'application/pdf', 'image/png', 'image/jpeg'}
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+def parse_range(header, size):
+    """Границы ``(start, end)`` включительно или None, если отдавать файл целиком.
+
+    Поддерживается один диапазон; для нескольких диапазонов (разрешено RFC 9110)
+    отдается весь файл.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        # Суффикс: последние N байт
+        length = int(last)
+        if length == 0:
+            raise RangeNotSatisfiable(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable(header)
+    return start, end
+
+
+def file_chunks(fileobj, start, length, chunk_size=CHUNK_SIZE):
+    try:
+        fileobj.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = fileobj.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        fileobj.close()
+
+
+async def afile_chunks(fileobj, start, length, chunk_size=CHUNK_SIZE):
+    # thread_sensitive=False: чтение файла не обязано ждать общего потока Django
+    read = sync_to_async(fileobj.read, thread_sensitive=False)
+    try:
+        await sync_to_async(fileobj.seek, thread_sensitive=False)(start)
+        remaining = length
+        while remaining > 0:
+            chunk = await read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        fileobj.close()
+
+
+def attachment_validators(fieldfile):
+    """ETag и время изменения вложения по метаданным файла, без чтения содержимого."""
+    storage, name = fieldfile.storage, fieldfile.name
+    try:
+        size = storage.size(name)
+        modified = storage.get_modified_time(name)
+    except (FileNotFoundError, NotImplementedError):
+        raise Http404('Файл не найден')
+    etag = hashlib.sha1(f'{name}:{size}:{modified.timestamp()}'.encode()).hexdigest()
+    return size, quote_etag(etag), modified.timestamp()
+
+
+def _if_range_matches(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        # Для If-Range допустимо только строгое сравнение
+        return if_range == etag
+    return parse_http_date_safe(if_range) == int(last_modified)
+
+
+def is_attachment(content_type):
+    return content_type not in INLINE_TYPES
+
+
+def sendfile_response(fieldfile, filename, content_type):
+    backend = settings.KB_SENDFILE_BACKEND
+    response = HttpResponse(content_type=content_type)
+    if backend == 'nginx':
+        prefix = getattr(settings, 'KB_SENDFILE_URL_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = prefix + quote(fieldfile.name)
+    elif backend == 'xsendfile':
+        response['X-Sendfile'] = fieldfile.path
+    else:
+        raise ValueError(f'Неизвестный KB_SENDFILE_BACKEND: {backend}')
+    response['Content-Disposition'] = content_disposition_header(is_attachment(content_type), filename)
+    response['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+
+def serve_attachment(request, fieldfile, filename=None, asynchronous=False):
+    """Ответ с вложением: 200, 206, 304 или 416.
+
+    ``asynchronous=True`` — тело ответа отдается асинхронным итератором (для ASGI).
+    """
+    filename = filename or os.path.basename(fieldfile.name)
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    if getattr(settings, 'KB_SENDFILE_BACKEND', None):
+        # Файл отдает веб-сервер; считаем объявленный размер, Range здесь не разбирается
+        metrics.inc('kb_download_bytes_total', fieldfile.size)
+        return sendfile_response(fieldfile, filename, content_type)
+
+    size, etag, last_modified = attachment_validators(fieldfile)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+        chunks = afile_chunks if asynchronous else file_chunks
+        if byte_range and _if_range_matches(request, etag, last_modified):
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                chunks(fieldfile.storage.open(fieldfile.name, 'rb'), start, end - start + 1),
+                status=206,
+                content_type=content_type,
+            )
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = str(end - start + 1)
+            response['Content-Disposition'] = content_disposition_header(is_attachment(content_type), filename)
+        elif asynchronous:
+            response = StreamingHttpResponse(
+                chunks(fieldfile.storage.open(fieldfile.name, 'rb'), 0, size),
+                content_type=content_type,
+            )
+            response['Content-Length'] = str(size)
+            response['Content-Disposition'] = content_disposition_header(is_attachment(content_type), filename)
+        else:
+            response = FileResponse(
+                fieldfile.storage.open(fieldfile.name, 'rb'),
+                filename=filename,
+                as_attachment=is_attachment(content_type),
+                content_type=content_type,
+            )
+            response.block_size = CHUNK_SIZE
+        metrics.inc('kb_download_bytes_total', int(response.get('Content-Length') or size))
+
+    response['Accept-Ranges'] = 'bytes'
+    response['X-Content-Type-Options'] = 'nosniff'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'private, no-cache'
+    return response
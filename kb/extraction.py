@@ -0,0 +1,216 @@
+"""Извлечение текста из вложений для поиска.
+
+Форматы Office Open XML и OpenDocument — это ZIP с XML внутри, их разбираем
+стандартной библиотекой. Для PDF нужен необязательный пакет ``pypdf``; без
+него PDF помечаются как неподдерживаемые и подхватываются повторным
+извлечением после установки. Функции этого модуля не обращаются к БД и
+вызываются в процессах пула (см. команду ``extract_attachments``).
+"""
+import os
+import re
+import zipfile
+from xml.etree import ElementTree
+
+from django.conf import settings
+
+from .filetypes import SNIFF_SIZE, sniff_mime_type
+
+try:
+    import pypdf
+except ImportError:  # pragma: no cover - зависит от окружения
+    pypdf = None
+
+# Увеличивается при изменении разборщиков: команда --stale переизвлекает старые тексты
+EXTRACTOR_VERSION = 1
+
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+A_NS = '{http://schemas.openxmlformats.org/drawingml/2006/main}'
+S_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+TEXT_NS = '{urn:oasis:names:tc:opendocument:xmlns:text:1.0}'
+
+RTF_CONTROL_RE = re.compile(r'\\[a-z]+-?\d* ?|[{}]|\\[^a-z]', re.IGNORECASE)
+WHITESPACE_RE = re.compile(r'[ \t\r\f\v]+')
+
+
+class ExtractionError(Exception):
+    """Файл поврежден или не читается: извлечение будет повторено позже."""
+
+
+class UnsupportedFormat(Exception):
+    """Из файла такого типа текст не извлекается; повторять бессмысленно."""
+
+
+def max_text_length():
+    return getattr(settings, 'KB_EXTRACTION_MAX_CHARS', 1_000_000)
+
+
+def max_file_size():
+    return getattr(settings, 'KB_EXTRACTION_MAX_FILE_SIZE', 50 * 1024 * 1024)
+
+
+def max_member_size():
+    return getattr(settings, 'KB_EXTRACTION_MAX_MEMBER_SIZE', 100 * 1024 * 1024)
+
+
+def _open_member(archive, member):
+    # max_file_size ограничивает сжатый файл: часть архива может распаковаться в гигабайты
+    if archive.getinfo(member).file_size > max_member_size():
+        raise UnsupportedFormat(f'Часть архива {member} слишком большая для извлечения текста')
+    return archive.open(member)
+
+
+def _xml_text(archive, member, paragraph_tag, text_tags, limit):
+    """Текст XML-части архива, не длиннее limit: абзацы через перевод строки."""
+    parts, length = [], 0
+    with _open_member(archive, member) as source:
+        for event, element in ElementTree.iterparse(source, events=('end',)):
+            if element.tag in text_tags and element.text:
+                parts.append(element.text)
+                length += len(element.text)
+            elif element.tag == paragraph_tag:
+                parts.append('\n')
+                length += 1
+                # Разобранные абзацы не нужны: держим в памяти только текущий
+                element.clear()
+            if length >= limit:
+                break
+    return ''.join(parts)[:limit]
+
+
+def _members_text(archive, members, paragraph_tag, text_tags):
+    """Текст частей архива подряд, в сумме не длиннее max_text_length()."""
+    parts, remaining = [], max_text_length()
+    for member in members:
+        if remaining <= 0:
+            break
+        text = _xml_text(archive, member, paragraph_tag, text_tags, remaining)
+        parts.append(text)
+        remaining -= len(text) + 1
+    return '\n'.join(parts)
+
+
+def _members(archive, prefix, suffix='.xml'):
+    names = [name for name in archive.namelist() if name.startswith(prefix) and name.endswith(suffix)]
+    # slide10.xml должен идти после slide9.xml
+    return sorted(names, key=lambda name: [int(p) if p.isdigit() else p for p in re.split(r'(\d+)', name)])
+
+
+def extract_docx(archive):
+    members = ['word/document.xml'] + _members(archive, 'word/footnotes')
+    names = set(archive.namelist())
+    return _members_text(archive, [member for member in members if member in names], W_NS + 'p', {W_NS + 't'})
+
+
+def extract_xlsx(archive):
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return ''
+    return _xml_text(archive, 'xl/sharedStrings.xml', S_NS + 'si', {S_NS + 't'}, max_text_length())
+
+
+def extract_pptx(archive):
+    return _members_text(archive, _members(archive, 'ppt/slides/slide'), A_NS + 'p', {A_NS + 't'})
+
+
+def extract_odt(archive):
+    paragraph_tags = {TEXT_NS + 'p', TEXT_NS + 'h'}
+    parts, length, limit = [], 0, max_text_length()
+    with _open_member(archive, 'content.xml') as source:
+        for event, element in ElementTree.iterparse(source, events=('end',)):
+            if element.tag in paragraph_tags:
+                # Текст абзаца разбит между дочерними span: берем все куски
+                parts.append(''.join(element.itertext()))
+                length += len(parts[-1]) + 1
+                element.clear()
+                if length >= limit:
+                    break
+    return '\n'.join(parts)[:limit]
+
+
+ZIP_EXTRACTORS = {
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': extract_docx,
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': extract_xlsx,
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation': extract_pptx,
+    'application/vnd.oasis.opendocument.text': extract_odt,
+}
+
+
+def extract_pdf(path):
+    if pypdf is None:
+        raise UnsupportedFormat('Для PDF нужен пакет pypdf')
+    reader = pypdf.PdfReader(path)
+    if reader.is_encrypted:
+        raise UnsupportedFormat('PDF зашифрован')
+    limit = max_text_length()
+    parts, length = [], 0
+    for page in reader.pages:
+        text = page.extract_text() or ''
+        parts.append(text)
+        length += len(text)
+        if length >= limit:
+            break
+    return '\n'.join(parts)
+
+
+def extract_plain(path):
+    with open(path, 'rb') as source:
+        data = source.read(max_text_length() * 4)
+    for encoding in ('utf-8-sig', 'cp1251'):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode('utf-8', errors='replace')
+
+
+def extract_rtf(path):
+    # Грубо: убираем управляющие слова; кириллица в \'xx остается нераспознанной
+    return RTF_CONTROL_RE.sub(' ', extract_plain(path))
+
+
+def normalize(text):
+    lines = (WHITESPACE_RE.sub(' ', line).strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines if line)[:max_text_length()]
+
+
+def extract_text(path, filename=''):
+    """Текст вложения. Бросает UnsupportedFormat или ExtractionError."""
+    if os.path.getsize(path) > max_file_size():
+        raise UnsupportedFormat('Файл слишком большой для извлечения текста')
+    with open(path, 'rb') as source:
+        mime_type = sniff_mime_type(source.read(SNIFF_SIZE), filename)
+
+    try:
+        if mime_type in ZIP_EXTRACTORS:
+            with zipfile.ZipFile(path) as archive:
+                text = ZIP_EXTRACTORS[mime_type](archive)
+        elif mime_type == 'application/pdf':
+            text = extract_pdf(path)
+        elif mime_type in ('text/plain', 'text/csv'):
+            text = extract_plain(path)
+        elif mime_type == 'application/rtf':
+            text = extract_rtf(path)
+        else:
+            raise UnsupportedFormat(f'Тип {mime_type or "не распознан"} не содержит текста')
+    except UnsupportedFormat:
+        raise
+    except Exception as error:
+        # Поврежденные файлы роняют разборщики самыми разными исключениями
+        raise ExtractionError(f'{type(error).__name__}: {error}') from error
+    return normalize(text)
+
+
+def extract_batch(items):
+    """Извлекает текст для пачки ``(pk, path, filename)``; выполняется в пуле процессов.
+
+    Возвращает ``(pk, status, text, error)``, где status — 'done', 'retry'
+    или 'unsupported'.
+    """
+    results = []
+    for pk, path, filename in items:
+        try:
+            results.append((pk, 'done', extract_text(path, filename), ''))
+        except UnsupportedFormat as error:
+            results.append((pk, 'unsupported', '', str(error)))
+        except (ExtractionError, OSError) as error:
+            results.append((pk, 'retry', '', str(error)))
+    return results
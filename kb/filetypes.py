@@ -0,0 +1,76 @@
+"""Определение типа файла по сигнатуре (magic bytes), а не по имени."""
+import os
+
+SNIFF_SIZE = 8 * 1024
+
+OLE_TYPES = {
+    '.doc': 'application/msword',
+    '.xls': 'application/vnd.ms-excel',
+    '.ppt': 'application/vnd.ms-powerpoint',
+}
+
+# Каталоги внутри ZIP-контейнеров Office Open XML
+OOXML_MARKERS = (
+    (b'word/', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'),
+    (b'xl/', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    (b'ppt/', 'application/vnd.openxmlformats-officedocument.presentationml.presentation'),
+)
+
+SIGNATURES = (
+    (b'%PDF-', 'application/pdf'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'II*\x00', 'image/tiff'),
+    (b'MM\x00*', 'image/tiff'),
+    (b'{\\rtf', 'application/rtf'),
+    (b'7z\xbc\xaf\x27\x1c', 'application/x-7z-compressed'),
+    (b'Rar!\x1a\x07', 'application/x-rar-compressed'),
+)
+
+
+def _sniff_zip(head):
+    # ODF хранит несжатый файл mimetype первым в архиве
+    if head[30:38] == b'mimetype':
+        if b'application/vnd.oasis.opendocument.text' in head[38:120]:
+            return 'application/vnd.oasis.opendocument.text'
+        return 'application/zip'
+    for marker, mime_type in OOXML_MARKERS:
+        if marker in head:
+            return mime_type
+    return 'application/zip'
+
+
+def _sniff_text(head, extension):
+    if b'\x00' in head:
+        return None
+    try:
+        text = head.decode('utf-8')
+    except UnicodeDecodeError as error:
+        # Блок может оборваться посреди многобайтового символа
+        if error.start < len(head) - 3:
+            return None
+        text = head[:error.start].decode('utf-8')
+    stripped = text.lstrip('﻿ \t\r\n').lower()
+    if stripped.startswith('<svg') or (stripped.startswith('<?xml') and '<svg' in stripped):
+        return 'image/svg+xml'
+    return 'text/csv' if extension == '.csv' else 'text/plain'
+
+
+def sniff_mime_type(head, filename=''):
+    """MIME-тип по первым байтам файла или None, если тип не распознан."""
+    extension = os.path.splitext(filename)[1].lower()
+    if head.startswith(b'PK\x03\x04'):
+        return _sniff_zip(head)
+    if head.startswith(b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'):
+        return OLE_TYPES.get(extension, 'application/msword')
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    # У BMP короткая сигнатура, поэтому проверяем и зарезервированные нули заголовка
+    if head[:2] == b'BM' and head[6:10] == b'\x00\x00\x00\x00':
+        return 'image/bmp'
+    for signature, mime_type in SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    return _sniff_text(head, extension)
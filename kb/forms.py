@@ -1,8 +1,39 @@
 from django import forms
-from .models import Document, Comment
+from .models import Category, Document, Comment
 from django.core.exceptions import ValidationError
 import mimetypes
 
+# Допустимые типы вложений (проверка формы)
+ALLOWED_MIME_TYPES = [
+    # Документы
+    'application/pdf',
+    'application/msword',  # .doc
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',  # .docx
+    'application/vnd.ms-excel',  # .xls
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',  # .xlsx
+    'text/csv',
+    'text/plain',
+    'application/rtf',
+    'application/vnd.oasis.opendocument.text',  # .odt
+    'application/vnd.ms-powerpoint',  # .ppt
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation',  # .pptx
+
+    # Изображения
+    'image/jpeg',
+    'image/png',
+    'image/gif',
+    'image/bmp',
+    'image/tiff',
+    'image/webp',
+    'image/svg+xml',
+
+    # Архивы
+    'application/zip',
+    'application/x-rar-compressed',
+    'application/x-7z-compressed',
+]
+
+
 class DocumentForm(forms.ModelForm):
     class Meta:
         model = Document
@@ -17,36 +48,7 @@ class DocumentForm(forms.ModelForm):
         if file:
             mime_type, _ = mimetypes.guess_type(file.name)
 
-            allowed_types = [
-                # Документы
-                'application/pdf',
-                'application/msword',  # .doc
-                'application/vnd.openxmlformats-officedocument.wordprocessingml.document',  # .docx
-                'application/vnd.ms-excel',  # .xls
-                'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',  # .xlsx
-                'text/csv',
-                'text/plain',
-                'application/rtf',
-                'application/vnd.oasis.opendocument.text',  # .odt
-                'application/vnd.ms-powerpoint',  # .ppt
-                'application/vnd.openxmlformats-officedocument.presentationml.presentation',  # .pptx
-
-                # Изображения
-                'image/jpeg',
-                'image/png',
-                'image/gif',
-                'image/bmp',
-                'image/tiff',
-                'image/webp',
-                'image/svg+xml',
-
-                # Архивы
-                'application/zip',
-                'application/x-rar-compressed',
-                'application/x-7z-compressed',
-            ]
-
-            if mime_type not in allowed_types:
+            if mime_type not in ALLOWED_MIME_TYPES:
                 raise ValidationError("Недопустимый тип файла")
 
             if file.size > 10 * 1024 * 1024:
@@ -66,3 +68,16 @@ class CommentForm(forms.ModelForm):
         if link and not link.startswith(('http://', 'https://')):
             raise ValidationError("Ссылка должна начинаться с http:// или https://")
         return link
+
+
+class MoveDocumentsForm(forms.Form):
+    """Цель массового перемещения документов: категория и вместе с ней ее отдел."""
+    category = forms.ModelChoiceField(
+        queryset=Category.objects.select_related('department').order_by('department__name', 'name'),
+        label='Категория',
+    )
+
+    def __init__(self, *args, categories=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if categories is not None:
+            self.fields['category'].queryset = categories
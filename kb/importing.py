@@ -0,0 +1,192 @@
+"""Чтение и подготовка документов для массового импорта (команда import_documents).
+
+Источник читается потоково: JSONL, CSV или дерево каталогов
+``<отдел>/<категория>/<файл>``. Каждая запись получает позицию — номер строки
+или файла, — по которой импорт продолжается после прерывания.
+"""
+import csv
+import json
+import os
+
+from .models import Category, CustomUser, Department, Document, document_slug_base
+
+TEXT_EXTENSIONS = ('.txt', '.md', '.html')
+SLUG_MAX_LENGTH = Document._meta.get_field('slug').max_length
+
+
+class RecordError(ValueError):
+    """Запись нельзя импортировать (не хватает полей, неизвестный отдел и т. п.)."""
+
+
+def detect_format(path):
+    if os.path.isdir(path):
+        return 'dir'
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def read_jsonl(path):
+    with open(path, encoding='utf-8') as source:
+        for position, line in enumerate(source, 1):
+            if not line.strip():
+                continue
+            # Битая строка пропускается, как и другие ошибочные записи, а не прерывает импорт
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as error:
+                yield position, {'_error': f'Некорректный JSON: {error}'}
+                continue
+            if not isinstance(record, dict):
+                yield position, {'_error': 'Запись должна быть JSON-объектом'}
+                continue
+            yield position, record
+
+
+def read_csv(path):
+    with open(path, encoding='utf-8-sig', newline='') as source:
+        for position, row in enumerate(csv.DictReader(source), 1):
+            yield position, row
+
+
+def read_directory(path):
+    files = []
+    for root, dirs, names in os.walk(path):
+        dirs.sort()
+        files.extend(os.path.join(root, name) for name in sorted(names) if name.lower().endswith(TEXT_EXTENSIONS))
+    for position, file_path in enumerate(files, 1):
+        parts = os.path.relpath(file_path, path).split(os.sep)
+        if len(parts) != 3:
+            yield position, {'_error': f'{file_path}: ожидается <отдел>/<категория>/<файл>'}
+            continue
+        try:
+            with open(file_path, encoding='utf-8') as source:
+                content = source.read()
+        except (UnicodeDecodeError, OSError) as error:
+            yield position, {'_error': f'{file_path}: не удалось прочитать файл ({error})'}
+            continue
+        yield position, {
+            'department': parts[0],
+            'category': parts[1],
+            'title': os.path.splitext(parts[2])[0].replace('_', ' '),
+            'content': content,
+        }
+
+
+READERS = {'jsonl': read_jsonl, 'csv': read_csv, 'dir': read_directory}
+
+
+def read_records(path, fmt=None):
+    """Пары ``(позиция, запись)`` из источника."""
+    return READERS[fmt or detect_format(path)](path)
+
+
+class SlugAllocator:
+    """Выдает уникальные слаги в памяти по заранее загруженному множеству занятых."""
+
+    def __init__(self, taken=None):
+        if taken is None:
+            taken = Document.objects.values_list('slug', flat=True).iterator(chunk_size=5000)
+        self.taken = set(taken)
+        # Последний выданный номер для основы: не перебираем -2, -3 ... заново
+        self.counters = {}
+
+    def allocate(self, title):
+        # Оставляем место для суффикса
+        base = document_slug_base(title)[:SLUG_MAX_LENGTH - 8].strip('-') or 'document'
+        slug = base
+        number = self.counters.get(base, 1)
+        while slug in self.taken:
+            number += 1
+            slug = f'{base}-{number}'
+        self.counters[base] = number
+        self.taken.add(slug)
+        return slug
+
+
+class Lookups:
+    """Отделы, категории и авторы из памяти; недостающие создаются по требованию."""
+
+    def __init__(self, default_author=None, create_missing=False):
+        self.create_missing = create_missing
+        self.departments = {}
+        for department in Department.objects.all():
+            self.departments[department.name.lower()] = department
+            self.departments[department.slug.lower()] = department
+        self.categories = {
+            (category.department_id, category.name.lower()): category
+            for category in Category.objects.all()
+        }
+        self.authors = {user.username: user for user in CustomUser.objects.only('id', 'username')}
+        self.default_author = None
+        if default_author:
+            self.default_author = self.author(default_author)
+
+    def department(self, name):
+        key = str(name or '').strip().lower()
+        if not key:
+            raise RecordError('Не указан отдел')
+        if key not in self.departments:
+            if not self.create_missing:
+                raise RecordError(f'Неизвестный отдел: {name}')
+            department = Department.objects.create(name=str(name).strip())
+            self.departments[key] = self.departments[department.slug.lower()] = department
+        return self.departments[key]
+
+    def category(self, department, name):
+        key = (department.id, str(name or '').strip().lower())
+        if not key[1]:
+            raise RecordError('Не указана категория')
+        if key not in self.categories:
+            if not self.create_missing:
+                raise RecordError(f'Неизвестная категория: {name} ({department.name})')
+            self.categories[key] = Category.objects.create(name=str(name).strip(), department=department)
+        return self.categories[key]
+
+    def author(self, username):
+        if not username:
+            if self.default_author is None:
+                raise RecordError('Не указан автор')
+            return self.default_author
+        try:
+            return self.authors[username]
+        except KeyError:
+            raise RecordError(f'Неизвестный автор: {username}')
+
+
+def parse_bool(value, default=True):
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() not in ('0', 'false', 'no', 'нет')
+
+
+def text_value(record, name):
+    """Строковое поле записи: числа из JSON приводятся к строке, объекты и списки — ошибка записи."""
+    value = record.get(name)
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        raise RecordError(f'Поле {name} должно быть строкой')
+    return str(value)
+
+
+def build_document(record, lookups, slugs):
+    """Несохраненный Document из записи, с анонсом и HTML (bulk_create не вызывает save)."""
+    if '_error' in record:
+        raise RecordError(record['_error'])
+    title = text_value(record, 'title').strip()
+    if not title:
+        raise RecordError('Не указан заголовок')
+    department = lookups.department(record.get('department'))
+    document = Document(
+        title=title,
+        slug=slugs.allocate(title),
+        content=text_value(record, 'content'),
+        author=lookups.author(text_value(record, 'author').strip()),
+        department=department,
+        category=lookups.category(department, record.get('category')),
+        is_published=parse_bool(record.get('is_published')),
+    )
+    document.update_excerpt()
+    document.render_content()
+    return document
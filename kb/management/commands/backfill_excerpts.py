@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from kb.models import Document
+
+
+class Command(BaseCommand):
+    help = 'Заполняет анонс и число слов у документов, сохраненных до появления этих полей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--all', action='store_true', help='Пересчитать все документы, а не только пустые')
+
+    def handle(self, *args, **options):
+        queryset = Document.objects.only('id', 'content').order_by('id')
+        if not options['all']:
+            queryset = queryset.filter(excerpt='').exclude(content='')
+
+        last_id = 0
+        total = 0
+        while True:
+            batch = list(queryset.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            for document in batch:
+                document.update_excerpt()
+            with transaction.atomic():
+                Document.objects.bulk_update(batch, ['excerpt', 'word_count'])
+            last_id = batch[-1].id
+            total += len(batch)
+            self.stdout.write(f'Обработано: {total}')
+
+        self.stdout.write(self.style.SUCCESS(f'Готово, обновлено документов: {total}'))
@@ -0,0 +1,42 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from kb.models import Document
+from kb.search import IcontainsSearchBackend, get_search_backend
+
+DEFAULT_QUERIES = ['отчет', 'инструкция', 'policy', 'договор поставки']
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает время поиска через icontains и через индекс поискового бэкенда'
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='*', help='Поисковые запросы')
+        parser.add_argument('--repeat', type=int, default=5, help='Повторов на запрос')
+        parser.add_argument('--limit', type=int, default=50, help='Размер выдачи (как на странице)')
+
+    def measure(self, backend, query, repeat, limit):
+        timings = []
+        found = 0
+        for _ in range(repeat):
+            started = time.perf_counter()
+            found = len(list(backend.search(Document.objects.all(), query).values_list('id', flat=True)[:limit]))
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings), found
+
+    def handle(self, *args, **options):
+        queries = options['queries'] or DEFAULT_QUERIES
+        baseline = IcontainsSearchBackend()
+        indexed = get_search_backend()
+        self.stdout.write(f'Документов: {Document.objects.count()}, бэкенд: {type(indexed).__name__}')
+        self.stdout.write(f"{'запрос':<24}{'icontains, мс':>16}{'индекс, мс':>14}{'найдено':>16}{'ускорение':>12}")
+        for query in queries:
+            base_ms, base_found = self.measure(baseline, query, options['repeat'], options['limit'])
+            index_ms, index_found = self.measure(indexed, query, options['repeat'], options['limit'])
+            speedup = base_ms / index_ms if index_ms else float('inf')
+            self.stdout.write(
+                f'{query:<24}{base_ms:>16.2f}{index_ms:>14.2f}'
+                f'{f"{base_found}/{index_found}":>16}{speedup:>11.1f}x'
+            )
@@ -0,0 +1,145 @@
+import asyncio
+import os
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from kb.benchmarking import Server, create_session, download_scenario, slow_clients_scenario
+from kb.models import Category, Document
+
+METRICS = [
+    ('probe_p50_ms', 'медленные клиенты: p50 списка, мс'),
+    ('probe_p95_ms', 'медленные клиенты: p95 списка, мс'),
+    ('probes', 'медленные клиенты: запросов списка'),
+    ('probe_errors', 'медленные клиенты: ошибок'),
+    ('throughput_mb_s', 'скачивание: МБ/с'),
+    ('download_p50_s', 'скачивание: p50, с'),
+    ('download_p95_s', 'скачивание: p95, с'),
+    ('download_errors', 'скачивание: ошибок'),
+    ('peak_rss_mb', 'скачивание: пик памяти, МБ'),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает gunicorn с синхронными воркерами (WSGI) и с воркерами uvicorn '
+        '(ASGI, async-представления) на медленных клиентах и скачивании больших вложений'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Пользователь, от имени которого идут запросы (по умолчанию — администратор)')
+        parser.add_argument('--document', help='Slug документа с вложением; по умолчанию создается временный')
+        parser.add_argument('--file-size', type=int, default=32, help='Размер временного вложения, МБ')
+        parser.add_argument('--workers', type=int, default=2, help='Воркеров у каждого сервера')
+        parser.add_argument('--slow-clients', type=int, default=8)
+        parser.add_argument('--slow-rate', type=int, default=256, help='Скорость медленного клиента, КБ/с')
+        parser.add_argument('--duration', type=int, default=10, help='Длительность сценария медленных клиентов, с')
+        parser.add_argument('--downloads', type=int, default=16)
+        parser.add_argument('--concurrency', type=int, default=8, help='Параллельных скачиваний')
+        parser.add_argument('--wsgi-settings', default=os.environ.get('DJANGO_SETTINGS_MODULE'))
+        parser.add_argument('--asgi-settings', default='knowledgebasesrc.settings_asgi')
+        parser.add_argument('--only', choices=['wsgi', 'asgi'], help='Запустить только один сервер')
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        document, temporary = self.get_document(options['document'], user, options['file_size'])
+        session = create_session(user)
+        cookie = f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+        paths = {
+            'download_path': reverse('document_download', args=[document.slug]),
+            'probe_path': reverse('document_list'),
+        }
+        self.stdout.write(
+            f'Вложение: {document.file.size / 2 ** 20:.1f} МБ, воркеров: {options["workers"]}, '
+            f'медленных клиентов: {options["slow_clients"]} по {options["slow_rate"]} КБ/с'
+        )
+
+        workers = str(options['workers'])
+        servers = [
+            Server(
+                'WSGI', ['knowledgebasesrc.wsgi:application', '--workers', workers, '--timeout', '120'],
+                options['wsgi_settings'], settings.BASE_DIR,
+            ),
+            Server(
+                'ASGI', [
+                    'knowledgebasesrc.asgi:application', '-c',
+                    str(settings.BASE_DIR / 'knowledgebasesrc' / 'gunicorn_asgi.py'), '--workers', workers,
+                ],
+                options['asgi_settings'], settings.BASE_DIR,
+            ),
+        ]
+        if options['only']:
+            servers = [server for server in servers if server.name.lower() == options['only']]
+
+        results = {}
+        try:
+            for server in servers:
+                self.stdout.write(f'{server.name}: запуск')
+                server.start()
+                try:
+                    results[server.name] = asyncio.run(self.run(server, cookie, paths, options))
+                finally:
+                    server.stop()
+        finally:
+            session.delete()
+            if temporary:
+                document.delete()
+
+        self.report(results)
+
+    async def run(self, server, cookie, paths, options):
+        result = await slow_clients_scenario(
+            server, cookie, paths['download_path'], paths['probe_path'],
+            options['slow_clients'], options['slow_rate'] * 1024, options['duration'],
+        )
+        result.update(await download_scenario(
+            server, cookie, paths['download_path'], options['downloads'], options['concurrency'],
+        ))
+        return result
+
+    def report(self, results):
+        names = list(results)
+        self.stdout.write(f"{'':<40}" + ''.join(f'{name:>12}' for name in names))
+        for key, title in METRICS:
+            cells = []
+            for name in names:
+                value = results[name].get(key)
+                cells.append(f'{"—" if value is None else round(value, 1):>12}')
+            self.stdout.write(f'{title:<40}' + ''.join(cells))
+
+    def get_user(self, username):
+        User = get_user_model()
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f'Пользователь не найден: {username}')
+        user = User.objects.filter(is_active=True, user_type='ADMIN').order_by('pk').first()
+        if user is None:
+            raise CommandError('Нет администратора; укажите --user')
+        return user
+
+    def get_document(self, slug, user, file_size):
+        if slug:
+            document = Document.objects.filter(slug=slug).first()
+            if document is None or not document.file:
+                raise CommandError(f'Документ {slug} не найден или без вложения')
+            return document, False
+
+        category = Category.objects.select_related('department').order_by('pk').first()
+        if category is None:
+            raise CommandError('Нет ни одной категории; укажите --document')
+        with tempfile.NamedTemporaryFile(suffix='.bin') as source:
+            for _ in range(file_size):
+                source.write(os.urandom(2 ** 20))
+            source.seek(0)
+            document = Document.objects.create(
+                title='Нагрузочный тест', content='Временный документ benchmark_servers',
+                author=user, category=category, department=category.department,
+                file=File(source, name='benchmark.bin'),
+            )
+        return document, True
@@ -0,0 +1,285 @@
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import tempfile
+from urllib.parse import urlencode
+
+import django
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.middleware.csrf import CSRF_ALLOWED_CHARS, CSRF_SECRET_LENGTH
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from kb.benchmarking import (
+    Endpoint, Server, create_session, database_url, measure_client, measure_server,
+)
+from kb.corpus import ADMIN_USERNAME, CorpusSpec, seed_corpus
+from kb.models import CustomUser, Document
+
+# Метрики, по которым --compare ищет регрессии
+COMPARED = ('p95_ms', 'queries')
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет страницы базы знаний на синтетическом корпусе в отдельной БД: '
+        'тестовым клиентом (задержки и SQL-запросы) и, с --server, через gunicorn '
+        'с параллельными пользователями. Результат — JSON для сравнения между коммитами'
+    )
+
+    def add_arguments(self, parser):
+        corpus = parser.add_argument_group('корпус')
+        corpus.add_argument('--departments', type=int, default=CorpusSpec.departments)
+        corpus.add_argument('--categories', type=int, default=CorpusSpec.categories, help='В каждом отделе')
+        corpus.add_argument('--users', type=int, default=CorpusSpec.users, help='В каждом отделе')
+        corpus.add_argument('--documents', type=int, default=CorpusSpec.documents)
+        corpus.add_argument('--comments', type=int, default=CorpusSpec.comments)
+        corpus.add_argument('--seed', type=int, default=CorpusSpec.seed)
+
+        parser.add_argument('--iterations', type=int, default=30, help='Запросов на страницу тестовым клиентом')
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument(
+            '--cold-cache', action='store_true', help='Очищать кэш фрагментов перед каждым запросом',
+        )
+        parser.add_argument('--query', default='отчет', help='Поисковый запрос для замера поиска')
+        parser.add_argument('--only', action='append', help='Замерять только эти страницы (можно повторять)')
+
+        parser.add_argument('--server', action='store_true', help='Замерять и через gunicorn')
+        parser.add_argument('--asgi', action='store_true', help='Сервер с воркерами uvicorn и async-представлениями')
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--concurrency', type=int, default=8, help='Виртуальных пользователей')
+        parser.add_argument('--requests', type=int, default=200, help='Запросов на страницу через сервер')
+
+        parser.add_argument('--output', help='Файл для JSON (по умолчанию — stdout)')
+        parser.add_argument('--compare', help='JSON прошлого замера: регрессии завершают команду с ошибкой')
+        parser.add_argument('--threshold', type=float, default=0.25, help='Допустимый рост p95, доля')
+        parser.add_argument(
+            '--database', help='Имя БД корпуса; для SQLite — путь к файлу (по умолчанию во временном каталоге)',
+        )
+        parser.add_argument('--keep-database', action='store_true')
+
+    def handle(self, *args, **options):
+        spec = CorpusSpec(
+            departments=options['departments'], categories=options['categories'], users=options['users'],
+            documents=options['documents'], comments=options['comments'], seed=options['seed'],
+        )
+        if spec.departments < 1 or spec.documents < 1:
+            raise CommandError('Нужен хотя бы один отдел и один документ')
+        baseline = self.read_baseline(options['compare'])
+
+        connection = connections[DEFAULT_DB_ALIAS]
+        if options['database'] or connection.vendor == 'sqlite':
+            # Серверу нужен файл: SQLite в памяти ему не видна
+            connection.settings_dict['TEST']['NAME'] = options['database'] or os.path.join(
+                tempfile.gettempdir(), 'kb-benchmark.sqlite3',
+            )
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            report = {
+                'meta': self.meta(spec, options),
+                'corpus': seed_corpus(spec),
+            }
+            endpoints = self.endpoints(options)
+            report['client'] = self.run_client(endpoints, options)
+            if options['server']:
+                report['server'] = self.run_server(endpoints, options)
+        finally:
+            if options['keep_database']:
+                self.stderr.write(f"БД корпуса сохранена: {connection.settings_dict['NAME']}")
+            else:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as target:
+                target.write(output + '\n')
+            self.print_table(report)
+        else:
+            self.stdout.write(output)
+        if baseline is not None:
+            # Без --output stdout занят JSON
+            self.compare(report, baseline, options['threshold'], self.stdout if options['output'] else self.stderr)
+
+    # === Подготовка ===
+
+    def meta(self, spec, options):
+        return {
+            'commit': self.git('rev-parse', 'HEAD'),
+            # Незакоммиченные изменения делают сравнение с коммитом неточным
+            'dirty': bool(self.git('status', '--porcelain', '--untracked-files=no')),
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connections[DEFAULT_DB_ALIAS].vendor,
+            'spec': spec.as_dict(),
+            'options': {
+                key: options[key] for key in (
+                    'iterations', 'warmup', 'cold_cache', 'query', 'asgi', 'workers', 'concurrency', 'requests',
+                )
+            },
+        }
+
+    def git(self, *args):
+        try:
+            result = subprocess.run(
+                ['git', *args], cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=30,
+            )
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+        return result.stdout.strip() if result.returncode == 0 else None
+
+    def endpoints(self, options):
+        self.user = (
+            CustomUser.objects.filter(user_type='EMPLOYEE', department__isnull=False).order_by('pk').first()
+        )
+        self.admin = CustomUser.objects.get(username=ADMIN_USERNAME)
+        # Самый обсуждаемый документ отдела — худший случай для страницы документа
+        document = (
+            Document.objects.filter(department_id=self.user.department_id, is_published=True)
+            .order_by('-comment_count', 'pk').first()
+        )
+        if document is None:
+            raise CommandError('В отделе пользователя нет опубликованных документов; увеличьте --documents')
+        endpoints = [
+            Endpoint('document_list', reverse('document_list')),
+            Endpoint('search', reverse('document_list') + '?' + urlencode({'q': options['query']})),
+            Endpoint('document_detail', reverse('document_detail', args=[document.slug])),
+            Endpoint('admin_documents', reverse('admin:kb_document_changelist'), admin=True),
+            Endpoint('admin_comments', reverse('admin:kb_comment_changelist'), admin=True),
+            # Запись последней: новые комментарии не должны влиять на остальные замеры
+            Endpoint(
+                'add_comment', reverse('add_comment', args=[document.slug]),
+                method='POST', data={'text': 'Комментарий нагрузочного теста'},
+            ),
+        ]
+        if options['only']:
+            unknown = set(options['only']) - {endpoint.name for endpoint in endpoints}
+            if unknown:
+                raise CommandError(f"Неизвестные страницы: {', '.join(sorted(unknown))}")
+            endpoints = [endpoint for endpoint in endpoints if endpoint.name in options['only']]
+        return endpoints
+
+    # === Замеры ===
+
+    def run_client(self, endpoints, options):
+        clients = {}
+        for admin, user in ((False, self.user), (True, self.admin)):
+            clients[admin] = Client(HTTP_HOST=self.host())
+            clients[admin].force_login(user)
+        cache = caches[getattr(settings, 'KB_CACHE_ALIAS', 'default')]
+        cache.clear()
+
+        results = {}
+        for endpoint in endpoints:
+            self.stderr.write(f'Клиент: {endpoint.name}')
+            results[endpoint.name] = measure_client(
+                clients[endpoint.admin], endpoint, options['iterations'], options['warmup'],
+                before_request=cache.clear if options['cold_cache'] else None,
+            )
+        return results
+
+    def run_server(self, endpoints, options):
+        env = {'DATABASE_URL': database_url(connections[DEFAULT_DB_ALIAS].settings_dict)}
+        workers = str(options['workers'])
+        if options['asgi']:
+            server = Server('ASGI', [
+                'knowledgebasesrc.asgi:application', '-c',
+                str(settings.BASE_DIR / 'knowledgebasesrc' / 'gunicorn_asgi.py'), '--workers', workers,
+            ], 'knowledgebasesrc.settings_asgi', settings.BASE_DIR, env)
+        else:
+            server = Server(
+                'WSGI', ['knowledgebasesrc.wsgi:application', '--workers', workers, '--timeout', '120'],
+                os.environ.get('DJANGO_SETTINGS_MODULE'), settings.BASE_DIR, env,
+            )
+
+        # CSRF-проверку проходим как браузер: секрет в cookie и тот же секрет в заголовке
+        csrf_secret = get_random_string(CSRF_SECRET_LENGTH, allowed_chars=CSRF_ALLOWED_CHARS)
+        cookies = {
+            admin: f'{settings.SESSION_COOKIE_NAME}={create_session(user).session_key}; '
+                   f'{settings.CSRF_COOKIE_NAME}={csrf_secret}'
+            for admin, user in ((False, self.user), (True, self.admin))
+        }
+        headers = {'X-CSRFToken': csrf_secret}
+
+        results = {}
+        server.start()
+        try:
+            for endpoint in endpoints:
+                self.stderr.write(f'{server.name}: {endpoint.name}')
+                results[endpoint.name] = asyncio.run(measure_server(
+                    server, endpoint, cookies[endpoint.admin], options['concurrency'], options['requests'],
+                    headers=headers,
+                ))
+        finally:
+            server.stop()
+        return results
+
+    def host(self):
+        # Тестовый клиент по умолчанию ходит на testserver, которого нет в ALLOWED_HOSTS
+        for host in settings.ALLOWED_HOSTS:
+            if host != '*':
+                return host.lstrip('.')
+        return 'localhost'
+
+    # === Отчет ===
+
+    def read_baseline(self, path):
+        if not path:
+            return None
+        try:
+            with open(path, encoding='utf-8') as source:
+                return json.load(source)
+        except (OSError, ValueError) as error:
+            raise CommandError(f'Не удалось прочитать {path}: {error}')
+
+    def print_table(self, report):
+        for mode in ('client', 'server'):
+            if mode not in report:
+                continue
+            self.stdout.write(
+                f"{mode:<18}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'зап/с':>10}"
+                f"{'SQL':>6}{'RSS, МБ':>10}{'ошибок':>8}"
+            )
+            for name, result in report[mode].items():
+                self.stdout.write(
+                    f'{name:<18}' + ''.join(
+                        f'{self.format(result.get(key)):>{width}}' for key, width in (
+                            ('p50_ms', 10), ('p95_ms', 10), ('p99_ms', 10), ('throughput_rps', 10),
+                            ('queries', 6), ('peak_rss_mb', 10), ('errors', 8),
+                        )
+                    )
+                )
+
+    def format(self, value):
+        return '—' if value is None else f'{value:.1f}' if isinstance(value, float) else str(value)
+
+    def compare(self, report, baseline, threshold, out):
+        if baseline.get('meta', {}).get('spec') != report['meta']['spec']:
+            out.write('Корпус отличается от базового замера: сравнение неточное')
+        regressions = []
+        for mode in ('client', 'server'):
+            for name, current in report.get(mode, {}).items():
+                previous = baseline.get(mode, {}).get(name)
+                if not previous:
+                    continue
+                for metric in COMPARED:
+                    old, new = previous.get(metric), current.get(metric)
+                    if old is None or new is None:
+                        continue
+                    # Число запросов должно совпадать точно, время — в пределах порога
+                    limit = old if metric == 'queries' else old * (1 + threshold)
+                    marker = ''
+                    if new > limit:
+                        marker = '  <-- регрессия'
+                        regressions.append(f'{mode}/{name}/{metric}')
+                    out.write(f'{mode}/{name}/{metric}: {self.format(old)} -> {self.format(new)}{marker}')
+        if regressions:
+            raise CommandError(f"Регрессии относительно {baseline['meta'].get('commit')}: {', '.join(regressions)}")
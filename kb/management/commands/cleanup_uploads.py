@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from kb.models import UploadSession
+from kb.storage import purge_orphan_blobs
+from kb.uploads import abort_upload
+
+
+class Command(BaseCommand):
+    help = 'Удаляет брошенные загрузки частями, их staging-файлы и вложения без ссылок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help='Возраст последнего куска, часов')
+
+    def handle(self, *args, **options):
+        threshold = timezone.now() - timedelta(hours=options['hours'])
+        removed = 0
+        for session in UploadSession.objects.filter(updated_at__lt=threshold).iterator():
+            abort_upload(session)
+            removed += 1
+        # Файлы, загруженные повторно в момент удаления, но так и не прикрепленные
+        orphans = purge_orphan_blobs(threshold)
+        self.stdout.write(self.style.SUCCESS(f'Удалено загрузок: {removed}, вложений без ссылок: {orphans}'))
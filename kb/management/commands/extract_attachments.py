@@ -0,0 +1,76 @@
+import os
+
+from django.utils import timezone
+
+from kb.cache import bump_version
+from kb.extraction import EXTRACTOR_VERSION, extract_batch
+from kb.models import AttachmentText, Document
+from kb.queue import QueueCommand
+from kb.storage import attachment_storage
+
+
+class Command(QueueCommand):
+    help = 'Извлекает текст вложений для поиска в пуле процессов'
+    model = AttachmentText
+    fields = ('file', 'document__file_name')
+    task = staticmethod(extract_batch)
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--reextract', action='store_true',
+            help='Поставить в очередь все вложения (после обновления разборщиков)',
+        )
+        parser.add_argument(
+            '--stale', action='store_true',
+            help='Поставить в очередь вложения, извлеченные старой версией разборщиков',
+        )
+
+    def handle(self, *args, **options):
+        if options['reextract'] or options['stale']:
+            queued = self.requeue(stale_only=not options['reextract'])
+            self.stdout.write(f'Поставлено в очередь: {queued}')
+        super().handle(*args, **options)
+
+    def requeue(self, stale_only):
+        # Вложения, загруженные до появления очереди
+        missing = (
+            Document.objects.exclude(file='').exclude(file__isnull=True)
+            .filter(attachment_text__isnull=True).values_list('id', 'file')
+        )
+        AttachmentText.objects.bulk_create(
+            (AttachmentText(document_id=pk, file=name) for pk, name in missing.iterator()),
+            batch_size=500,
+        )
+        queryset = AttachmentText.objects.all()
+        if stale_only:
+            queryset = queryset.exclude(status=AttachmentText.PENDING).exclude(
+                extractor_version=EXTRACTOR_VERSION,
+            )
+        # Старый текст остается в индексе, пока не извлечен новый
+        return queryset.update(
+            status=AttachmentText.PENDING, attempts=0, last_error='', next_attempt_at=timezone.now(),
+        )
+
+    def item(self, row):
+        pk, name, file_name = row
+        return pk, attachment_storage.path(name), file_name or os.path.basename(name)
+
+    def result_fields(self, row, status, value):
+        fields = {'extractor_version': EXTRACTOR_VERSION}
+        # При ошибке прежний текст (если он был) остается в индексе
+        if status != 'retry':
+            fields['text'] = value
+        return fields
+
+    def target(self, row):
+        # Если файл заменили во время извлечения, результат устарел
+        return AttachmentText.objects.filter(document_id=row[0], file=row[1])
+
+    def label(self, row):
+        return f'Документ {row[0]}'
+
+    def finished(self, rows):
+        # Новый текст меняет результаты поиска в кэшированных списках
+        documents = Document.objects.filter(pk__in=[row[0] for row in rows])
+        bump_version(*documents.values_list('department_id', flat=True))
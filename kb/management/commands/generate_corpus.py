@@ -0,0 +1,67 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from kb.corpus import CorpusExists, CorpusSpec, seed_corpus
+
+
+class Command(BaseCommand):
+    help = (
+        'Создает синтетический корпус рабочего масштаба: отделы, категории, пользователей, '
+        'документы и комментарии (по умолчанию около 10 млн строк). Детерминирован по --seed'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--departments', type=int, default=20)
+        parser.add_argument('--categories', type=int, default=10, help='В каждом отделе')
+        parser.add_argument('--users', type=int, default=50, help='В среднем на отдел')
+        parser.add_argument('--documents', type=int, default=500_000)
+        parser.add_argument('--comments', type=int, default=9_500_000, help='Примерное число')
+        parser.add_argument('--seed', type=int, default=CorpusSpec.seed)
+        parser.add_argument(
+            '--department-skew', type=float, default=CorpusSpec.department_skew,
+            help='Неравномерность размеров отделов (показатель закона Ципфа; 0 — равные)',
+        )
+        parser.add_argument(
+            '--comment-skew', type=float, default=CorpusSpec.comment_skew,
+            help='Неравномерность числа комментариев у документов (показатель закона Ципфа)',
+        )
+        parser.add_argument(
+            '--attachments', type=float, default=0.0,
+            help='Доля документов с вложением (файлы-заглушки PDF и PNG в хранилище вложений)',
+        )
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument(
+            '--render-html', action='store_true',
+            help='Рендерить HTML сразу; по умолчанию он строится при первом просмотре документа',
+        )
+
+    def handle(self, *args, **options):
+        spec = CorpusSpec(
+            departments=options['departments'], categories=options['categories'], users=options['users'],
+            documents=options['documents'], comments=options['comments'], seed=options['seed'],
+            department_skew=options['department_skew'], comment_skew=options['comment_skew'],
+            attachments=options['attachments'],
+        )
+        if spec.departments < 1 or spec.categories < 1:
+            raise CommandError('Нужен хотя бы один отдел и одна категория')
+        if not 0 <= spec.attachments <= 1:
+            raise CommandError('--attachments — доля от 0 до 1')
+
+        self.started = time.monotonic()
+        try:
+            counts = seed_corpus(
+                spec, options['batch_size'], render_html=options['render_html'], progress=self.progress,
+            )
+        except CorpusExists as error:
+            raise CommandError(f'{error}; используйте пустую БД (например, через DATABASE_URL)')
+        elapsed = time.monotonic() - self.started
+        rows = sum(counts.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово: {rows} строк за {elapsed:.1f} с ({rows / elapsed:.0f} строк/с): "
+            + ', '.join(f'{model} {count}' for model, count in counts.items())
+        ))
+
+    def progress(self, model, rows):
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(f'{model}: {rows} ({elapsed:.0f} с)')
@@ -0,0 +1,99 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from kb.cache import bump_version
+from kb.importing import Lookups, RecordError, SlugAllocator, build_document, read_records
+from kb.models import Document
+
+
+class Command(BaseCommand):
+    help = 'Массовый импорт документов из JSONL, CSV или дерева каталогов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Файл .jsonl/.csv или каталог <отдел>/<категория>/<файл>')
+        parser.add_argument('--format', choices=['jsonl', 'csv', 'dir'], help='По умолчанию — по источнику')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--default-author', help='Автор для записей без поля author')
+        parser.add_argument(
+            '--create-missing', action='store_true',
+            help='Создавать отсутствующие отделы и категории',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='Файл с позицией последней сохраненной пачки (по умолчанию <source>.checkpoint)',
+        )
+        parser.add_argument('--restart', action='store_true', help='Начать сначала, игнорируя checkpoint')
+
+    def handle(self, *args, **options):
+        source = options['source']
+        if not os.path.exists(source):
+            raise CommandError(f'Источник не найден: {source}')
+        self.checkpoint_path = options['checkpoint'] or source.rstrip(os.sep) + '.checkpoint'
+        resume_after = 0 if options['restart'] else self.read_checkpoint()
+        if resume_after:
+            self.stdout.write(f'Продолжаем после позиции {resume_after}')
+
+        try:
+            lookups = Lookups(options['default_author'], options['create_missing'])
+        except RecordError as error:
+            raise CommandError(error)
+        slugs = SlugAllocator()
+
+        self.imported = self.skipped = 0
+        self.departments = set()
+        self.started = time.monotonic()
+        batch, position = [], resume_after
+        for position, record in read_records(source, options['format']):
+            if position <= resume_after:
+                continue
+            try:
+                batch.append(build_document(record, lookups, slugs))
+            except RecordError as error:
+                self.skipped += 1
+                self.stderr.write(f'Позиция {position}: {error}')
+            if len(batch) >= options['batch_size']:
+                self.write(batch, position)
+                batch = []
+        self.write(batch, position)
+
+        # Кэш списков сбрасывается один раз, а не на каждый документ
+        bump_version(*self.departments)
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: импортировано {self.imported}, пропущено {self.skipped} '
+            f'за {elapsed:.1f} с ({self.rate(elapsed)} док/с)'
+        ))
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def write(self, batch, position):
+        with transaction.atomic():
+            Document.objects.bulk_create(batch)
+        # Позиция записывается только после фиксации пачки
+        self.save_checkpoint(position)
+        self.imported += len(batch)
+        self.departments.update(document.department_id for document in batch)
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(f'Импортировано: {self.imported} ({self.rate(elapsed)} док/с)')
+
+    def rate(self, elapsed):
+        return f'{self.imported / elapsed:.0f}' if elapsed else '—'
+
+    def read_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, encoding='utf-8') as checkpoint:
+                return json.load(checkpoint)['position']
+        except FileNotFoundError:
+            return 0
+        except (ValueError, KeyError):
+            raise CommandError(f'Поврежден checkpoint {self.checkpoint_path}; запустите с --restart')
+
+    def save_checkpoint(self, position):
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as checkpoint:
+            json.dump({'position': position}, checkpoint)
+        os.replace(tmp_path, self.checkpoint_path)
@@ -0,0 +1,103 @@
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from kb.models import Blob, Document
+from kb.storage import BLOB_PREFIX, attachment_storage, blob_name, hash_file
+
+
+class Command(BaseCommand):
+    help = 'Переносит вложения в контентно-адресуемое хранилище и удаляет дубликаты'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=min(32, (os.cpu_count() or 1) + 4),
+            help='Число потоков для чтения и хеширования файлов',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать экономию')
+
+    def handle(self, *args, **options):
+        # Один файл может быть прикреплен к нескольким документам
+        documents = defaultdict(list)
+        rows = (
+            Document.objects.exclude(file='').exclude(file__isnull=True)
+            .exclude(file__startswith=BLOB_PREFIX + '/')
+            .values_list('id', 'file', 'file_name')
+        )
+        for pk, name, file_name in rows:
+            documents[name].append((pk, file_name))
+        if not documents:
+            self.stdout.write(self.style.SUCCESS('Нечего переносить'))
+            return
+
+        # Хеширование — основная работа; hashlib отпускает GIL, поэтому хватает потоков
+        with ThreadPoolExecutor(max_workers=max(options['workers'], 1)) as pool:
+            hashed = list(pool.map(self.hash, documents))
+
+        missing = [name for name, result in hashed if result is None]
+        for name in missing:
+            self.stderr.write(f'Файл не найден: {name}')
+        hashed = [(name, result) for name, result in hashed if result is not None]
+
+        total = sum(size for _, (_, size) in hashed)
+        unique = {digest: size for _, (digest, size) in hashed}
+        # Содержимое, которое уже лежит в хранилище, места не добавит
+        stored = sum(
+            size for digest, size in unique.items()
+            if not attachment_storage.exists(blob_name(digest))
+        )
+        if options['dry_run']:
+            self.report(len(hashed), total, stored)
+            return
+
+        updates = []
+        placed = set()
+        for name, (digest, size) in hashed:
+            blob, _ = attachment_storage.import_file(attachment_storage.path(name), digest)
+            placed.add(blob)
+            for pk, file_name in documents[name]:
+                updates.append(Document(
+                    pk=pk, file=blob, file_name=file_name or os.path.basename(name),
+                ))
+
+        with transaction.atomic():
+            Document.objects.bulk_update(updates, ['file', 'file_name'], batch_size=500)
+            self.recount(placed)
+
+        # Старые файлы удаляются только после фиксации ссылок на blob
+        for name, _ in hashed:
+            attachment_storage.delete(name)
+        self.remove_empty_dirs(attachment_storage.path('documents'))
+        self.report(len(hashed), total, stored)
+
+    def hash(self, name):
+        try:
+            return name, hash_file(attachment_storage.path(name))
+        except FileNotFoundError:
+            return name, None
+
+    def recount(self, blobs):
+        counts = dict(
+            Document.objects.filter(file__in=list(blobs))
+            .values_list('file').annotate(total=Count('id'))
+        )
+        for name in blobs:
+            Blob.objects.update_or_create(
+                name=name,
+                defaults={'size': attachment_storage.size(name), 'ref_count': counts.get(name, 0)},
+            )
+
+    def remove_empty_dirs(self, root):
+        for path, dirs, files in os.walk(root, topdown=False):
+            if path != root and not os.listdir(path):
+                os.rmdir(path)
+
+    def report(self, files, total, stored):
+        saved = total - stored
+        self.stdout.write(self.style.SUCCESS(
+            f'Файлов: {files}, было {total} байт, стало {stored} байт, сэкономлено {saved} байт'
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from kb.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Создает (при необходимости) и перестраивает полнотекстовый индекс документов'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        if backend.install():
+            self.stdout.write(f'Индекс создан: {type(backend).__name__}')
+        else:
+            backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Индекс перестроен: {type(backend).__name__}'))
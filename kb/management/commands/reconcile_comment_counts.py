@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from kb.models import Comment, Document
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики активных комментариев документов по частям'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        actual = Coalesce(Subquery(
+            Comment.objects.filter(document=OuterRef('pk'), is_active=True)
+            .order_by().values('document').annotate(total=Count('id')).values('total')
+        ), Value(0))
+
+        last_id = 0
+        checked = fixed = 0
+        while True:
+            ids = list(
+                Document.objects.filter(id__gt=last_id).order_by('id')
+                .values_list('id', flat=True)[:options['batch_size']]
+            )
+            if not ids:
+                break
+            with transaction.atomic():
+                # Обновляются только расходящиеся строки
+                fixed += (
+                    Document.objects.filter(id__gte=ids[0], id__lte=ids[-1])
+                    .exclude(comment_count=actual)
+                    .update(comment_count=actual)
+                )
+            last_id = ids[-1]
+            checked += len(ids)
+            self.stdout.write(f'Проверено: {checked}')
+
+        self.stdout.write(self.style.SUCCESS(f'Готово, исправлено счетчиков: {fixed}'))
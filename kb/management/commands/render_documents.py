@@ -0,0 +1,79 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from kb.cache import bump_version
+from kb.models import Document
+from kb.rendering import get_content_format, render_batch, renderer_key
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает сохраненный HTML документов в пуле процессов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Число процессов; 0 — рендерить в текущем процессе',
+        )
+        parser.add_argument('--all', action='store_true', help='Перестроить все, а не только устаревшие')
+
+    def handle(self, *args, **options):
+        content_format = get_content_format()
+        key = renderer_key(content_format)
+        queryset = Document.objects.order_by('id').values_list('id', 'content', 'updated_at', 'department_id')
+        if not options['all']:
+            queryset = queryset.exclude(content_renderer=key)
+
+        self.key = key
+        self.total = 0
+        self.read = {}
+        batches = self.read_batches(queryset, options['batch_size'])
+
+        if options['workers'] == 0:
+            for batch in batches:
+                self.write(render_batch(batch, content_format))
+        else:
+            workers = options['workers']
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                pending = set()
+                for batch in batches:
+                    pending.add(pool.submit(render_batch, batch, content_format))
+                    # Ограничиваем число пачек в памяти
+                    if len(pending) >= workers * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            self.write(future.result())
+                for future in pending:
+                    self.write(future.result())
+
+        self.stdout.write(self.style.SUCCESS(f'Готово, перестроено документов: {self.total} ({key})'))
+
+    def read_batches(self, queryset, batch_size):
+        last_id = 0
+        while True:
+            batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                return
+            last_id = batch[-1][0]
+            for pk, content, updated_at, department_id in batch:
+                self.read[pk] = (updated_at, department_id)
+            yield [(pk, content) for pk, content, updated_at, department_id in batch]
+
+    def write(self, rendered):
+        departments = set()
+        with transaction.atomic():
+            for pk, html in rendered:
+                updated_at, department_id = self.read.pop(pk)
+                # Документ, сохраненный после чтения, уже отрендерен в save(): старый HTML не пишем
+                if Document.objects.filter(pk=pk, updated_at=updated_at).update(
+                    content_html=html, content_renderer=self.key,
+                ):
+                    departments.add(department_id)
+                    self.total += 1
+        if departments:
+            # ETag страницы документа и кэш списков зависят от версии отдела
+            bump_version(*departments)
+        self.stdout.write(f'Обработано: {self.total}')
@@ -0,0 +1,89 @@
+import os
+
+from django.db.models import Q
+from django.utils import timezone
+
+from kb.cache import bump_version
+from kb.models import AttachmentPreview, Document
+from kb.previews import PREVIEW_VERSION, evict, known_digest, preview_key, preview_path, render_batch
+from kb.queue import QueueCommand
+from kb.storage import attachment_storage
+
+
+class Command(QueueCommand):
+    help = 'Рендерит миниатюры вложений в пуле процессов и ограничивает размер их кэша'
+    model = AttachmentPreview
+    fields = ('file', 'digest')
+    task = staticmethod(render_batch)
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--stale', action='store_true',
+            help='Поставить в очередь вложения без миниатюр, миниатюры старой версии '
+                 'и неподдерживаемые (после установки Pillow или pdftoppm)',
+        )
+        parser.add_argument(
+            '--prune', action='store_true',
+            help='Удалить миниатюры файлов, на которые больше не ссылается ни один документ',
+        )
+
+    def handle(self, *args, **options):
+        if options['stale']:
+            self.stdout.write(f'Поставлено в очередь: {self.requeue()}')
+        if options['prune']:
+            self.stdout.write(f'Удалено миниатюр без вложений: {self.prune()}')
+        super().handle(*args, **options)
+
+    def after_pass(self):
+        evicted = evict()
+        if evicted:
+            self.stdout.write(f'Вытеснено из кэша: {len(evicted)}')
+
+    def requeue(self):
+        # Вложения, загруженные до появления миниатюр
+        missing = (
+            Document.objects.exclude(file='').exclude(file__isnull=True)
+            .exclude(file__in=AttachmentPreview.objects.values('file'))
+            .values_list('file', flat=True).distinct()
+        )
+        created = AttachmentPreview.objects.bulk_create(
+            [AttachmentPreview(file=name, digest=known_digest(name)) for name in missing.iterator()],
+            batch_size=500, ignore_conflicts=True,
+        )
+        stale = AttachmentPreview.objects.exclude(status=AttachmentPreview.PENDING).filter(
+            ~Q(version=PREVIEW_VERSION) | Q(status=AttachmentPreview.UNSUPPORTED),
+        )
+        return len(created) + stale.update(
+            status=AttachmentPreview.PENDING, attempts=0, last_error='', next_attempt_at=timezone.now(),
+        )
+
+    def prune(self):
+        # NOT IN с NULL в подзапросе не выбрал бы ни одной строки
+        files = Document.objects.exclude(file__isnull=True).values('file')
+        orphans = AttachmentPreview.objects.exclude(file__in=files)
+        removed = 0
+        for preview in orphans.iterator():
+            if preview.digest:
+                try:
+                    os.remove(preview_path(preview_key(preview.digest)))
+                except FileNotFoundError:
+                    pass
+            removed += 1
+        orphans.delete()
+        return removed
+
+    def item(self, row):
+        pk, name, digest = row
+        return pk, attachment_storage.path(name), os.path.basename(name), digest
+
+    def result_fields(self, row, status, value):
+        return {'digest': value or '', 'version': PREVIEW_VERSION}
+
+    def label(self, row):
+        return row[1]
+
+    def finished(self, rows):
+        # Списки документов с этими вложениями должны показать миниатюру
+        documents = Document.objects.filter(file__in=[row[1] for row in rows])
+        bump_version(*documents.values_list('department_id', flat=True))
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from kb.bulk import claim, purge_chunks, run
+from kb.models import BulkAction
+
+
+class Command(BaseCommand):
+    help = 'Выполняет массовые действия админки из очереди по частям'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Работать постоянно, опрашивая очередь')
+        parser.add_argument('--interval', type=int, default=5, help='Пауза при пустой очереди, секунд')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            # Части действий, отмененных до начала выполнения
+            purge_chunks()
+            bulk_action = claim()
+            if bulk_action is not None:
+                self.stdout.write(f'{bulk_action.description}: {bulk_action.total} объектов')
+                try:
+                    status = run(bulk_action)
+                except Exception as exc:
+                    # Действие помечено как упавшее; воркер продолжает с остальными
+                    self.stderr.write(f'{bulk_action.description}: {exc}')
+                else:
+                    self.stdout.write(
+                        f'{bulk_action.description}: {bulk_action.get_status_display().lower()}, '
+                        f'изменено {bulk_action.changed} из {bulk_action.processed}',
+                    )
+                    total += status == BulkAction.DONE
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f'Готово, выполнено действий: {total}'))
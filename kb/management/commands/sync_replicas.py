@@ -0,0 +1,47 @@
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from kb.routers import replicas
+
+
+class Command(BaseCommand):
+    help = (
+        'Копирует основную SQLite-БД в файлы реплик: локальная замена репликации для проверки '
+        'разделения чтения и записи (для PostgreSQL используйте потоковую репликацию)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Копировать постоянно, имитируя отставание')
+        parser.add_argument('--interval', type=float, default=5, help='Пауза между копиями, секунд')
+
+    def handle(self, *args, **options):
+        aliases = replicas()
+        if not aliases:
+            raise CommandError('Реплики не настроены: задайте DATABASE_REPLICA_URLS')
+        for alias in [DEFAULT_DB_ALIAS, *aliases]:
+            if connections[alias].vendor != 'sqlite':
+                raise CommandError(f'{alias}: копирование поддерживается только для SQLite')
+
+        while True:
+            started = time.monotonic()
+            for alias in aliases:
+                self.copy(
+                    connections[DEFAULT_DB_ALIAS].settings_dict['NAME'], connections[alias].settings_dict['NAME'],
+                )
+            self.stdout.write(f"Реплики обновлены: {', '.join(aliases)} ({time.monotonic() - started:.2f} с)")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def copy(self, source_path, target_path):
+        # Backup API копирует согласованный снимок, не останавливая запись в основную БД
+        source = sqlite3.connect(source_path)
+        target = sqlite3.connect(target_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
@@ -0,0 +1,258 @@
+"""Операционные метрики в текстовом формате Prometheus.
+
+Каждый процесс (воркер gunicorn) копит приращения в памяти, и фоновый
+поток раз в ``KB_METRICS_FLUSH_INTERVAL`` секунд сбрасывает их в свой
+SQLite-файл в каталоге ``KB_METRICS_DIR``. ``/metrics`` суммирует файлы всех процессов,
+поэтому счетчики сходятся независимо от того, какой воркер ответил на
+запрос. Файлы завершившихся процессов остаются и продолжают входить в
+сумму (счетчики монотонны); каталог очищается перед запуском сервера,
+как и для multiprocess-режима prometheus_client. Без ``KB_METRICS_DIR``
+метрики выключены и запись ничего не стоит.
+
+Число документов и комментариев по отделам в хранилище не пишется:
+оно считается при опросе одним агрегатным запросом и кэшируется.
+"""
+import atexit
+import glob
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Count, Sum
+
+# Имя: (тип, описание). Гистограмма хранится счетчиками _bucket, _sum и _count
+METRICS = {
+    'kb_http_request_duration_seconds': ('histogram', 'Время обработки запроса по имени маршрута'),
+    'kb_http_requests_total': ('counter', 'Запросы по имени маршрута и классу статуса'),
+    'kb_db_queries_total': ('counter', 'SQL-запросы по имени маршрута'),
+    'kb_db_query_seconds_total': ('counter', 'Время SQL-запросов по имени маршрута'),
+    'kb_fragment_cache_requests_total': ('counter', 'Обращения к кэшу фрагментов: hit или miss'),
+    'kb_upload_bytes_total': ('counter', 'Байты, принятые при загрузке вложений'),
+    'kb_download_bytes_total': ('counter', 'Байты вложений, отданные при скачивании'),
+    'kb_department_documents': ('gauge', 'Документы отдела'),
+    'kb_department_comments': ('gauge', 'Активные комментарии к документам отдела'),
+}
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, math.inf)
+COUNTS_CACHE_KEY = 'kb:metrics:department_counts'
+
+
+def _key(name, labels):
+    return name, json.dumps(labels, sort_keys=True, ensure_ascii=False)
+
+
+def metrics_dir():
+    return getattr(settings, 'KB_METRICS_DIR', None)
+
+
+class MetricsStore:
+    """Приращения метрик одного процесса и их файл в каталоге метрик."""
+
+    def __init__(self, directory):
+        self.directory = str(directory)
+        self.lock = threading.Lock()
+        self.pid = None
+        self.connection = None
+        self.pending = {}
+        self.flushed_at = 0.0
+
+    def _reset_after_fork(self):
+        # После fork приращения родителя уже записаны в его файл, а соединение и поток не наследуются
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.connection = None
+            self.pending = {}
+            threading.Thread(target=self._flush_loop, name='kb-metrics-flush', daemon=True).start()
+
+    def _flush_loop(self):
+        # Воркер может долго простаивать: приращения пишутся по таймеру, а не в конце запроса
+        while True:
+            time.sleep(max(getattr(settings, 'KB_METRICS_FLUSH_INTERVAL', 1.0), 0.1))
+            try:
+                self.flush(force=True)
+            except sqlite3.Error:
+                pass
+
+    def _connect(self):
+        if self.connection is None:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f'metrics-{self.pid}.sqlite3')
+            self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=OFF')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS samples '
+                '(name TEXT NOT NULL, labels TEXT NOT NULL, value REAL NOT NULL, PRIMARY KEY (name, labels))'
+            )
+        return self.connection
+
+    def inc(self, name, labels, amount):
+        key = _key(name, labels)
+        with self.lock:
+            self._reset_after_fork()
+            self.pending[key] = self.pending.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        with self.lock:
+            self._reset_after_fork()
+            for bound in BUCKETS:
+                if value <= bound:
+                    key = _key(f'{name}_bucket', {**labels, 'le': bound})
+                    self.pending[key] = self.pending.get(key, 0) + 1
+            for suffix, amount in (('_sum', value), ('_count', 1)):
+                key = _key(f'{name}{suffix}', labels)
+                self.pending[key] = self.pending.get(key, 0) + amount
+
+    def flush(self, force=False):
+        interval = getattr(settings, 'KB_METRICS_FLUSH_INTERVAL', 1.0)
+        with self.lock:
+            self._reset_after_fork()
+            if not self.pending or (not force and time.monotonic() - self.flushed_at < interval):
+                return
+            pending, self.pending = self.pending, {}
+            connection = self._connect()
+            connection.execute('BEGIN')
+            connection.executemany(
+                'INSERT INTO samples (name, labels, value) VALUES (?, ?, ?) '
+                'ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value',
+                [(name, labels, value) for (name, labels), value in pending.items()],
+            )
+            connection.execute('COMMIT')
+            self.flushed_at = time.monotonic()
+
+    def collect(self):
+        """Суммы по файлам всех процессов: {(имя, labels_json): значение}."""
+        self.flush(force=True)
+        totals = {}
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.sqlite3')):
+            try:
+                source = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+                try:
+                    rows = source.execute('SELECT name, labels, value FROM samples').fetchall()
+                finally:
+                    source.close()
+            except sqlite3.Error:
+                # Файл только что создан другим процессом и еще без таблицы
+                continue
+            for name, labels, value in rows:
+                totals[(name, labels)] = totals.get((name, labels), 0) + value
+        return totals
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store():
+    directory = metrics_dir()
+    if not directory:
+        return None
+    store = _stores.get(str(directory))
+    if store is None:
+        with _stores_lock:
+            store = _stores.setdefault(str(directory), MetricsStore(directory))
+    return store
+
+
+def inc(name, amount=1, **labels):
+    store = get_store()
+    if store is not None:
+        store.inc(name, labels, amount)
+
+
+def observe(name, value, **labels):
+    store = get_store()
+    if store is not None:
+        store.observe(name, labels, value)
+
+
+def flush(force=False):
+    store = get_store()
+    if store is not None:
+        store.flush(force)
+
+
+@atexit.register
+def _flush_all():
+    for store in list(_stores.values()):
+        try:
+            store.flush(force=True)
+        except sqlite3.Error:
+            pass
+
+
+def department_counts():
+    """[(отдел, документы, комментарии)]; кэшируется на KB_METRICS_COUNTS_TIMEOUT секунд."""
+    from .cache import get_cache
+    from .models import Document
+
+    cache = get_cache()
+    counts = cache.get(COUNTS_CACHE_KEY)
+    if counts is None:
+        # comment_count уже хранится в документе: комментарии не читаются
+        counts = [
+            (row['department__name'] or '', row['documents'], row['comments'] or 0)
+            for row in Document.objects.order_by().values('department__name')
+            .annotate(documents=Count('id'), comments=Sum('comment_count'))
+        ]
+        cache.set(COUNTS_CACHE_KEY, counts, getattr(settings, 'KB_METRICS_COUNTS_TIMEOUT', 60))
+    return counts
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for key, value in sorted(labels.items(), key=lambda item: (item[0] == 'le', item[0])):
+        if key == 'le':
+            value = '+Inf' if value == math.inf else repr(float(value))
+        parts.append(f'{key}="{_escape(value)}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _sort_key(row):
+    # Корзины гистограммы идут по возрастанию границы
+    name, labels, _ = row
+    return name, _key('', {k: v for k, v in labels.items() if k != 'le'})[1], labels.get('le', 0)
+
+
+def _family(name):
+    for suffix in ('_bucket', '_sum', '_count'):
+        base = name[:-len(suffix)]
+        if name.endswith(suffix) and METRICS.get(base, ('',))[0] == 'histogram':
+            return base
+    return name
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus 0.0.4."""
+    samples = {}
+    for (name, labels), value in get_store().collect().items():
+        samples.setdefault(_family(name), []).append((name, json.loads(labels), value))
+    for department, documents, comments in department_counts():
+        samples.setdefault('kb_department_documents', []).append(
+            ('kb_department_documents', {'department': department}, documents),
+        )
+        samples.setdefault('kb_department_comments', []).append(
+            ('kb_department_comments', {'department': department}, comments),
+        )
+
+    lines = []
+    for family, (kind, description) in METRICS.items():
+        lines.append(f'# HELP {family} {description}')
+        lines.append(f'# TYPE {family} {kind}')
+        rows = sorted(samples.get(family, ()), key=_sort_key)
+        for name, labels, value in rows:
+            lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,201 @@
+import cProfile
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils import timezone
+from django.utils.deprecation import MiddlewareMixin
+
+from . import metrics, profiling, tracing
+from .routers import PRIMARY_COOKIE, SAFE_METHODS, replica_lag, replicas
+
+
+class PrimaryAfterWriteMiddleware(MiddlewareMixin):
+    """После изменяющего запроса пользователь какое-то время читает с основной БД.
+
+    Признак хранится в cookie: он истекает сам и не требует запросов к БД.
+    """
+
+    def process_response(self, request, response):
+        if request.method not in SAFE_METHODS and replicas():
+            response.set_cookie(PRIMARY_COOKIE, '1', max_age=replica_lag(), httponly=True, samesite='Lax')
+        return response
+
+
+class TracingMiddleware:
+    """Основа middleware, которым нужны замеры запроса из kb.tracing.
+
+    Подкласс решает в ``enabled``, нужен ли он (иначе исключается из цепочки
+    при загрузке и ничего не стоит), и получает замеры в ``finish``.
+    Несколько таких middleware делят одни замеры на запрос.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not self.enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        tracing.install()
+        self.sync_connections_instrumented = False
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def enabled(self):
+        raise NotImplementedError
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with tracing.tracing() as trace:
+            response = self.get_response(request)
+            return self.finish(request, response, trace)
+
+    async def __acall__(self, request):
+        if not self.sync_connections_instrumented:
+            # ORM async-представлений работает в другом потоке; его соединение могло открыться раньше
+            await sync_to_async(tracing.instrument_connections)()
+            self.sync_connections_instrumented = True
+        with tracing.tracing() as trace:
+            response = await self.get_response(request)
+            return self.finish(request, response, trace)
+
+    def finish(self, request, response, trace):
+        raise NotImplementedError
+
+
+class MetricsMiddleware(TracingMiddleware):
+    """Время, статусы и число SQL-запросов по имени маршрута (см. kb.metrics).
+
+    Включается ``KB_METRICS_DIR``; стоит первой в MIDDLEWARE.
+    """
+
+    def enabled(self):
+        return bool(metrics.metrics_dir())
+
+    def finish(self, request, response, trace):
+        view = route_name(request)
+        metrics.observe('kb_http_request_duration_seconds', trace.elapsed(), view=view)
+        metrics.inc('kb_http_requests_total', view=view, status=f'{response.status_code // 100}xx')
+        metrics.inc('kb_db_queries_total', trace.sql_count, view=view)
+        metrics.inc('kb_db_query_seconds_total', trace.durations['sql'], view=view)
+        return response
+
+
+def route_name(request):
+    """Имя маршрута для меток: имена из kb.urls, для админки и прочих пространств имен — само пространство."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.namespace or match.url_name or 'unnamed'
+
+
+class RequestTimingMiddleware(TracingMiddleware):
+    """Замеры запроса: заголовок Server-Timing и выборочная JSONL-трасса.
+
+    Включается ``KB_REQUEST_TIMING``; стоит в начале MIDDLEWARE, чтобы время
+    включало остальные middleware.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.sample_rate = getattr(settings, 'KB_REQUEST_TRACE_SAMPLE_RATE', 0.01)
+        self.logger = tracing.trace_logger()
+
+    def enabled(self):
+        return getattr(settings, 'KB_REQUEST_TIMING', False)
+
+    def finish(self, request, response, trace):
+        total = trace.elapsed()
+        response['Server-Timing'] = tracing.server_timing(trace, total)
+        if self.logger and random.random() < self.sample_rate:
+            tracing.write_record(self.logger, tracing.trace_record(request, response, trace, total))
+        return response
+
+
+class ProfilingMiddleware:
+    """Профиль запроса cProfile по флагу сотрудника или по выборке (см. kb.profiling).
+
+    Стоит после AuthenticationMiddleware: пользователь проверяется, только
+    когда профиль запрошен или запрос попал в выборку. Под ASGI профиль
+    снимается в потоке цикла событий и одновременно только один: в него
+    попадают и другие корутины, работающие в это время, но не ORM в потоках.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'KB_PROFILING', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_busy = False
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def reason(self, request):
+        """Почему запрос стоит профилировать (до проверки пользователя)."""
+        if profiling.requested(request):
+            return 'requested'
+        # Настройки читаются на каждый запрос: выборку можно менять без перезапуска
+        sample_rate = getattr(settings, 'KB_PROFILE_SAMPLE_RATE', 0)
+        if sample_rate and random.random() < sample_rate:
+            return 'sampled'
+        return None
+
+    def allowed(self, request, reason):
+        user = request.user
+        if reason == 'requested':
+            return user.is_active and user.is_staff
+        departments = getattr(settings, 'KB_PROFILE_DEPARTMENTS', ())
+        return not departments or getattr(user, 'department_id', None) in departments
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        reason = self.reason(request)
+        if not reason or not self.allowed(request, reason):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        response = profiler.runcall(self.profiled, request)
+        return self.save(request, response, profiler, reason, time.perf_counter() - started)
+
+    def profiled(self, request):
+        # Корень графа вызовов: обертки get_response вызывают друг друга по цепочке
+        # middleware, и у них самих всегда есть вызывающий
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        reason = self.reason(request)
+        if not reason or self.async_busy or not await sync_to_async(self.allowed)(request, reason):
+            return await self.get_response(request)
+
+        self.async_busy = True
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiler.disable()
+            self.async_busy = False
+        return await sync_to_async(self.save)(request, response, profiler, reason, time.perf_counter() - started)
+
+    def save(self, request, response, profiler, reason, duration):
+        match = getattr(request, 'resolver_match', None)
+        name = profiling.save_profile(profiler, {
+            'created': timezone.now().isoformat(),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'view': match.view_name if match else None,
+            'user': request.user.get_username(),
+            'department_id': getattr(request.user, 'department_id', None),
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'reason': reason,
+        })
+        response[profiling.PROFILE_HEADER] = name
+        return response
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def install_index(apps, schema_editor):
+    from kb.search import get_search_backend
+    get_search_backend().install()
+
+
+def uninstall_index(apps, schema_editor):
+    from kb.search import get_search_backend
+    get_search_backend().uninstall()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kb', '0005_comment_link'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_index, uninstall_index),
+    ]
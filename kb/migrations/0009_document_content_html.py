@@ -0,0 +1,23 @@
+# Generated by Django 4.2.13 on 2026-10-18 02:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kb', '0008_document_excerpt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='content_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='content_renderer',
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+    ]
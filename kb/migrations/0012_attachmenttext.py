@@ -0,0 +1,32 @@
+# Generated by Django 4.2.13 on 2026-10-18 02:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kb', '0011_content_addressable_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttachmentText',
+            fields=[
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='attachment_text', serialize=False, to='kb.document')),
+                ('file', models.CharField(max_length=100)),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('done', 'Извлечен'), ('failed', 'Ошибка'), ('unsupported', 'Формат не поддерживается')], default='pending', max_length=12)),
+                ('text', models.TextField(blank=True)),
+                ('extractor_version', models.PositiveSmallIntegerField(default=0)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='kb_attachtext_queue_idx')],
+            },
+        ),
+    ]
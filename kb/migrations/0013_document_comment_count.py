@@ -0,0 +1,35 @@
+# Generated by Django 4.2.13 on 2026-10-18 02:48
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_comment_counts(apps, schema_editor):
+    Document = apps.get_model('kb', 'Document')
+    Comment = apps.get_model('kb', 'Comment')
+    active = (
+        Comment.objects.filter(document=OuterRef('pk'), is_active=True)
+        .order_by().values('document').annotate(total=Count('id')).values('total')
+    )
+    Document.objects.update(comment_count=Coalesce(Subquery(active), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kb', '0012_attachmenttext'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['comment_count', 'id'], name='kb_document_comments_idx'),
+        ),
+        migrations.RunPython(fill_comment_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.13 on 2026-10-18 03:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kb', '0013_document_comment_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttachmentPreview',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.CharField(max_length=100, unique=True)),
+                ('digest', models.CharField(blank=True, max_length=64)),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('done', 'Готова'), ('failed', 'Ошибка'), ('unsupported', 'Формат не поддерживается')], default='pending', max_length=12)),
+                ('version', models.PositiveSmallIntegerField(default=0)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='kb_preview_queue_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.13 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kb', '0016_bulkaction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='released_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
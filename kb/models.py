@@ -1,11 +1,24 @@
+import datetime
 import time
+import uuid
 import os
-from django.db import models
-from django.utils.text import slugify
+from django.conf import settings
+from django.db import connections, models, transaction
+from django.db.models import F, Max, Min, OuterRef, Q, Subquery, Value
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.text import Truncator, slugify
 from django.core.validators import FileExtensionValidator
 from django.contrib.auth.models import AbstractUser
+from django.utils.safestring import mark_safe
 from unidecode import unidecode
 
+from .access import policy_for
+from .previews import PREVIEW_VERSION, known_digest, preview_key
+from .rendering import get_content_format, render_content, renderer_key
+from .storage import get_attachment_storage
+
 # === DEPARTMENT ===
 class Department(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -54,43 +67,237 @@ def document_upload_path(instance, filename):
     return f'documents/{instance.department.slug}/{instance.category.name}/{filename}'
 
 # === DOCUMENT ===
+EXCERPT_WORDS = 30
+
+
+def document_slug_base(title):
+    """Транслитерация + slugify"""
+    return slugify(unidecode(title))
+
+
+def _periods(first, last, kind):
+    """Начала лет/месяцев/дней от first до last и начала следующих периодов."""
+    start = datetime.datetime(first.year, first.month if kind != 'year' else 1,
+                              first.day if kind == 'day' else 1)
+    while start <= last:
+        if kind == 'year':
+            end = start.replace(year=start.year + 1)
+        elif kind == 'month':
+            end = start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+        else:
+            end = start + datetime.timedelta(days=1)
+        yield start, end
+        start = end
+
+
+class ProbedDatesQuerySetMixin:
+    """``datetimes()`` для иерархии дат в админке без полного просмотра таблицы.
+
+    Вместо DISTINCT по усеченной дате (вычисляется для каждой строки) берутся
+    MIN и MAX поля, и каждый год, месяц или день между ними проверяется
+    запросом EXISTS по диапазону — это поиск по индексу на поле даты.
+    Результат — список, а не QuerySet; если периодов больше ``max_date_probes``,
+    работает обычный ``datetimes()``.
+    """
+    max_date_probes = 400
+
+    def aggregate(self, *args, **kwargs):
+        # SQLite берет MIN или MAX из индекса, только если агрегат в запросе один и
+        # условий нет: MIN и MAX вместе (начало иерархии дат) просматривают весь индекс
+        if (
+            connections[self.db].vendor == 'sqlite' and not self.query.where and not args
+            and len(kwargs) > 1 and all(type(value) in (Min, Max) for value in kwargs.values())
+        ):
+            return {key: super(ProbedDatesQuerySetMixin, self).aggregate(**{key: value})[key]
+                    for key, value in kwargs.items()}
+        return super().aggregate(*args, **kwargs)
+
+    def datetimes(self, field_name, kind, order='ASC', tzinfo=None, is_dst=timezone.NOT_PASSED):
+        if kind not in ('year', 'month', 'day') or LOOKUP_SEP in field_name:
+            return super().datetimes(field_name, kind, order, tzinfo, is_dst)
+        bounds = self.aggregate(first=Min(field_name), last=Max(field_name))
+        if bounds['first'] is None:
+            return []
+        tz = None
+        if settings.USE_TZ:
+            tz = tzinfo or timezone.get_current_timezone()
+            bounds = {key: timezone.localtime(value, tz) for key, value in bounds.items()}
+        first, last = (value.replace(tzinfo=None) for value in bounds.values())
+        periods = list(_periods(first, last, kind))
+        if len(periods) > self.max_date_probes:
+            return super().datetimes(field_name, kind, order, tzinfo, is_dst)
+
+        def aware(value):
+            return timezone.make_aware(value, tz) if tz else value
+
+        found = [
+            aware(start) for start, end in periods
+            if self.filter(**{f'{field_name}__gte': aware(start), f'{field_name}__lt': aware(end)}).exists()
+        ]
+        return found[::-1] if order == 'DESC' else found
+
+
+class DocumentQuerySet(ProbedDatesQuerySetMixin, models.QuerySet):
+    def visible_to(self, user):
+        """Документы, доступные пользователю (правила в kb.access.AccessPolicy)."""
+        return policy_for(user).filter_documents(self)
+
+    def with_preview(self):
+        """Добавляет preview_digest — хеш готовой миниатюры вложения (или None)."""
+        previews = AttachmentPreview.objects.filter(
+            file=OuterRef('file'), status=AttachmentPreview.DONE, version=PREVIEW_VERSION,
+        )
+        return self.annotate(preview_digest=Subquery(previews.values('digest')[:1]))
+
+
 class Document(models.Model):
     title = models.CharField(max_length=200)
     slug = models.SlugField(max_length=200, unique=True, blank=True)
     content = models.TextField()
+    # Вычисляются при сохранении, чтобы списки не загружали content целиком
+    excerpt = models.TextField(blank=True, editable=False)
+    word_count = models.PositiveIntegerField(default=0, editable=False)
+    # HTML рендерится при сохранении; content_renderer — ключ версии рендерера
+    content_html = models.TextField(blank=True, editable=False)
+    content_renderer = models.CharField(max_length=32, blank=True, editable=False)
     author = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     department = models.ForeignKey(Department, on_delete=models.CASCADE)
     file = models.FileField(
         upload_to=document_upload_path,
+        storage=get_attachment_storage,
         validators=[FileExtensionValidator(['pdf', 'doc', 'docx', 'jpg', 'jpeg', 'png'])],
         blank=True,
         null=True
     )
+    # Исходное имя вложения: сам файл хранится под хешем содержимого
+    file_name = models.CharField(max_length=255, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_published = models.BooleanField(default=True)
+    # Число активных комментариев; обновляется через F() (см. signals и CommentQuerySet)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = DocumentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Порядок выдачи списка и ключ постраничной навигации
+            models.Index(fields=['-created_at', '-id'], name='kb_document_created_idx'),
+            # Список сотрудника: опубликованные документы отдела (или категории) в порядке выдачи,
+            # без сортировки; неопубликованные в индекс не попадают
+            models.Index(
+                fields=['department', '-created_at', '-id'], condition=Q(is_published=True),
+                name='kb_document_dept_pub_idx',
+            ),
+            models.Index(
+                fields=['category', '-created_at', '-id'], condition=Q(is_published=True),
+                name='kb_document_cat_pub_idx',
+            ),
+            # Сортировка и фильтр по числу комментариев в админке
+            models.Index(fields=['comment_count', 'id'], name='kb_document_comments_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Исходный отдел нужен сигналам при переносе документа в другой отдел
+        instance._loaded_department_id = instance.__dict__.get('department_id')
+        # Прежний файл нужен для подсчета ссылок на blob
+        instance._loaded_file_name = instance.__dict__.get('file') or ''
+        return instance
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            # Транслитерация + slugify
-            base_slug = slugify(unidecode(self.title))
+            base_slug = document_slug_base(self.title)
             unique_slug = base_slug
             timestamp = int(time.time())
             while Document.objects.filter(slug=unique_slug).exists():
                 unique_slug = f"{base_slug}-{timestamp}"
                 timestamp += 1
             self.slug = unique_slug
+        if self.file and not self.file._committed:
+            self.file_name = os.path.basename(self.file.name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'content' in update_fields:
+            self.update_excerpt()
+            self.render_content()
+            if update_fields is not None:
+                kwargs['update_fields'] = {
+                    *update_fields, 'excerpt', 'word_count', 'content_html', 'content_renderer',
+                }
         super().save(*args, **kwargs)
 
+    def update_excerpt(self):
+        """Пересчитывает анонс (как truncatewords:30) и число слов."""
+        self.excerpt = Truncator(self.content).words(EXCERPT_WORDS, truncate=' …')
+        self.word_count = len(self.content.split())
+
+    def render_content(self):
+        content_format = get_content_format()
+        self.content_html = render_content(self.content, content_format)
+        self.content_renderer = renderer_key(content_format)
+
+    def get_content_html(self):
+        """HTML текста; при смене версии рендерера перестраивается и сохраняется."""
+        if self.content_renderer != renderer_key():
+            self.render_content()
+            Document.objects.filter(pk=self.pk).update(
+                content_html=self.content_html,
+                content_renderer=self.content_renderer,
+            )
+        return mark_safe(self.content_html)
+
+
+    def get_file_name(self):
+        return (self.file_name or os.path.basename(self.file.name)) if self.file else ''
+
+    def preview_key(self):
+        """Имя миниатюры для URL; только для выборок через with_preview()."""
+        digest = getattr(self, 'preview_digest', None)
+        return preview_key(digest) if digest else None
 
     def extension(self):
-        return os.path.splitext(self.file.name)[1][1:].lower() if self.file else None
+        return os.path.splitext(self.get_file_name())[1][1:].lower() if self.file else None
 
     def __str__(self):
         return self.title
 
 # === COMMENT ===
+def change_comment_counts(deltas):
+    """Атомарно меняет счетчики: ``deltas`` — {document_id: изменение}."""
+    by_delta = {}
+    for document_id, delta in deltas.items():
+        if delta:
+            by_delta.setdefault(delta, []).append(document_id)
+    # Один UPDATE на каждое значение изменения, а не на каждый документ
+    for delta, document_ids in by_delta.items():
+        Document.objects.filter(pk__in=document_ids).update(
+            comment_count=Greatest(F('comment_count') + delta, Value(0)),
+        )
+
+
+class CommentQuerySet(ProbedDatesQuerySetMixin, models.QuerySet):
+    def set_active(self, is_active):
+        """queryset.update(is_active=...) с пересчетом счетчиков документов."""
+        with transaction.atomic():
+            # Блокируем строки, чтобы параллельное переключение не посчиталось дважды
+            changed = list(
+                self.exclude(is_active=is_active).select_for_update().values_list('pk', 'document_id')
+            )
+            pks = [pk for pk, _ in changed]
+            updated = 0
+            for start in range(0, len(pks), 500):
+                updated += self.model.objects.filter(pk__in=pks[start:start + 500]).update(
+                    is_active=is_active,
+                )
+            deltas = {}
+            for _, document_id in changed:
+                deltas[document_id] = deltas.get(document_id, 0) + (1 if is_active else -1)
+            change_comment_counts(deltas)
+        return updated
+
+
 class Comment(models.Model):
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='comments')
     author = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
@@ -99,5 +306,217 @@ class Comment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
 
+    objects = CommentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Активные комментарии документа по порядку: страница документа, JSON-лента
+            # и время последнего комментария для ETag
+            models.Index(
+                fields=['document', 'created_at', 'id'], condition=Q(is_active=True),
+                name='kb_comment_active_idx',
+            ),
+            # Иерархия дат и выдача по дате в админке комментариев
+            models.Index(fields=['created_at', 'id'], name='kb_comment_created_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Прежнее состояние нужно для счетчика комментариев документа
+        instance._loaded_state = (instance.__dict__.get('document_id'), instance.__dict__.get('is_active'))
+        return instance
+
     def __str__(self):
         return f"Комментарий {self.id} к документу {self.document.title}"
+
+# === BLOB ===
+class Blob(models.Model):
+    """Файл в контентно-адресуемом хранилище и число документов, ссылающихся на него."""
+    name = models.CharField(max_length=100, unique=True)
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    # Когда ушла последняя ссылка; файл удаляется, только если blob с тех пор не подхватили
+    released_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count})"
+
+# === ATTACHMENT TEXT ===
+class AttachmentText(models.Model):
+    """Текст вложения для поиска и очередь его извлечения.
+
+    Хранится отдельно от Document, чтобы списки документов не читали его.
+    """
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    UNSUPPORTED = 'unsupported'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (DONE, 'Извлечен'),
+        (FAILED, 'Ошибка'),
+        (UNSUPPORTED, 'Формат не поддерживается'),
+    )
+
+    document = models.OneToOneField(
+        Document, on_delete=models.CASCADE, primary_key=True, related_name='attachment_text',
+    )
+    file = models.CharField(max_length=100)
+    status = models.CharField(max_length=12, choices=STATUSES, default=PENDING)
+    text = models.TextField(blank=True)
+    extractor_version = models.PositiveSmallIntegerField(default=0)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='kb_attachtext_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"Текст вложения {self.document_id} ({self.status})"
+
+    @classmethod
+    def enqueue(cls, document_id, file):
+        """Ставит вложение в очередь; прежний текст относится к старому файлу."""
+        cls.objects.update_or_create(document_id=document_id, defaults={
+            'file': file, 'status': cls.PENDING, 'text': '', 'attempts': 0,
+            'next_attempt_at': timezone.now(), 'last_error': '',
+        })
+
+class AttachmentPreview(models.Model):
+    """Миниатюра вложения и очередь ее рендеринга (см. kb.previews).
+
+    Привязана к файлу, а не к документу: одинаковые вложения разных
+    документов хранятся одним blob и получают одну миниатюру.
+    """
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    UNSUPPORTED = 'unsupported'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (DONE, 'Готова'),
+        (FAILED, 'Ошибка'),
+        (UNSUPPORTED, 'Формат не поддерживается'),
+    )
+
+    file = models.CharField(max_length=100, unique=True)
+    # SHA-256 содержимого; для вложений вне blobs/ вычисляется при рендеринге
+    digest = models.CharField(max_length=64, blank=True)
+    status = models.CharField(max_length=12, choices=STATUSES, default=PENDING)
+    version = models.PositiveSmallIntegerField(default=0)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='kb_preview_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"Миниатюра {self.file} ({self.status})"
+
+    @classmethod
+    def enqueue(cls, file):
+        """Ставит файл в очередь, если миниатюры для него еще нет."""
+        cls.objects.get_or_create(file=file, defaults={'digest': known_digest(file)})
+
+    @classmethod
+    def requeue(cls, file):
+        """Миниатюра вытеснена из кэша: рендерим заново."""
+        cls.objects.filter(file=file, status=cls.DONE).update(
+            status=cls.PENDING, attempts=0, next_attempt_at=timezone.now(),
+        )
+
+# === UPLOAD SESSION ===
+class UploadSession(models.Model):
+    """Загрузка вложения частями: куски пишутся в staging-файл по порядку."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    received = models.PositiveBigIntegerField(default=0)
+    content_type = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Загрузка {self.filename} ({self.received}/{self.size})"
+
+    @property
+    def is_complete(self):
+        return self.received == self.size
+
+
+# === BULK ACTION ===
+class BulkAction(models.Model):
+    """Массовое действие админки, выполняемое в фоне частями (см. kb.bulk).
+
+    Выбранные id хранятся в ``BulkActionChunk`` по KB_BULK_ACTION_BATCH_SIZE
+    штук; команда ``run_bulk_actions`` применяет действие к одной части за
+    транзакцию и удаляет ее, поэтому прогресс переживает падение воркера.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    CANCELLED = 'cancelled'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Завершено'),
+        (CANCELLED, 'Отменено'),
+        (FAILED, 'Ошибка'),
+    )
+    ACTIVE = (PENDING, RUNNING)
+
+    action = models.CharField(max_length=50)
+    params = models.JSONField(default=dict, blank=True)
+    description = models.CharField(max_length=255)
+    created_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True)
+    status = models.CharField(max_length=12, choices=STATUSES, default=PENDING)
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    changed = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Пока не истекло, действие выполняет воркер; после его падения действие подхватит другой
+    lease_until = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'массовое действие'
+        verbose_name_plural = 'массовые действия'
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='kb_bulkaction_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.description} ({self.processed}/{self.total})"
+
+    @property
+    def is_active(self):
+        return self.status in self.ACTIVE
+
+    @property
+    def percent(self):
+        return int(self.processed * 100 / self.total) if self.total else 100
+
+
+class BulkActionChunk(models.Model):
+    """Еще не обработанная часть выбранных объектов массового действия."""
+    bulk_action = models.ForeignKey(BulkAction, on_delete=models.CASCADE, related_name='chunks')
+    ids = models.JSONField()
+
+    def __str__(self):
+        return f"Часть {self.pk} действия {self.bulk_action_id}"
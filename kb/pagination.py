@@ -0,0 +1,261 @@
+"""Постраничный вывод по ключу (keyset/cursor pagination).
+
+Вместо OFFSET страница выбирается условием «после последней строки предыдущей
+страницы» по упорядоченному набору полей, поэтому стоимость запроса зависит
+только от размера страницы, а не от глубины листания.
+
+Для админки, где нужны номера страниц, — ``EstimatedCountPaginator``: он не
+считает COUNT(*) по всей выборке, если строк больше порога.
+"""
+import base64
+import binascii
+import datetime
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from .cache import get_cache
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _encode_value(value):
+    # DjangoJSONEncoder обрезает микросекунды, а для курсора нужна точность
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f'Значение {value!r} нельзя сохранить в курсоре')
+
+
+def encode_cursor(values, direction):
+    payload = json.dumps({'v': values, 'd': direction}, default=_encode_value, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values, direction = payload['v'], payload['d']
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise InvalidCursor(token)
+    if direction not in ('next', 'prev') or not isinstance(values, list):
+        raise InvalidCursor(token)
+    return values, direction
+
+
+class KeysetPage:
+    """Одна страница выдачи с непрозрачными курсорами соседних страниц."""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.next_url = None
+        self.previous_url = None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+
+class KeysetPaginator:
+    """Пагинатор по набору полей сортировки.
+
+    Последнее поле сортировки должно быть уникальным (обычно ``id``), иначе
+    строки с одинаковыми значениями на границе страниц будут пропущены.
+    Если ``ordering`` не задан, используется сортировка самого queryset.
+    """
+
+    def __init__(self, queryset, per_page, ordering=None):
+        self.ordering = tuple(ordering or queryset.query.order_by)
+        if not self.ordering:
+            raise ValueError('KeysetPaginator требует явной сортировки')
+        self.queryset = queryset.order_by(*self.ordering)
+        self.per_page = per_page
+
+    @staticmethod
+    def _split(field):
+        return (field[1:], True) if field.startswith('-') else (field, False)
+
+    def _boundary(self, values, forward):
+        """Условие «строго после values» (forward) или «строго до values»."""
+        condition = Q()
+        for index, field in enumerate(self.ordering):
+            name, descending = self._split(field)
+            lookup = 'lt' if descending == forward else 'gt'
+            clause = Q(**{f'{name}__{lookup}': values[index]})
+            for prev_field, prev_value in zip(self.ordering[:index], values[:index]):
+                clause &= Q(**{self._split(prev_field)[0]: prev_value})
+            condition |= clause
+        return condition
+
+    def _values(self, obj):
+        return [getattr(obj, self._split(field)[0]) for field in self.ordering]
+
+    def _clean(self, values):
+        """Значения курсора, приведенные к типам полей сортировки."""
+        cleaned = []
+        for field, value in zip(self.ordering, values):
+            # Поля сортировки не бывают NULL, а словари и списки в курсор не пишутся
+            if value is None or isinstance(value, (dict, list)):
+                raise ValueError(f'Недопустимое значение курсора: {value!r}')
+            try:
+                model_field = self.queryset.model._meta.get_field(self._split(field)[0])
+            except FieldDoesNotExist:
+                cleaned.append(value)
+            else:
+                cleaned.append(model_field.to_python(value))
+        return cleaned
+
+    def _page_query(self, cursor):
+        values, direction = None, 'next'
+        if cursor:
+            try:
+                values, direction = decode_cursor(cursor)
+            except InvalidCursor:
+                values = None
+            if values is not None and len(values) != len(self.ordering):
+                values, direction = None, 'next'
+
+        queryset = self.queryset
+        if values is not None:
+            try:
+                queryset = queryset.filter(self._boundary(self._clean(values), forward=direction == 'next'))
+            except (ValidationError, TypeError, ValueError):
+                # Курсор отредактирован вручную: как и нечитаемый, ведет на первую страницу
+                values, direction = None, 'next'
+        if direction == 'prev':
+            queryset = queryset.reverse()
+        return queryset[:self.per_page + 1], values, direction
+
+    def _make_page(self, rows, values, direction):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if direction == 'prev':
+            rows.reverse()
+            has_next, has_previous = values is not None, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+
+        next_cursor = encode_cursor(self._values(rows[-1]), 'next') if rows and has_next else None
+        previous_cursor = encode_cursor(self._values(rows[0]), 'prev') if rows and has_previous else None
+        return KeysetPage(rows, next_cursor, previous_cursor)
+
+    def get_page(self, cursor=None):
+        queryset, values, direction = self._page_query(cursor)
+        return self._make_page(list(queryset), values, direction)
+
+    async def aget_page(self, cursor=None):
+        queryset, values, direction = self._page_query(cursor)
+        return self._make_page([row async for row in queryset], values, direction)
+
+
+def _add_links(request, page, param):
+    for cursor, attr in ((page.next_cursor, 'next_url'), (page.previous_cursor, 'previous_url')):
+        if cursor:
+            params = request.GET.copy()
+            params[param] = cursor
+            setattr(page, attr, '?' + params.urlencode())
+    return page
+
+
+def paginate(request, queryset, per_page, ordering=None, param='cursor'):
+    """Страница для запроса: курсор берется из GET-параметра ``param``,
+    ссылки на соседние страницы сохраняют остальные параметры запроса."""
+    page = KeysetPaginator(queryset, per_page, ordering).get_page(request.GET.get(param))
+    return _add_links(request, page, param)
+
+
+async def apaginate(request, queryset, per_page, ordering=None, param='cursor'):
+    """Асинхронный вариант paginate для async-представлений."""
+    page = await KeysetPaginator(queryset, per_page, ordering).aget_page(request.GET.get(param))
+    return _add_links(request, page, param)
+
+
+def estimate_count(queryset):
+    """Оценка числа строк планировщиком; None, если оценки нет.
+
+    PostgreSQL оценивает любой запрос (EXPLAIN). У SQLite оценки по условиям
+    нет: берется только размер таблицы из sqlite_stat1 (после ANALYZE) для
+    выборки без условий.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+    if connection.vendor == 'sqlite' and not queryset.query.where:
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+        except DatabaseError:
+            # ANALYZE еще не выполнялся: таблицы sqlite_stat1 нет
+            return None
+        return int(row[0].split()[0]) if row else None
+    return None
+
+
+def cached_count(queryset):
+    """Точный COUNT, закэшированный на KB_ADMIN_COUNT_CACHE_TIMEOUT секунд."""
+    sql, params = queryset.order_by().query.sql_with_params()
+    digest = hashlib.md5(repr((queryset.db, sql, params)).encode()).hexdigest()
+    key = f'kb:count:{digest}'
+    cache = get_cache()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, getattr(settings, 'KB_ADMIN_COUNT_CACHE_TIMEOUT', 300))
+    return count
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator с приблизительным числом строк для больших выборок.
+
+    Точно считаются не больше ``KB_ADMIN_EXACT_COUNT_LIMIT`` строк (COUNT по
+    подзапросу с LIMIT). Если их больше, число берется из оценки
+    планировщика, а без нее — из кэша точных подсчетов. Номера последних
+    страниц при этом приблизительны.
+    """
+
+    @cached_property
+    def count(self):
+        limit = getattr(settings, 'KB_ADMIN_EXACT_COUNT_LIMIT', 10000)
+        queryset = self.object_list
+        counted = queryset.order_by().values('pk')[:limit + 1].count()
+        if counted <= limit:
+            return counted
+        estimate = estimate_count(queryset)
+        if estimate is not None:
+            return max(estimate, counted)
+        return cached_count(queryset)
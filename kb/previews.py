@@ -0,0 +1,202 @@
+"""Миниатюры вложений для списков документов.
+
+Изображения (JPEG, PNG, WebP) уменьшаются пакетом ``Pillow``, для PDF
+рендерится первая страница утилитой ``pdftoppm`` (poppler-utils). Оба
+инструмента необязательны: без них вложения помечаются как неподдерживаемые
+и подхватываются повторным запуском после установки.
+
+Миниатюры рендерятся только в фоне (команда ``render_previews``) и лежат в
+дисковом кэше ``KB_PREVIEW_ROOT`` под именем из хеша содержимого, поэтому
+отдаются с бессрочными заголовками кэширования. Размер кэша ограничен
+``KB_PREVIEW_CACHE_SIZE``: при переполнении удаляются миниатюры, которые
+дольше всех не запрашивались (время последнего запроса — mtime файла).
+Удаленная миниатюра рендерится заново при следующем запросе.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from django.conf import settings
+
+from .filetypes import SNIFF_SIZE, sniff_mime_type
+from .storage import hash_file, is_blob_name
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - зависит от окружения
+    Image = None
+
+# Увеличивается при изменении размера или формата: меняет имена файлов и URL
+PREVIEW_VERSION = 1
+IMAGE_TYPES = {'image/jpeg', 'image/png', 'image/webp'}
+PDFTOPPM_TIMEOUT = 60
+# mtime обновляется не чаще раза в час: точности LRU этого хватает
+TOUCH_INTERVAL = 60 * 60
+# После вытеснения кэш заполнен на 90%, чтобы не чистить его на каждой миниатюре
+LOW_WATERMARK = 0.9
+
+
+class PreviewError(Exception):
+    """Файл не удалось обработать: рендеринг будет повторен позже."""
+
+
+class UnsupportedPreview(Exception):
+    """Для файлов такого типа миниатюра не строится."""
+
+
+def preview_root():
+    return getattr(settings, 'KB_PREVIEW_ROOT', None) or os.path.join(settings.MEDIA_ROOT, 'previews')
+
+
+def preview_size():
+    return getattr(settings, 'KB_PREVIEW_SIZE', 320)
+
+
+def max_cache_size():
+    return getattr(settings, 'KB_PREVIEW_CACHE_SIZE', 512 * 1024 * 1024)
+
+
+def known_digest(name):
+    """Хеш содержимого из имени blob; для прочих имен — пустая строка."""
+    return os.path.basename(name) if is_blob_name(name) else ''
+
+
+def preview_key(digest):
+    return f'{digest}-{PREVIEW_VERSION}'
+
+
+def preview_path(key):
+    return os.path.join(preview_root(), key[:2], f'{key}.jpg')
+
+
+def _render_image(source_path, target, size):
+    if Image is None:
+        raise UnsupportedPreview('Для изображений нужен пакет Pillow')
+    with Image.open(source_path) as image:
+        # Для JPEG декодирует сразу уменьшенную копию: не держим в памяти оригинал
+        image.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.save(target, 'JPEG', quality=80, optimize=True)
+
+
+def _render_pdf(source_path, target, size):
+    pdftoppm = shutil.which('pdftoppm')
+    if pdftoppm is None:
+        raise UnsupportedPreview('Для PDF нужна утилита pdftoppm (poppler-utils)')
+    with tempfile.TemporaryDirectory() as workdir:
+        prefix = os.path.join(workdir, 'page')
+        try:
+            subprocess.run(
+                [pdftoppm, '-f', '1', '-l', '1', '-singlefile', '-jpeg', '-scale-to', str(size),
+                 source_path, prefix],
+                check=True, capture_output=True, timeout=PDFTOPPM_TIMEOUT,
+            )
+        except subprocess.CalledProcessError as error:
+            raise PreviewError(error.stderr.decode(errors='replace').strip() or str(error))
+        except subprocess.TimeoutExpired:
+            raise PreviewError('pdftoppm не уложился в отведенное время')
+        with open(prefix + '.jpg', 'rb') as page:
+            shutil.copyfileobj(page, target)
+
+
+def render_preview(source_path, filename, key):
+    """Рендерит миниатюру в кэш; файл появляется атомарно."""
+    with open(source_path, 'rb') as source:
+        mime_type = sniff_mime_type(source.read(SNIFF_SIZE), filename)
+    if mime_type in IMAGE_TYPES:
+        render = _render_image
+    elif mime_type == 'application/pdf':
+        render = _render_pdf
+    else:
+        raise UnsupportedPreview(f'Тип {mime_type or "не распознан"} без миниатюры')
+
+    path = preview_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as target:
+            try:
+                render(source_path, target, preview_size())
+            except (UnsupportedPreview, PreviewError):
+                raise
+            except Exception as error:
+                # Поврежденные изображения роняют Pillow самыми разными исключениями
+                raise PreviewError(f'{type(error).__name__}: {error}') from error
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def render_batch(items):
+    """Рендерит пачку ``(pk, path, filename, digest)``; выполняется в пуле процессов.
+
+    Если digest неизвестен (вложение не в контентно-адресуемом хранилище),
+    он вычисляется здесь. Возвращает ``(pk, status, digest, error)``, где
+    status — 'done', 'retry' или 'unsupported'.
+    """
+    results = []
+    for pk, path, filename, digest in items:
+        try:
+            digest = digest or hash_file(path)[0]
+            render_preview(path, filename, preview_key(digest))
+            results.append((pk, 'done', digest, ''))
+        except UnsupportedPreview as error:
+            results.append((pk, 'unsupported', digest, str(error)))
+        except (PreviewError, OSError) as error:
+            results.append((pk, 'retry', digest, str(error)))
+    return results
+
+
+def touch(path):
+    """Отмечает запрос миниатюры для LRU. False, если файла нет в кэше."""
+    try:
+        if time.time() - os.stat(path).st_mtime > TOUCH_INTERVAL:
+            os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def evict(max_size=None):
+    """Удаляет давно не запрашивавшиеся миниатюры, пока кэш больше лимита.
+
+    Возвращает хеши удаленных миниатюр.
+    """
+    max_size = max_cache_size() if max_size is None else max_size
+    entries, total = [], 0
+    for directory, _, filenames in os.walk(preview_root()):
+        for filename in filenames:
+            if not filename.endswith('.jpg'):
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+    if total <= max_size:
+        return []
+
+    evicted = []
+    for mtime, size, path in sorted(entries):
+        if total <= max_size * LOW_WATERMARK:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        evicted.append(os.path.basename(path).rsplit('-', 1)[0])
+    return evicted
@@ -0,0 +1,139 @@
+"""Профилирование отдельных запросов по требованию.
+
+Запрос профилируется cProfile, если сотрудник с доступом в админку
+добавил к нему ``?_profile=1`` или заголовок ``X-KB-Profile: 1``, либо
+если он попал в выборку ``KB_PROFILE_SAMPLE_RATE`` (при заданном
+``KB_PROFILE_DEPARTMENTS`` — только запросы пользователей этих отделов).
+Параметр входит в ключи кэша фрагментов, и такая страница строится
+заново; заголовок кэш не обходит.
+Профили складываются в ``KB_PROFILE_ROOT`` (по умолчанию
+MEDIA_ROOT/profiles): pstats-файл и JSON с описанием запроса; сверх
+``KB_PROFILE_MAX_COUNT`` старые удаляются. Список и скачивание — на
+странице админки ``kb_profiles``.
+"""
+import json
+import os
+import pstats
+import re
+import uuid
+
+from django.conf import settings
+from django.utils import timezone
+
+PROFILE_PARAM = '_profile'
+PROFILE_HEADER = 'X-KB-Profile'
+NAME_RE = re.compile(r'^\d{8}T\d{12}-[0-9a-f]{8}$')
+MIN_PATH_TIME = 1e-6  # секунд
+
+
+def profile_root():
+    return getattr(settings, 'KB_PROFILE_ROOT', None) or os.path.join(settings.MEDIA_ROOT, 'profiles')
+
+
+def max_count():
+    return getattr(settings, 'KB_PROFILE_MAX_COUNT', 100)
+
+
+def requested(request):
+    """Профиль запрошен явно (доступ проверяется отдельно)."""
+    return request.GET.get(PROFILE_PARAM) == '1' or request.headers.get(PROFILE_HEADER) == '1'
+
+
+def profile_path(name, extension='prof'):
+    if not NAME_RE.match(name):
+        raise ValueError(f'Некорректное имя профиля: {name!r}')
+    return os.path.join(profile_root(), f'{name}.{extension}')
+
+
+def save_profile(profiler, meta):
+    """Сохраняет профиль и его описание; возвращает имя профиля."""
+    os.makedirs(profile_root(), exist_ok=True)
+    # Имя начинается со времени: сортировка по имени — сортировка по времени
+    name = f"{timezone.now():%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+    profiler.dump_stats(profile_path(name))
+    with open(profile_path(name, 'json'), 'w', encoding='utf-8') as file:
+        json.dump({**meta, 'name': name}, file, ensure_ascii=False)
+    prune()
+    return name
+
+
+def prune():
+    names = sorted(
+        entry[:-len('.prof')] for entry in os.listdir(profile_root()) if entry.endswith('.prof')
+    )
+    for name in names[:max(len(names) - max_count(), 0)]:
+        for extension in ('prof', 'json'):
+            try:
+                os.remove(profile_path(name, extension))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles():
+    """Описания сохраненных профилей, новые первыми."""
+    try:
+        entries = os.listdir(profile_root())
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for entry in sorted(entries, reverse=True):
+        if not entry.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(profile_root(), entry), encoding='utf-8') as file:
+                profiles.append(json.load(file))
+        except (OSError, ValueError):
+            # Профиль удален параллельно или записан не до конца
+            continue
+    return profiles
+
+
+def _label(function):
+    filename, line, name = function
+    if filename == '~':
+        return name  # встроенные функции: '<built-in method ...>'
+    return f'{name} ({os.path.basename(filename)}:{line})'
+
+
+def collapsed_stacks(path):
+    """Профиль в формате «collapsed stacks» (flamegraph.pl, speedscope).
+
+    cProfile хранит только пары вызывающий — вызываемый, поэтому стеки
+    восстанавливаются по графу вызовов: время функции делится между
+    вызывающими пропорционально их доле в ее суммарном времени. Значения —
+    микросекунды собственного времени.
+    """
+    stats = pstats.Stats(path).stats
+    children = {}
+    for function, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            children.setdefault(caller, []).append((function, edge[3]))
+
+    lines = {}
+    visited = set()
+
+    def walk(function, stack, share):
+        own_time = stats[function][2]
+        stack = stack + [_label(function).replace(';', ',')]
+        key = ';'.join(stack)
+        lines[key] = lines.get(key, 0) + own_time * share
+        for child, edge_time in children.get(function, ()):
+            # Рекурсия обрывается (ее время уже учтено у предка), а пути короче
+            # микросекунды не раскрываются: иначе число путей растет экспоненциально
+            if child in visited or not stats[child][3] or edge_time * share < MIN_PATH_TIME:
+                continue
+            visited.add(child)
+            walk(child, stack, share * edge_time / stats[child][3])
+            visited.discard(child)
+
+    for function, (_, _, _, _, callers) in stats.items():
+        # Встроенные функции без вызывающего — служебные вызовы самого профилировщика
+        if not callers and function[0] != '~':
+            visited.add(function)
+            walk(function, [], 1.0)
+            visited.discard(function)
+    return ''.join(
+        f'{stack} {round(value * 1_000_000)}\n'
+        for stack, value in sorted(lines.items()) if round(value * 1_000_000)
+    )
+
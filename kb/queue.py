@@ -0,0 +1,165 @@
+"""Очереди фоновой обработки в БД.
+
+Строка очереди (``AttachmentText``, ``AttachmentPreview``) хранит статус,
+число попыток и время следующей попытки. Воркер забирает строки с арендой
+``LEASE``: попытка засчитывается сразу при захвате, и если воркер упал,
+строка вернется в очередь по истечении аренды. Неудачная попытка
+откладывает строку с экспоненциальной задержкой, после
+``KB_EXTRACTION_MAX_ATTEMPTS`` попыток строка помечается как упавшая.
+
+``QueueCommand`` — основа команд таких очередей: подкласс задает модель,
+функцию пачки для пула процессов и поля, которые пишутся по результату.
+"""
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+# Сколько строка остается за воркером; если он упал, строка вернется в очередь
+LEASE = timedelta(minutes=10)
+
+
+def max_attempts():
+    return getattr(settings, 'KB_EXTRACTION_MAX_ATTEMPTS', 5)
+
+
+def retry_delay(attempts):
+    """Экспоненциальная задержка перед следующей попыткой: 1, 2, 4 ... минут."""
+    base = getattr(settings, 'KB_EXTRACTION_RETRY_DELAY', 60)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), 24 * 60 * 60))
+
+
+def claim(queryset, limit, fields=(), **changes):
+    """Забирает до limit строк queryset, пропуская заблокированные другими воркерами.
+
+    Забранные строки обновляются changes в той же транзакции. Возвращает
+    кортежи ``(pk, *fields)``.
+    """
+    with transaction.atomic():
+        rows = list(
+            queryset.select_for_update(skip_locked=True, of=('self',)).values_list('pk', *fields)[:limit]
+        )
+        queryset.model.objects.filter(pk__in=[row[0] for row in rows]).update(**changes)
+    return rows
+
+
+class QueueCommand(BaseCommand):
+    """Команда, обрабатывающая очередь пачками в пуле процессов.
+
+    Подкласс задает ``model``, ``fields`` (читаются при захвате, к ним
+    добавляются pk и attempts), ``task`` — функцию пачки, возвращающую
+    ``(pk, status, value, error)`` со status 'done', 'retry' или
+    'unsupported', — и методы ``item`` и ``result_fields``.
+    """
+    model = None
+    fields = ()
+    task = None
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Число процессов; 0 — обрабатывать в текущем процессе',
+        )
+        parser.add_argument('--loop', action='store_true', help='Работать постоянно, опрашивая очередь')
+        parser.add_argument('--interval', type=int, default=30, help='Пауза при пустой очереди, секунд')
+
+    def handle(self, *args, **options):
+        self.total = 0
+        while True:
+            processed = self.process(options['workers'], options['batch_size'])
+            self.after_pass()
+            if not options['loop']:
+                break
+            if not processed:
+                time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f'Готово, обработано вложений: {self.total}'))
+
+    def after_pass(self):
+        """Вызывается после каждого прохода по очереди."""
+
+    def item(self, row):
+        """Аргумент task для забранной строки ``(pk, *fields)``."""
+        raise NotImplementedError
+
+    def result_fields(self, row, status, value):
+        """Поля строки, которые пишутся вместе со статусом."""
+        return {}
+
+    def target(self, row):
+        """Строки, в которые пишется результат."""
+        return self.model.objects.filter(pk=row[0])
+
+    def label(self, row):
+        return str(row[0])
+
+    def finished(self, rows):
+        """Вызывается для успешно обработанных строк пачки."""
+
+    def claim(self, batch_size):
+        now = timezone.now()
+        queryset = self.model.objects.filter(
+            status=self.model.PENDING, next_attempt_at__lte=now,
+        ).order_by('next_attempt_at')
+        # Попытка засчитывается сразу: файл, роняющий воркер, не будет браться бесконечно
+        rows = claim(
+            queryset, batch_size, (*self.fields, 'attempts'),
+            attempts=F('attempts') + 1, next_attempt_at=now + LEASE,
+        )
+        batch = []
+        for *row, attempts in rows:
+            row = tuple(row)
+            self.claimed[row[0]] = (row, attempts + 1)
+            batch.append(self.item(row))
+        return batch
+
+    def process(self, workers, batch_size):
+        self.claimed = {}
+        processed = self.total
+        if workers == 0:
+            while batch := self.claim(batch_size):
+                self.write(self.task(batch))
+            return self.total - processed
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = set()
+            while batch := self.claim(batch_size):
+                pending.add(pool.submit(self.task, batch))
+                # Не забираем из очереди больше, чем пул успеет обработать
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.write(future.result())
+            for future in pending:
+                self.write(future.result())
+        return self.total - processed
+
+    def write(self, results):
+        now = timezone.now()
+        done = []
+        for pk, status, value, error in results:
+            row, attempts = self.claimed.pop(pk)
+            if status == 'done':
+                fields = {'status': self.model.DONE}
+                done.append(row)
+            elif status == 'unsupported':
+                fields = {'status': self.model.UNSUPPORTED}
+            elif attempts >= max_attempts():
+                fields = {'status': self.model.FAILED}
+            else:
+                fields = {'status': self.model.PENDING, 'next_attempt_at': now + retry_delay(attempts)}
+            fields.update(self.result_fields(row, status, value), last_error=error)
+            self.target(row).update(**fields)
+            if error:
+                self.stderr.write(f'{self.label(row)}: {error}')
+
+        if done:
+            self.finished(done)
+        self.total += len(results)
+        self.stdout.write(f'Обработано: {self.total}')
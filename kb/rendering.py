@@ -0,0 +1,63 @@
+"""Преобразование текста документа в HTML при сохранении.
+
+Формат задается настройкой ``KB_CONTENT_FORMAT``: ``plain`` (как фильтр
+linebreaks) или ``markdown``. Markdown включается только при установленных
+пакетах ``markdown`` и ``nh3`` — без санитайзера HTML не выводится.
+"""
+from django.conf import settings
+from django.utils.html import linebreaks
+
+try:
+    import markdown
+except ImportError:
+    markdown = None
+
+try:
+    import nh3
+except ImportError:
+    nh3 = None
+
+# Увеличивается при любом изменении результата рендеринга:
+# сохраненный HTML с другой версией будет перестроен при чтении.
+RENDERER_VERSION = 1
+
+ALLOWED_TAGS = {
+    'a', 'abbr', 'b', 'blockquote', 'br', 'code', 'dd', 'del', 'dl', 'dt', 'em',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'li', 'ol', 'p', 'pre', 's',
+    'strong', 'sub', 'sup', 'table', 'tbody', 'td', 'th', 'thead', 'tr', 'ul',
+}
+ALLOWED_ATTRIBUTES = {
+    'a': {'href', 'title'},
+    'abbr': {'title'},
+    'td': {'align'},
+    'th': {'align'},
+}
+
+
+def get_content_format():
+    content_format = getattr(settings, 'KB_CONTENT_FORMAT', 'plain')
+    if content_format == 'markdown' and (markdown is None or nh3 is None):
+        return 'plain'
+    return content_format
+
+
+def renderer_key(content_format=None):
+    """Ключ рендерера, сохраняемый рядом с HTML."""
+    return f'{content_format or get_content_format()}-{RENDERER_VERSION}'
+
+
+def render_content(text, content_format='plain'):
+    if content_format == 'markdown':
+        html = markdown.markdown(text, extensions=['extra', 'sane_lists'])
+        return nh3.clean(
+            html,
+            tags=ALLOWED_TAGS,
+            attributes=ALLOWED_ATTRIBUTES,
+            link_rel='noopener noreferrer',
+        )
+    return linebreaks(text, autoescape=True)
+
+
+def render_batch(items, content_format):
+    """Рендерит пачку ``(id, text)``; выполняется в пуле процессов."""
+    return [(pk, render_content(text, content_format)) for pk, text in items]
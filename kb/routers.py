@@ -0,0 +1,107 @@
+"""Разделение чтения и записи между основной БД и репликами.
+
+Реплики перечислены в ``KB_DATABASE_REPLICAS``. Запись всегда идет в
+основную БД, а на реплику переводится только чтение внутри представлений,
+помеченных ``replica_reads`` (списки и страницы документов, списки
+админки), и только для безопасных методов. Пользователь, который только
+что что-то изменил, ``KB_REPLICA_LAG`` секунд читает с основной БД
+(cookie ставит ``kb.middleware.PrimaryAfterWriteMiddleware``), поэтому
+сразу видит свой комментарий, даже если реплика отстает. Внутри запроса
+после первой записи все дальнейшие чтения тоже идут в основную БД.
+
+Сессии, пользователи и права всегда читаются с основной БД: иначе после
+входа отставшая реплика «разлогинила» бы пользователя.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PRIMARY_COOKIE = 'kb_primary'
+PRIMARY_APPS = {'sessions', 'auth', 'contenttypes', 'admin'}
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Реплика текущего запроса; список, чтобы запись из потока sync_to_async была видна
+_replica = ContextVar('kb_replica', default=None)
+
+
+def replicas():
+    return list(getattr(settings, 'KB_DATABASE_REPLICAS', []))
+
+
+def replica_lag():
+    """Верхняя оценка отставания реплик, секунд."""
+    return getattr(settings, 'KB_REPLICA_LAG', 10)
+
+
+def current_replica():
+    """Реплика, с которой сейчас читаются данные, или None."""
+    state = _replica.get()
+    return state[0] if state else None
+
+
+def choose_replica(request):
+    """Реплика для чтения в этом запросе или None, если читать надо с основной БД."""
+    aliases = replicas()
+    if not aliases or request.method not in SAFE_METHODS or PRIMARY_COOKIE in request.COOKIES:
+        return None
+    return random.choice(aliases)
+
+
+@contextmanager
+def reading_from_replica(request):
+    token = _replica.set([choose_replica(request)])
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def replica_reads(view):
+    """Читать данные представления с реплики (см. описание модуля)."""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            with reading_from_replica(request):
+                return await view(request, *args, **kwargs)
+    else:
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            with reading_from_replica(request):
+                return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _replica.get()
+        if not state or not state[0]:
+            return None
+        if model._meta.app_label in PRIMARY_APPS or model._meta.label == settings.AUTH_USER_MODEL:
+            return None
+        # Внутри транзакции основной БД читаем ее же: иначе не увидим собственных изменений
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return state[0]
+
+    def db_for_write(self, model, **hints):
+        state = _replica.get()
+        if state:
+            state[0] = None
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема реплик приходит вместе с данными из основной БД
+        if db in replicas():
+            return False
+        return None
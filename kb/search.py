@@ -0,0 +1,406 @@
+"""Полнотекстовый поиск по документам.
+
+Бэкенд выбирается настройкой ``KB_SEARCH_BACKEND`` (путь к классу), по умолчанию
+по типу базы данных: SQLite — виртуальная таблица FTS5, PostgreSQL — tsvector
+с GIN-индексом, остальные — прежний поиск через ``icontains``. Текст вложений
+(``AttachmentText``) индексируется отдельно и участвует в поиске с меньшим весом.
+Текст комментариев индексируется для поиска в админке (``filter_comments``).
+"""
+import re
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .models import AttachmentText, Comment, Document
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+CYRILLIC_RE = re.compile(r'[а-яё]')
+MAX_TERMS = 8
+
+# Флективные окончания русских слов: отбрасываются перед префиксным поиском,
+# чтобы «отчеты» находило «отчет», «отчетов», «отчетами».
+RUSSIAN_ENDINGS = sorted([
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ией',
+    'ей', 'ой', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ов', 'ев',
+    'ах', 'ях', 'ам', 'ям', 'ом', 'ем', 'ую', 'юю', 'ия', 'ью',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+], key=len, reverse=True)
+MIN_STEM_LENGTH = 3
+
+
+def tokenize(query):
+    """Разбивает поисковую строку на термы в нижнем регистре."""
+    return [term.lower() for term in TOKEN_RE.findall(query)][:MAX_TERMS]
+
+
+def stem_prefix(term):
+    """Грубый стеммер для русских слов: отрезает окончание для префиксного поиска."""
+    if not CYRILLIC_RE.search(term):
+        return term
+    for ending in RUSSIAN_ENDINGS:
+        if term.endswith(ending) and len(term) - len(ending) >= MIN_STEM_LENGTH:
+            return term[:-len(ending)]
+    return term
+
+
+class BaseSearchBackend:
+    """Интерфейс поискового бэкенда."""
+
+    def filter(self, queryset, query):
+        """Документы из queryset, подходящие под запрос (без ранжирования)."""
+        raise NotImplementedError
+
+    def search(self, queryset, query):
+        """Подходящие документы, отсортированные по релевантности."""
+        return self.filter(queryset, query).order_by('-created_at', '-id')
+
+    def filter_titles(self, queryset, query):
+        """Документы из queryset, заголовок которых подходит под запрос."""
+        raise NotImplementedError
+
+    def filter_comments(self, queryset, query):
+        """Комментарии из queryset, текст которых подходит под запрос."""
+        raise NotImplementedError
+
+    def install(self):
+        """Создает служебные таблицы/индексы. Возвращает True, если что-то создано."""
+        return False
+
+    def rebuild(self):
+        """Полностью перестраивает индекс."""
+
+    def uninstall(self):
+        """Удаляет служебные таблицы/индексы."""
+
+
+class IcontainsSearchBackend(BaseSearchBackend):
+    """Поиск подстрокой без индекса (полный просмотр таблицы)."""
+
+    def filter(self, queryset, query):
+        return queryset.filter(
+            Q(title__icontains=query) | Q(content__icontains=query)
+            | Q(attachment_text__text__icontains=query)
+        )
+
+    def filter_titles(self, queryset, query):
+        return queryset.filter(title__icontains=query)
+
+    def filter_comments(self, queryset, query):
+        return queryset.filter(text__icontains=query)
+
+
+class SQLiteFTSSearchBackend(BaseSearchBackend):
+    """FTS5 с внешним содержимым: индекс синхронизируется триггерами в самой БД,
+    поэтому bulk_create и queryset.update тоже попадают в индекс."""
+
+    table = 'kb_document_fts'
+    attachment_table = 'kb_attachment_fts'
+    comment_table = 'kb_comment_fts'
+    # Вес заголовка в bm25 относительно текста
+    title_weight = 10.0
+    content_weight = 1.0
+    # Совпадение только во вложении ранжируется ниже совпадения в тексте
+    attachment_weight = 0.5
+
+    def match_expression(self, query):
+        terms = [stem_prefix(term) for term in tokenize(query)]
+        return ' '.join('"%s"*' % term.replace('"', '""') for term in terms)
+
+    def filter(self, queryset, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return queryset.none()
+        return queryset.filter(id__in=RawSQL(
+            f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s '
+            f'UNION SELECT rowid FROM {self.attachment_table} WHERE {self.attachment_table} MATCH %s',
+            [expression, expression],
+        ))
+
+    def search(self, queryset, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return queryset.none()
+        doc_table = Document._meta.db_table
+        a = self.attachment_table
+        rank = RawSQL(
+            f'coalesce((SELECT bm25({self.table}, {self.title_weight}, {self.content_weight}) '
+            f'FROM {self.table} WHERE {self.table} MATCH %s AND rowid = {doc_table}.id), 0) + '
+            f'{self.attachment_weight} * coalesce((SELECT bm25({a}) '
+            f'FROM {a} WHERE {a} MATCH %s AND rowid = {doc_table}.id), 0)',
+            [expression, expression],
+            output_field=FloatField(),
+        )
+        # bm25 возвращает отрицательные значения: чем меньше, тем релевантнее
+        return self.filter(queryset, query).annotate(search_rank=rank).order_by('search_rank', '-id')
+
+    def filter_titles(self, queryset, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return queryset.none()
+        # Фильтр по колонке: совпадения только в заголовке
+        return queryset.filter(id__in=RawSQL(
+            f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s', [f'title : ({expression})'],
+        ))
+
+    def filter_comments(self, queryset, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return queryset.none()
+        return queryset.filter(id__in=RawSQL(
+            f'SELECT rowid FROM {self.comment_table} WHERE {self.comment_table} MATCH %s', [expression],
+        ))
+
+    def _existing(self, cursor):
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger') "
+            "AND (name LIKE %s OR name LIKE %s OR name LIKE %s)",
+            [f'{self.table}%', f'{self.attachment_table}%', f'{self.comment_table}%'],
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+    def attachment_statements(self):
+        text_table = AttachmentText._meta.db_table
+        a = self.attachment_table
+        # rowid текста совпадает с id документа (document_id — первичный ключ)
+        return {
+            ('table', a): (
+                f"CREATE VIRTUAL TABLE {a} USING fts5("
+                f"text, content='{text_table}', content_rowid='document_id', "
+                f"tokenize='porter unicode61 remove_diacritics 2')"
+            ),
+            ('trigger', f'{a}_ai'): (
+                f"CREATE TRIGGER {a}_ai AFTER INSERT ON {text_table} BEGIN "
+                f"INSERT INTO {a}(rowid, text) VALUES (new.document_id, new.text); END"
+            ),
+            ('trigger', f'{a}_ad'): (
+                f"CREATE TRIGGER {a}_ad AFTER DELETE ON {text_table} BEGIN "
+                f"INSERT INTO {a}({a}, rowid, text) VALUES ('delete', old.document_id, old.text); END"
+            ),
+            ('trigger', f'{a}_au'): (
+                f"CREATE TRIGGER {a}_au AFTER UPDATE OF text ON {text_table} BEGIN "
+                f"INSERT INTO {a}({a}, rowid, text) VALUES ('delete', old.document_id, old.text); "
+                f"INSERT INTO {a}(rowid, text) VALUES (new.document_id, new.text); END"
+            ),
+        }
+
+    def comment_statements(self):
+        comment_table = Comment._meta.db_table
+        c = self.comment_table
+        return {
+            ('table', c): (
+                f"CREATE VIRTUAL TABLE {c} USING fts5("
+                f"text, content='{comment_table}', content_rowid='id', "
+                f"tokenize='porter unicode61 remove_diacritics 2')"
+            ),
+            ('trigger', f'{c}_ai'): (
+                f"CREATE TRIGGER {c}_ai AFTER INSERT ON {comment_table} BEGIN "
+                f"INSERT INTO {c}(rowid, text) VALUES (new.id, new.text); END"
+            ),
+            ('trigger', f'{c}_ad'): (
+                f"CREATE TRIGGER {c}_ad AFTER DELETE ON {comment_table} BEGIN "
+                f"INSERT INTO {c}({c}, rowid, text) VALUES ('delete', old.id, old.text); END"
+            ),
+            ('trigger', f'{c}_au'): (
+                f"CREATE TRIGGER {c}_au AFTER UPDATE OF text ON {comment_table} BEGIN "
+                f"INSERT INTO {c}({c}, rowid, text) VALUES ('delete', old.id, old.text); "
+                f"INSERT INTO {c}(rowid, text) VALUES (new.id, new.text); END"
+            ),
+        }
+
+    def install(self):
+        doc_table = Document._meta.db_table
+        t = self.table
+        statements = {
+            ('table', t): (
+                f"CREATE VIRTUAL TABLE {t} USING fts5("
+                f"title, content, content='{doc_table}', content_rowid='id', "
+                f"tokenize='porter unicode61 remove_diacritics 2')"
+            ),
+            ('trigger', f'{t}_ai'): (
+                f"CREATE TRIGGER {t}_ai AFTER INSERT ON {doc_table} BEGIN "
+                f"INSERT INTO {t}(rowid, title, content) VALUES (new.id, new.title, new.content); END"
+            ),
+            ('trigger', f'{t}_ad'): (
+                f"CREATE TRIGGER {t}_ad AFTER DELETE ON {doc_table} BEGIN "
+                f"INSERT INTO {t}({t}, rowid, title, content) "
+                f"VALUES ('delete', old.id, old.title, old.content); END"
+            ),
+            ('trigger', f'{t}_au'): (
+                f"CREATE TRIGGER {t}_au AFTER UPDATE OF title, content ON {doc_table} BEGIN "
+                f"INSERT INTO {t}({t}, rowid, title, content) "
+                f"VALUES ('delete', old.id, old.title, old.content); "
+                f"INSERT INTO {t}(rowid, title, content) VALUES (new.id, new.title, new.content); END"
+            ),
+        }
+        # Миграция 0006 выполняется до появления таблицы текстов вложений
+        if AttachmentText._meta.db_table in connection.introspection.table_names():
+            statements.update(self.attachment_statements())
+        statements.update(self.comment_statements())
+        created = False
+        with connection.cursor() as cursor:
+            existing = self._existing(cursor)
+            for (kind, name), sql in statements.items():
+                if name not in existing:
+                    cursor.execute(sql)
+                    created = True
+        # Пересоздание таблицы kb_document (ALTER в SQLite) удаляет триггеры,
+        # а изменения между миграциями могли не попасть в индекс.
+        if created:
+            self.rebuild()
+        return created
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            for table in self._existing(cursor) & {self.table, self.attachment_table, self.comment_table}:
+                cursor.execute(f"INSERT INTO {table}({table}) VALUES ('rebuild')")
+
+    def uninstall(self):
+        with connection.cursor() as cursor:
+            for table in (self.table, self.attachment_table, self.comment_table):
+                for suffix in ('_ai', '_ad', '_au'):
+                    cursor.execute(f'DROP TRIGGER IF EXISTS {table}{suffix}')
+                cursor.execute(f'DROP TABLE IF EXISTS {table}')
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """tsvector по выражению с GIN-индексом.
+
+    Конфигурация ``russian`` стеммит кириллицу русским снежком, а латиницу —
+    английским, поэтому одного индекса хватает для обоих языков.
+    """
+
+    config = 'russian'
+    index_name = 'kb_document_search_gin'
+    attachment_index_name = 'kb_attachment_search_gin'
+    comment_index_name = 'kb_comment_search_gin'
+    attachment_weight = 0.5
+
+    def vector_sql(self, table=None):
+        prefix = f'{table}.' if table else ''
+        return (
+            f"(setweight(to_tsvector('{self.config}', coalesce({prefix}title, '')), 'A') || "
+            f"setweight(to_tsvector('{self.config}', coalesce({prefix}content, '')), 'B'))"
+        )
+
+    def attachment_vector_sql(self):
+        return f"to_tsvector('{self.config}', text)"
+
+    def comment_vector_sql(self, table=None):
+        # Совпадает с выражением индекса kb_comment_search_gin, иначе индекс не используется
+        prefix = f'{table}.' if table else ''
+        return f"to_tsvector('{self.config}', {prefix}text)"
+
+    def attachment_match_sql(self):
+        return (
+            f'SELECT document_id FROM {AttachmentText._meta.db_table} '
+            f'WHERE {self.attachment_vector_sql()} @@ to_tsquery(%s::regconfig, %s)'
+        )
+
+    def tsquery(self, query):
+        return ' & '.join(f'{term}:*' for term in tokenize(query))
+
+    def filter(self, queryset, query):
+        tsquery = self.tsquery(query)
+        if not tsquery:
+            return queryset.none()
+        # OR с подзапросом PostgreSQL выполняет перебором всех строк с to_tsvector на каждой;
+        # UNION двух выборок по GIN-индексам дает готовый набор id
+        return queryset.filter(id__in=RawSQL(
+            f'SELECT id FROM {Document._meta.db_table} '
+            f'WHERE {self.vector_sql()} @@ to_tsquery(%s::regconfig, %s) '
+            f'UNION {self.attachment_match_sql()}',
+            [self.config, tsquery, self.config, tsquery],
+        ))
+
+    def search(self, queryset, query):
+        tsquery = self.tsquery(query)
+        if not tsquery:
+            return queryset.none()
+        doc_table = Document._meta.db_table
+        vector = self.vector_sql(doc_table)
+        rank = RawSQL(
+            f'ts_rank({vector}, to_tsquery(%s::regconfig, %s)) + '
+            f'{self.attachment_weight} * coalesce((SELECT ts_rank({self.attachment_vector_sql()}, '
+            f'to_tsquery(%s::regconfig, %s)) FROM {AttachmentText._meta.db_table} '
+            f'WHERE document_id = {doc_table}.id), 0)',
+            [self.config, tsquery, self.config, tsquery],
+            output_field=FloatField(),
+        )
+        return self.filter(queryset, query).annotate(search_rank=rank).order_by('-search_rank', '-id')
+
+    def filter_titles(self, queryset, query):
+        # Заголовок проиндексирован с весом A: тот же GIN-индекс, запрос только по весу A
+        tsquery = ' & '.join(f'{term}:*A' for term in tokenize(query))
+        if not tsquery:
+            return queryset.none()
+        return queryset.filter(RawSQL(
+            f'{self.vector_sql(Document._meta.db_table)} @@ to_tsquery(%s::regconfig, %s)',
+            [self.config, tsquery],
+            output_field=BooleanField(),
+        ))
+
+    def filter_comments(self, queryset, query):
+        tsquery = self.tsquery(query)
+        if not tsquery:
+            return queryset.none()
+        return queryset.filter(RawSQL(
+            f'{self.comment_vector_sql(Comment._meta.db_table)} @@ to_tsquery(%s::regconfig, %s)',
+            [self.config, tsquery],
+            output_field=BooleanField(),
+        ))
+
+    def indexes(self):
+        indexes = {
+            self.index_name: (Document._meta.db_table, self.vector_sql()),
+            self.comment_index_name: (Comment._meta.db_table, self.comment_vector_sql()),
+        }
+        # Миграция 0006 выполняется до появления таблицы текстов вложений
+        if AttachmentText._meta.db_table in connection.introspection.table_names():
+            indexes[self.attachment_index_name] = (
+                AttachmentText._meta.db_table, self.attachment_vector_sql(),
+            )
+        return indexes
+
+    def install(self):
+        created = False
+        with connection.cursor() as cursor:
+            for name, (table, expression) in self.indexes().items():
+                cursor.execute('SELECT 1 FROM pg_indexes WHERE indexname = %s', [name])
+                if cursor.fetchone():
+                    continue
+                cursor.execute(f'CREATE INDEX {name} ON {table} USING GIN ({expression})')
+                created = True
+        return created
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            for name in self.indexes():
+                cursor.execute(f'REINDEX INDEX {name}')
+
+    def uninstall(self):
+        with connection.cursor() as cursor:
+            for name in (self.index_name, self.attachment_index_name, self.comment_index_name):
+                cursor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+VENDOR_BACKENDS = {
+    'sqlite': SQLiteFTSSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_search_backend():
+    """Возвращает экземпляр поискового бэкенда согласно настройкам."""
+    path = getattr(settings, 'KB_SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    return VENDOR_BACKENDS.get(connection.vendor, IcontainsSearchBackend)()
+
+
+def install_search_index(sender=None, using=DEFAULT_DB_ALIAS, **kwargs):
+    """Обработчик post_migrate: восстанавливает индекс после изменений схемы."""
+    if using == DEFAULT_DB_ALIAS:
+        get_search_backend().install()
@@ -0,0 +1,91 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .cache import bump_version
+from .models import (
+    AttachmentPreview, AttachmentText, Category, Comment, Document, change_comment_counts,
+)
+from .storage import acquire_blob, release_blob
+
+
+@receiver([post_save, post_delete], sender=Document)
+def document_changed(sender, instance, **kwargs):
+    # При переносе документа меняются списки обоих отделов
+    bump_version(instance.department_id, getattr(instance, '_loaded_department_id', None))
+
+
+@receiver(post_save, sender=Document)
+def document_file_saved(sender, instance, **kwargs):
+    previous = getattr(instance, '_loaded_file_name', '')
+    current = instance.file.name or ''
+    if current != previous:
+        acquire_blob(current)
+        release_blob(previous)
+        instance._loaded_file_name = current
+        # Текст извлекается в фоне командой extract_attachments
+        if current:
+            AttachmentText.enqueue(instance.pk, current)
+            # Миниатюра рендерится в фоне командой render_previews
+            AttachmentPreview.enqueue(current)
+        else:
+            AttachmentText.objects.filter(document_id=instance.pk).delete()
+
+
+@receiver(post_delete, sender=Document)
+def document_file_deleted(sender, instance, **kwargs):
+    release_blob(getattr(instance, '_loaded_file_name', instance.file.name or ''))
+
+
+@receiver(pre_delete, sender=Document)
+def document_deleting(sender, instance, origin=None, **kwargs):
+    # Комментарии удаляемого документа удаляются каскадом раньше него самого;
+    # метка на источнике удаления видна их сигналам
+    if origin is not None:
+        if not hasattr(origin, '_kb_deleted_documents'):
+            origin._kb_deleted_documents = set()
+        origin._kb_deleted_documents.add(instance.pk)
+
+
+def _document_deleted(instance, origin):
+    return instance.document_id in getattr(origin, '_kb_deleted_documents', ())
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def comment_changed(sender, instance, origin=None, **kwargs):
+    # Кэш отдела удаляемого документа сбросит document_changed
+    if _document_deleted(instance, origin):
+        return
+    if Comment.document.is_cached(instance):
+        department_id = instance.document.department_id
+    else:
+        department_id = (
+            Document.objects.filter(pk=instance.document_id).values_list('department_id', flat=True).first()
+        )
+    bump_version(department_id)
+
+
+@receiver(post_save, sender=Comment)
+def comment_counter_saved(sender, instance, **kwargs):
+    previous_document, previous_active = getattr(instance, '_loaded_state', (None, False))
+    deltas = {}
+    if previous_active:
+        deltas[previous_document] = -1
+    if instance.is_active:
+        deltas[instance.document_id] = deltas.get(instance.document_id, 0) + 1
+    change_comment_counts(deltas)
+    instance._loaded_state = (instance.document_id, instance.is_active)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_counter_deleted(sender, instance, origin=None, **kwargs):
+    # Счетчик удаляемого документа обновлять незачем
+    if _document_deleted(instance, origin):
+        return
+    document_id, is_active = getattr(instance, '_loaded_state', (instance.document_id, instance.is_active))
+    if is_active:
+        change_comment_counts({document_id: -1})
+
+
+@receiver([post_save, post_delete], sender=Category)
+def category_changed(sender, instance, **kwargs):
+    bump_version(instance.department_id)
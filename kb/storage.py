@@ -0,0 +1,161 @@
+"""Контентно-адресуемое хранилище вложений.
+
+Файл сохраняется под именем ``blobs/ab/cd/<sha256>``: одинаковое содержимое,
+загруженное в разные документы и отделы, хранится один раз. Исходное имя
+файла остается только в ``Document.file_name``. Число ссылок на каждый blob
+ведется в модели ``Blob``; когда ссылок не остается, файл удаляется.
+
+Удаление идет после коммита под блокировкой строки ``Blob``: если то же
+содержимое тем временем загрузили снова, ``_store`` обновляет
+``released_at`` и файл остается. Blob, загруженный, но так и не
+подхваченный документом, удаляет ``cleanup_uploads``.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+BLOB_PREFIX = 'blobs'
+HASH_BLOCK = 1024 * 1024
+
+
+def blob_name(digest):
+    return f'{BLOB_PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}'
+
+
+def is_blob_name(name):
+    return bool(name) and name.startswith(BLOB_PREFIX + '/')
+
+
+def hash_file(path):
+    """SHA-256 и размер файла, читаемого блоками."""
+    hasher = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as source:
+        while block := source.read(HASH_BLOCK):
+            hasher.update(block)
+            size += len(block)
+    return hasher.hexdigest(), size
+
+
+class ContentAddressableStorage(FileSystemStorage):
+    """FileSystemStorage, выбирающий имя файла по хешу содержимого."""
+
+    def get_available_name(self, name, max_length=None):
+        # Настоящее имя известно только после чтения содержимого в _save
+        return name
+
+    def _store(self, source_path, digest):
+        from .models import Blob
+        name = blob_name(digest)
+        with transaction.atomic():
+            # Отложенное удаление blob без ссылок увидит новое released_at и оставит файл;
+            # если удаление уже идет, ждем его и кладем файл заново
+            Blob.objects.filter(name=name, ref_count__lte=0).update(released_at=timezone.now())
+            if self.exists(name):
+                os.remove(source_path)
+            else:
+                os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+                file_move_safe(source_path, self.path(name), allow_overwrite=True)
+        return name
+
+    def import_file(self, source_path, digest):
+        """Кладет копию файла в хранилище; исходный файл остается на месте.
+
+        Возвращает имя blob и признак того, что такого содержимого еще не было.
+        """
+        name = blob_name(digest)
+        target = self.path(name)
+        if os.path.exists(target):
+            return name, False
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.link(source_path, target)
+        except OSError:
+            # Другая файловая система: копируем во временный файл и переименовываем
+            tmp_dir = self.path(f'{BLOB_PREFIX}/tmp')
+            os.makedirs(tmp_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as tmp:
+                with open(source_path, 'rb') as source:
+                    shutil.copyfileobj(source, tmp, HASH_BLOCK)
+            os.replace(tmp.name, target)
+        return name, True
+
+    def _save(self, name, content):
+        # Готовый файл с известным хешем (загрузка частями) просто перемещается
+        digest = getattr(content, 'sha256', None)
+        if digest and hasattr(content, 'temporary_file_path'):
+            return self._store(content.temporary_file_path(), digest)
+
+        tmp_dir = self.path(f'{BLOB_PREFIX}/tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        hasher = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as tmp:
+            for chunk in content.chunks():
+                hasher.update(chunk)
+                tmp.write(chunk)
+        return self._store(tmp.name, hasher.hexdigest())
+
+
+attachment_storage = ContentAddressableStorage()
+
+
+def get_attachment_storage():
+    return attachment_storage
+
+
+def acquire_blob(name, size=None):
+    """Добавляет ссылку на blob."""
+    from .models import Blob
+    if not is_blob_name(name):
+        return
+    with transaction.atomic():
+        blob, created = Blob.objects.get_or_create(
+            name=name,
+            defaults={'size': size if size is not None else attachment_storage.size(name), 'ref_count': 1},
+        )
+        if not created:
+            Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1, released_at=None)
+
+
+def release_blob(name):
+    """Убирает ссылку на blob; файл без ссылок удаляется после коммита."""
+    from .models import Blob
+    if not is_blob_name(name):
+        return
+    released_at = timezone.now()
+    with transaction.atomic():
+        Blob.objects.filter(name=name, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+        if Blob.objects.filter(name=name, ref_count__lte=0).update(released_at=released_at):
+            transaction.on_commit(lambda: delete_orphan_blob(name, released_at))
+
+
+def delete_orphan_blob(name, released_before):
+    """Удаляет blob без ссылок, если после released_before его никто не подхватил."""
+    from .models import Blob
+    with transaction.atomic():
+        # Ссылку могли добавить между коммитом release_blob и этим вызовом: проверяем под блокировкой
+        orphan = (
+            Blob.objects.select_for_update()
+            .filter(name=name, ref_count__lte=0, released_at__lte=released_before).first()
+        )
+        if orphan is None:
+            return False
+        orphan.delete()
+        attachment_storage.delete(name)
+    return True
+
+
+def purge_orphan_blobs(released_before):
+    """Удаляет blob, оставшиеся без ссылок с released_before; возвращает их число."""
+    from .models import Blob
+    names = list(
+        Blob.objects.filter(ref_count__lte=0, released_at__lt=released_before).values_list('name', flat=True)
+    )
+    return sum(delete_orphan_blob(name, released_before) for name in names)
@@ -1,5 +1,7 @@
 import pytest
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import override_settings
 from kb.models import Department, Category, Document
 
 User = get_user_model()
@@ -31,4 +33,16 @@ def document(user, category, department):
         author=user,
         category=category,
         department=department
-    )
\ No newline at end of file
+    )
+
+@pytest.fixture(autouse=True, scope='session')
+def locmem_cache():
+    # Общий файловый кэш настроек пережил бы тестовую БД и мешал соседним запускам
+    with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+        yield
+
+
+@pytest.fixture(autouse=True)
+def clear_cache(locmem_cache):
+    # Кэш фрагментов общий для процесса, а БД откатывается после каждого теста
+    cache.clear()
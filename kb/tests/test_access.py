@@ -0,0 +1,116 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.test import TestCase
+from django.urls import reverse
+
+from kb.access import AccessPolicy, policy_for
+from kb.models import Category, Comment, Department, Document
+
+User = get_user_model()
+
+
+class AccessPolicyTest(TestCase):
+    def setUp(self):
+        self.sales = Department.objects.create(name='Sales')
+        self.support = Department.objects.create(name='Support')
+        category = Category.objects.create(name='Contracts', department=self.sales)
+        self.author = User.objects.create_user(username='author', password='testpass123', department=self.sales)
+        self.published = Document.objects.create(
+            title='Published', content='Content', author=self.author,
+            category=category, department=self.sales,
+        )
+        self.draft = Document.objects.create(
+            title='Draft', content='Content', author=self.author,
+            category=category, department=self.sales, is_published=False,
+        )
+
+    def user(self, username, **kwargs):
+        return User.objects.create_user(username=username, password='testpass123', **kwargs)
+
+    def fresh(self, user):
+        # Как в новом запросе: политика и кэш прав ModelBackend пустые
+        return User.objects.get(pk=user.pk)
+
+    def test_rules_match_user_types(self):
+        employee = AccessPolicy(self.user('employee', department=self.sales))
+        outsider = AccessPolicy(self.user('outsider', department=self.support))
+        manager = AccessPolicy(self.user('manager', department=self.sales, user_type='MANAGER'))
+        admin = AccessPolicy(self.user('admin', user_type='ADMIN'))
+        author = AccessPolicy(self.author)
+
+        self.assertTrue(employee.can_view_document(self.published))
+        self.assertFalse(employee.can_view_document(self.draft))
+        self.assertFalse(outsider.can_view_document(self.published))
+        self.assertTrue(admin.can_view_document(self.draft))
+        self.assertTrue(author.can_edit_document(self.draft))
+        self.assertFalse(manager.can_edit_document(self.draft))
+        self.assertTrue(manager.can_moderate_comments(self.published))
+        self.assertFalse(employee.can_moderate_comments(self.published))
+        self.assertFalse(outsider.can_comment(self.published))
+        self.assertTrue(manager.can_add_document)
+        self.assertFalse(employee.can_add_document)
+
+    def test_visible_to_matches_can_view(self):
+        users = [
+            self.user('employee', department=self.sales),
+            self.user('outsider', department=self.support),
+            self.user('nobody'),
+            self.user('admin', user_type='ADMIN'),
+        ]
+        editor = self.user('editor', department=self.sales)
+        editor.user_permissions.add(Permission.objects.get(codename='manage_documents'))
+        users.append(self.fresh(editor))
+
+        for user in users:
+            policy = policy_for(user)
+            expected = {doc for doc in (self.published, self.draft) if policy.can_view_document(doc)}
+            self.assertEqual(set(Document.objects.visible_to(user)), expected, user.username)
+
+    def test_permissions_loaded_once_per_request(self):
+        editor = self.user('editor', department=self.sales)
+        editor.user_permissions.add(Permission.objects.get(codename='manage_documents'))
+        policy = AccessPolicy(self.fresh(editor))
+        with self.assertNumQueries(1):
+            self.assertTrue(policy.can_manage_documents)
+            self.assertTrue(policy.can_view_document(self.draft))
+
+        # Права не кэшируются между запросами: отзыв действует со следующего запроса
+        editor.user_permissions.clear()
+        user = self.fresh(editor)
+        self.assertFalse(AccessPolicy(user).can_manage_documents)
+        self.assertEqual(AccessPolicy(user).has_perm('kb.manage_documents'), user.has_perm('kb.manage_documents'))
+
+
+class AccessQueryCountTest(TestCase):
+    def setUp(self):
+        self.department = Department.objects.create(name='Sales')
+        category = Category.objects.create(name='Contracts', department=self.department)
+        self.user = User.objects.create_user(
+            username='author', password='testpass123', department=self.department,
+        )
+        self.document = Document.objects.create(
+            title='Contract', content='Content', author=self.user,
+            category=category, department=self.department,
+        )
+        Comment.objects.create(document=self.document, author=self.user, text='Note')
+        self.client.login(username='author', password='testpass123')
+
+    def test_detail_page(self):
+        url = reverse('document_detail', args=[self.document.slug])
+        self.client.get(url)
+        # Сессия, пользователь, права (одним запросом), состояние для ETag и документ
+        # вместе с автором, категорией и отделом; комментарии — из кэша
+        with self.assertNumQueries(5):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_update_view_fetches_document_once(self):
+        url = reverse('document_update', args=[self.document.slug])
+        self.client.get(url)
+        # Сессия, пользователь, документ (один раз), отдел в заголовке и списки формы
+        with self.assertNumQueries(6) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        document_queries = [
+            query for query in queries.captured_queries
+            if query['sql'].startswith('SELECT "kb_document"."id"')
+        ]
+        self.assertEqual(len(document_queries), 1)
@@ -0,0 +1,100 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from kb import bulk
+from kb.models import BulkAction, BulkActionChunk, Category, Department, Document
+
+User = get_user_model()
+
+
+@override_settings(KB_BULK_ACTION_BATCH_SIZE=2, KB_BULK_ACTION_PAUSE=0)
+class BulkActionTest(TestCase):
+    def setUp(self):
+        self.department = Department.objects.create(name='Support')
+        self.category = Category.objects.create(name='FAQ', department=self.department)
+        self.admin = User.objects.create_superuser(
+            username='root', password='pass', email='root@example.com', user_type='ADMIN',
+        )
+        self.documents = [
+            Document.objects.create(
+                title=f'Doc {number}', content='Text', author=self.admin,
+                category=self.category, department=self.department,
+            )
+            for number in range(5)
+        ]
+        self.client.force_login(self.admin)
+
+    def post_action(self, action, **data):
+        return self.client.post(reverse('admin:kb_document_changelist'), {
+            'action': action, 'select_across': '0', 'index': '0',
+            '_selected_action': [document.pk for document in self.documents], **data,
+        })
+
+    def published(self):
+        return list(Document.objects.order_by('pk').values_list('is_published', flat=True))
+
+    def test_action_runs_in_background_batches(self):
+        response = self.post_action('unpublish_documents')
+        self.assertEqual(response.status_code, 302)
+        bulk_action = BulkAction.objects.get()
+        self.assertEqual((bulk_action.status, bulk_action.total), (BulkAction.PENDING, 5))
+        self.assertEqual(bulk_action.chunks.count(), 3)
+        self.assertEqual(self.published(), [True] * 5)
+
+        call_command('run_bulk_actions', stdout=StringIO())
+        bulk_action.refresh_from_db()
+        self.assertEqual(self.published(), [False] * 5)
+        self.assertEqual((bulk_action.status, bulk_action.processed, bulk_action.changed), (BulkAction.DONE, 5, 5))
+        self.assertFalse(BulkActionChunk.objects.exists())
+
+        response = self.client.get(reverse('admin:kb_bulkaction_changelist'))
+        self.assertContains(response, '<progress max="100" value="100">')
+        self.assertNotContains(response, 'http-equiv="refresh"')
+
+    def test_cancel_stops_before_next_batch(self):
+        self.post_action('unpublish_documents')
+        bulk_action = bulk.claim()
+        bulk.process_chunk(bulk_action, bulk_action.chunks.order_by('pk').first())
+
+        response = self.client.get(reverse('admin:kb_bulkaction_changelist'))
+        self.assertContains(response, '<progress max="100" value="40">')
+        self.assertContains(response, 'http-equiv="refresh"')
+        self.client.post(reverse('admin:kb_bulkaction_changelist'), {
+            'action': 'cancel_bulk_actions', 'index': '0', '_selected_action': [bulk_action.pk],
+        })
+
+        self.assertEqual(bulk.run(bulk_action), BulkAction.CANCELLED)
+        self.assertEqual(self.published(), [False, False, True, True, True])
+        self.assertEqual(bulk_action.processed, 2)
+        self.assertFalse(BulkActionChunk.objects.exists())
+
+    def test_move_documents(self):
+        other = Department.objects.create(name='Sales')
+        target = Category.objects.create(name='Offers', department=other)
+
+        response = self.post_action('move_documents')
+        self.assertContains(response, 'name="apply"')
+        self.assertFalse(BulkAction.objects.exists())
+
+        response = self.post_action('move_documents', apply='1', category=target.pk)
+        self.assertEqual(response.status_code, 302)
+        call_command('run_bulk_actions', stdout=StringIO())
+        self.assertEqual(
+            set(Document.objects.values_list('category_id', 'department_id')), {(target.pk, other.pk)},
+        )
+
+    def test_failed_action_is_reported(self):
+        target = Category.objects.create(name='Old', department=self.department)
+        self.post_action('move_documents', apply='1', category=target.pk)
+        target.delete()
+
+        err = StringIO()
+        call_command('run_bulk_actions', stdout=StringIO(), stderr=err)
+        bulk_action = BulkAction.objects.get()
+        self.assertEqual(bulk_action.status, BulkAction.FAILED)
+        self.assertIn('DoesNotExist', bulk_action.last_error)
+        self.assertFalse(BulkActionChunk.objects.exists())
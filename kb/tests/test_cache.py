@@ -0,0 +1,138 @@
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+from kb.admin import DocumentAdmin, CommentAdmin
+from kb.cache import GLOBAL_SCOPE, bump_version, cached_fragment, get_version
+from kb.models import Department, Category, Document, Comment
+
+User = get_user_model()
+
+
+class DepartmentVersionTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_bump_invalidates_department_and_global_scope(self):
+        before = get_version(1), get_version(2), get_version(GLOBAL_SCOPE)
+        bump_version(1)
+        after = get_version(1), get_version(2), get_version(GLOBAL_SCOPE)
+        self.assertNotEqual(before[0], after[0])
+        self.assertEqual(before[1], after[1])
+        self.assertNotEqual(before[2], after[2])
+
+    def test_cached_fragment_rebuilds_after_bump(self):
+        calls = []
+        build = lambda: calls.append(1) or len(calls)
+        self.assertEqual(cached_fragment(1, 'rows', ('q',), build), 1)
+        self.assertEqual(cached_fragment(1, 'rows', ('q',), build), 1)
+        self.assertEqual(cached_fragment(2, 'rows', ('q',), build), 2)
+        bump_version(1)
+        self.assertEqual(cached_fragment(1, 'rows', ('q',), build), 3)
+
+    def test_evicted_counter_does_not_revive_old_fragments(self):
+        cached_fragment(1, 'rows', (), lambda: 'old')
+        cache.delete('kb:version:1')
+        self.assertEqual(cached_fragment(1, 'rows', (), lambda: 'new'), 'new')
+
+
+class FragmentCacheViewsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.sales = Department.objects.create(name='Sales')
+        self.support = Department.objects.create(name='Support')
+        self.category = Category.objects.create(name='Contracts', department=self.sales)
+        self.support_category = Category.objects.create(name='Tickets', department=self.support)
+        self.user = User.objects.create_user(
+            username='seller',
+            password='testpass123',
+            department=self.sales
+        )
+        self.support_user = User.objects.create_user(
+            username='helper',
+            password='testpass123',
+            department=self.support
+        )
+        self.document = self.create_document('Sales contract', self.category)
+        self.client.login(username='seller', password='testpass123')
+
+    def create_document(self, title, category):
+        return Document.objects.create(
+            title=title,
+            content='Content',
+            author=self.user,
+            category=category,
+            department=category.department
+        )
+
+    def list_titles(self, client=None):
+        response = (client or self.client).get(reverse('document_list'))
+        return [doc.title for doc in response.context['documents']]
+
+    def test_list_is_served_from_cache(self):
+        self.client.get(reverse('document_list'))
+        # Остаются только сессия, пользователь, его права и отдел в заголовке
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('document_list'))
+        self.assertContains(response, 'Sales contract')
+        self.assertContains(response, 'Contracts')
+
+    def test_new_document_invalidates_only_its_department(self):
+        self.list_titles()
+        support_version = get_version(self.support.id)
+        self.create_document('New offer', self.category)
+        self.assertEqual(self.list_titles(), ['New offer', 'Sales contract'])
+        self.assertEqual(get_version(self.support.id), support_version)
+
+    def test_departments_never_share_fragments(self):
+        self.create_document('Ticket rules', self.support_category)
+        other = self.client_class()
+        other.login(username='helper', password='testpass123')
+        self.assertEqual(self.list_titles(), ['Sales contract'])
+        self.assertEqual(self.list_titles(other), ['Ticket rules'])
+
+    def test_moving_document_invalidates_old_department(self):
+        self.list_titles()
+        document = Document.objects.get(pk=self.document.pk)
+        document.category = self.support_category
+        document.department = self.support
+        document.save()
+        self.assertEqual(self.list_titles(), [])
+
+    def run_admin_action(self, admin_class, name, queryset):
+        # Массовое действие ставится в очередь и выполняется воркером
+        admin = admin_class(queryset.model, None)
+        admin.message_user = lambda *args: None
+        request = RequestFactory().post('/')
+        request.user = self.user
+        getattr(admin, name)(request, queryset)
+        with override_settings(KB_BULK_ACTION_PAUSE=0):
+            call_command('run_bulk_actions', stdout=StringIO())
+
+    def test_admin_bulk_actions_invalidate(self):
+        self.list_titles()
+        self.run_admin_action(DocumentAdmin, 'unpublish_documents', Document.objects.all())
+        self.assertEqual(self.list_titles(), [])
+
+    def test_comments_block_invalidated_by_comment_changes(self):
+        url = reverse('document_detail', args=[self.document.slug])
+        comment = Comment.objects.create(document=self.document, author=self.user, text='First')
+        self.assertEqual(len(self.client.get(url).context['comments']), 1)
+
+        self.run_admin_action(CommentAdmin, 'deactivate_comments', Comment.objects.filter(pk=comment.pk))
+        self.assertEqual(len(self.client.get(url).context['comments']), 0)
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': tempfile.mkdtemp(prefix='kb-cache-'),
+    }
+})
+class FileBasedFragmentCacheTest(FragmentCacheViewsTest):
+    pass
@@ -0,0 +1,118 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from kb.admin import CommentAdmin
+from kb.models import Category, Comment, Department, Document
+
+User = get_user_model()
+
+
+class CommentCountTest(TestCase):
+    def setUp(self):
+        self.department = Department.objects.create(name='Support')
+        self.category = Category.objects.create(name='FAQ', department=self.department)
+        self.user = User.objects.create_superuser(
+            username='admin', password='testpass123', email='admin@example.com', user_type='ADMIN',
+        )
+        self.documents = [self.create_document(f'Doc {i}') for i in range(2)]
+
+    def create_document(self, title):
+        return Document.objects.create(
+            title=title, content='Content', author=self.user,
+            category=self.category, department=self.department,
+        )
+
+    def count(self, document):
+        return Document.objects.values_list('comment_count', flat=True).get(pk=document.pk)
+
+    def test_counter_follows_comment_lifecycle(self):
+        document = self.documents[0]
+        comment = Comment.objects.create(document=document, author=self.user, text='First')
+        Comment.objects.create(document=document, author=self.user, text='Second')
+        self.assertEqual(self.count(document), 2)
+
+        comment = Comment.objects.get(pk=comment.pk)
+        comment.is_active = False
+        comment.save()
+        comment.save()
+        self.assertEqual(self.count(document), 1)
+
+        comment.is_active = True
+        comment.save()
+        self.assertEqual(self.count(document), 2)
+
+        comment.delete()
+        Comment.objects.filter(document=document, is_active=True).delete()
+        self.assertEqual(self.count(document), 0)
+
+    def test_document_delete_does_not_touch_counter_per_comment(self):
+        def delete_queries(comments):
+            document = self.create_document(f'With {comments}')
+            for i in range(comments):
+                Comment.objects.create(document=document, author=self.user, text=str(i))
+            document = Document.objects.get(pk=document.pk)
+            with CaptureQueriesContext(connection) as queries:
+                document.delete()
+            return len(queries)
+
+        self.assertEqual(delete_queries(10), delete_queries(2))
+
+    def test_author_delete_updates_other_counters(self):
+        commenter = User.objects.create_user(username='commenter', password='testpass123')
+        Comment.objects.create(document=self.documents[0], author=commenter, text='x')
+        Comment.objects.create(document=self.documents[0], author=self.user, text='y')
+        commenter.delete()
+        self.assertEqual(self.count(self.documents[0]), 1)
+
+    @override_settings(KB_BULK_ACTION_PAUSE=0)
+    def test_bulk_set_active(self):
+        for document in self.documents:
+            for text in ('a', 'b'):
+                Comment.objects.create(document=document, author=self.user, text=text)
+
+        self.assertEqual(Comment.objects.filter(text='a').set_active(False), 2)
+        self.assertEqual(Comment.objects.all().set_active(False), 2)
+        self.assertEqual([self.count(document) for document in self.documents], [0, 0])
+
+        admin = CommentAdmin(Comment, None)
+        admin.message_user = lambda *args: None
+        request = RequestFactory().post('/')
+        request.user = self.user
+        admin.restore_comments(request, Comment.objects.filter(document=self.documents[0]))
+        # Действие выполняется в фоне
+        self.assertEqual([self.count(document) for document in self.documents], [0, 0])
+        call_command('run_bulk_actions', stdout=StringIO())
+        self.assertEqual([self.count(document) for document in self.documents], [2, 0])
+
+    def test_admin_changelist_does_not_count_per_row(self):
+        self.client.login(username='admin', password='testpass123')
+        url = reverse('admin:kb_document_changelist')
+
+        def changelist_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, {'o': '7', 'comments': '0'})
+            self.assertEqual(response.status_code, 200)
+            return len(queries)
+
+        baseline = changelist_queries()
+        for i in range(5):
+            document = self.create_document(f'Extra {i}')
+            Comment.objects.create(document=document, author=self.user, text='x', is_active=False)
+        self.assertEqual(changelist_queries(), baseline)
+
+    def test_reconcile_command(self):
+        Comment.objects.create(document=self.documents[0], author=self.user, text='x')
+        Document.objects.filter(pk=self.documents[0].pk).update(comment_count=5)
+        Document.objects.filter(pk=self.documents[1].pk).update(comment_count=3)
+
+        out = StringIO()
+        call_command('reconcile_comment_counts', batch_size=1, stdout=out)
+
+        self.assertEqual([self.count(document) for document in self.documents], [1, 0])
+        self.assertIn('исправлено счетчиков: 2', out.getvalue())
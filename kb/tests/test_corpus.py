@@ -0,0 +1,108 @@
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import Count, F, Q, Sum
+from django.test import TestCase, override_settings
+
+from kb.benchmarking import database_url, summarize
+from kb.corpus import END, START, CorpusSpec, seed_corpus
+from kb.models import AttachmentPreview, AttachmentText, Blob, Comment, CustomUser, Department, Document
+
+SPEC = CorpusSpec(departments=2, categories=2, users=3, documents=40, comments=200, seed=7)
+
+
+class SeedCorpusTest(TestCase):
+    def test_counts(self):
+        counts = seed_corpus(SPEC)
+        self.assertEqual(counts['departments'], 2)
+        self.assertEqual(counts['categories'], 4)
+        self.assertEqual(counts['users'], 7)
+        self.assertEqual(counts['documents'], 40)
+        self.assertEqual(Document.objects.count(), 40)
+        self.assertEqual(Comment.objects.count(), counts['comments'])
+        # Число комментариев по закону Ципфа приблизительное
+        self.assertAlmostEqual(counts['comments'], 200, delta=40)
+
+    def test_skewed_departments(self):
+        seed_corpus(SPEC)
+        sizes = list(
+            Document.objects.values('department').annotate(size=Count('id'))
+            .order_by('department').values_list('size', flat=True)
+        )
+        self.assertGreater(sizes[0], sizes[1])
+
+    def test_explicit_dates(self):
+        seed_corpus(SPEC)
+        self.assertFalse(Document.objects.exclude(created_at__range=(START, END)).exists())
+        self.assertFalse(Comment.objects.filter(created_at__lt=F('document__created_at')).exists())
+        # auto_now_add восстановлен после генерации
+        self.assertTrue(Document._meta.get_field('created_at').auto_now_add)
+
+    def test_refuses_second_corpus(self):
+        seed_corpus(SPEC)
+        with self.assertRaises(CommandError):
+            call_command('generate_corpus', documents=1, comments=0, stdout=StringIO())
+
+    def test_attachments(self):
+        media_root = tempfile.mkdtemp(prefix='kb-media-')
+        self.addCleanup(shutil.rmtree, media_root)
+        with override_settings(MEDIA_ROOT=media_root):
+            seed_corpus(CorpusSpec(departments=1, documents=60, comments=0, attachments=0.5))
+        with_files = Document.objects.exclude(file='').exclude(file__isnull=True)
+        self.assertTrue(with_files.exists())
+        self.assertEqual(Blob.objects.aggregate(total=Sum('ref_count'))['total'], with_files.count())
+        self.assertEqual(AttachmentText.objects.count(), with_files.count())
+        self.assertEqual(
+            AttachmentPreview.objects.count(), with_files.values('file').distinct().count(),
+        )
+
+    def test_comment_counters_match_active_comments(self):
+        seed_corpus(SPEC)
+        mismatched = Document.objects.annotate(
+            active=Count('comments', filter=Q(comments__is_active=True)),
+        ).exclude(comment_count=F('active'))
+        self.assertFalse(mismatched.exists())
+
+    def test_documents_stay_in_their_department(self):
+        seed_corpus(SPEC)
+        self.assertFalse(Document.objects.exclude(category__department=F('department')).exists())
+        self.assertFalse(Document.objects.exclude(author__department=F('department')).exists())
+
+    def test_deterministic(self):
+        def snapshot():
+            return list(Document.objects.order_by('slug').values_list('slug', 'title', 'comment_count'))
+
+        seed_corpus(SPEC)
+        first = snapshot()
+        Comment.objects.all().delete()
+        Document.objects.all().delete()
+        CustomUser.objects.all().delete()
+        Department.objects.all().delete()
+        seed_corpus(SPEC)
+        self.assertEqual(snapshot(), first)
+
+
+class BenchmarkingHelpersTest(TestCase):
+    def test_database_url(self):
+        self.assertEqual(
+            database_url({'ENGINE': 'django.db.backends.sqlite3', 'NAME': '/tmp/kb.sqlite3'}),
+            'sqlite:////tmp/kb.sqlite3',
+        )
+        self.assertEqual(
+            database_url({
+                'ENGINE': 'django.db.backends.postgresql', 'NAME': 'kb', 'USER': 'kb',
+                'PASSWORD': 'p@ss', 'HOST': 'db', 'PORT': 5432,
+            }),
+            'postgres://kb:p%40ss@db:5432/kb',
+        )
+
+    def test_summarize(self):
+        summary = summarize([0.01, 0.02, 0.03], errors=1, elapsed=1.0, queries=[3, 3, 4])
+        self.assertEqual(summary['requests'], 4)
+        self.assertEqual(summary['p50_ms'], 20.0)
+        self.assertEqual(summary['queries'], 3)
+        self.assertEqual(summary['queries_max'], 4)
+        self.assertEqual(summary['throughput_rps'], 3.0)
@@ -0,0 +1,124 @@
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.auth import get_user_model
+
+from kb.downloads import RangeNotSatisfiable, parse_range
+from kb.models import Department, Category, Document
+
+User = get_user_model()
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix='kb-media-')
+PAYLOAD = bytes(range(256)) * 1024
+
+
+class ParseRangeTest(TestCase):
+    def test_ranges(self):
+        self.assertEqual(parse_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range('bytes=900-', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=-100', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=500-5000', 1000), (500, 999))
+
+    def test_unsupported_ranges_serve_whole_file(self):
+        self.assertIsNone(parse_range(None, 1000))
+        self.assertIsNone(parse_range('bytes=0-1,5-6', 1000))
+        self.assertIsNone(parse_range('items=0-1', 1000))
+
+    def test_unsatisfiable(self):
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range('bytes=1000-', 1000)
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range('bytes=-0', 1000)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class DocumentDownloadTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.department = Department.objects.create(name='Engineering')
+        self.category = Category.objects.create(name='Specs', department=self.department)
+        self.user = User.objects.create_user(
+            username='engineer',
+            password='testpass123',
+            department=self.department
+        )
+        self.document = Document.objects.create(
+            title='Spec',
+            content='Content',
+            author=self.user,
+            category=self.category,
+            department=self.department,
+            file=SimpleUploadedFile('spec.pdf', PAYLOAD, content_type='application/pdf')
+        )
+        self.url = reverse('document_download', args=[self.document.slug])
+        self.client.login(username='engineer', password='testpass123')
+
+    def test_full_download_is_streamed(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content), PAYLOAD)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+
+    def test_partial_content(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(PAYLOAD)}')
+        self.assertEqual(b''.join(response.streaming_content), PAYLOAD[100:200])
+
+    def test_range_not_satisfiable(self):
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(PAYLOAD)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(PAYLOAD)}')
+
+    def test_stale_if_range_returns_whole_file(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_conditional_get(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_active_content_is_never_inline(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response['Content-Disposition'].startswith('inline'))
+        self.assertEqual(response['X-Content-Type-Options'], 'nosniff')
+
+        for name, content in (('page.html', b'<script>alert(1)</script>'),
+                              ('image.svg', b'<svg><script>alert(1)</script></svg>')):
+            self.document.file.save(name, SimpleUploadedFile(name, content), save=True)
+            self.document.file_name = name
+            self.document.save()
+            for headers in ({}, {'HTTP_RANGE': 'bytes=0-3'}):
+                response = self.client.get(self.url, **headers)
+                self.assertTrue(response['Content-Disposition'].startswith('attachment'), name)
+                self.assertEqual(response['X-Content-Type-Options'], 'nosniff')
+
+    def test_access_is_checked(self):
+        User.objects.create_user(
+            username='outsider',
+            password='testpass123',
+            department=Department.objects.create(name='Sales')
+        )
+        self.client.login(username='outsider', password='testpass123')
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_document_without_file(self):
+        self.document.file = None
+        self.document.save()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    @override_settings(KB_SENDFILE_BACKEND='nginx', KB_SENDFILE_URL_PREFIX='/protected/')
+    def test_x_accel_redirect(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/' + self.document.file.name)
+        self.assertEqual(response.content, b'')
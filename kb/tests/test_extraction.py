@@ -0,0 +1,161 @@
+import io
+import shutil
+import tempfile
+import zipfile
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from kb.extraction import EXTRACTOR_VERSION, extract_docx
+from kb.models import AttachmentText, Category, Department, Document
+from kb.search import get_search_backend
+
+User = get_user_model()
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix='kb-media-')
+
+W = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+DOCX_XML = (
+    f'<w:document xmlns:w="{W}"><w:body>'
+    '<w:p><w:r><w:t>Регламент </w:t></w:r><w:r><w:t>инвентаризации</w:t></w:r></w:p>'
+    '<w:p><w:r><w:t>склада</w:t></w:r></w:p>'
+    '</w:body></w:document>'
+)
+ODT_XML = (
+    '<office:document-content xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+    'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0"><office:body><office:text>'
+    '<text:h>Приказ</text:h><text:p>О <text:span>командировках</text:span></text:p>'
+    '</office:text></office:body></office:document-content>'
+)
+
+
+def make_docx(xml=DOCX_XML, compression=zipfile.ZIP_STORED):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression) as archive:
+        archive.writestr('[Content_Types].xml', '<Types/>')
+        archive.writestr('word/document.xml', xml)
+    return buffer.getvalue()
+
+
+def make_odt():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('mimetype', 'application/vnd.oasis.opendocument.text', zipfile.ZIP_STORED)
+        archive.writestr('content.xml', ODT_XML)
+    return buffer.getvalue()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, KB_EXTRACTION_MAX_ATTEMPTS=2)
+class AttachmentExtractionTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.department = Department.objects.create(name='Логистика')
+        self.category = Category.objects.create(name='Склад', department=self.department)
+        self.user = User.objects.create_user(username='author', password='testpass123')
+
+    def create_document(self, filename, data, title='Вложение'):
+        return Document.objects.create(
+            title=title,
+            content='Без текста',
+            author=self.user,
+            category=self.category,
+            department=self.department,
+            file=SimpleUploadedFile(filename, data),
+        )
+
+    def extract(self):
+        call_command('extract_attachments', workers=0, stdout=StringIO(), stderr=StringIO())
+
+    def test_upload_is_queued(self):
+        document = self.create_document('a.docx', make_docx())
+        entry = AttachmentText.objects.get(document=document)
+        self.assertEqual((entry.status, entry.file), (AttachmentText.PENDING, document.file.name))
+
+    def test_docx_and_odt_text_is_searchable(self):
+        docx = self.create_document('a.docx', make_docx())
+        odt = self.create_document('b.odt', make_odt())
+        self.extract()
+
+        entry = AttachmentText.objects.get(document=docx)
+        self.assertEqual(entry.status, AttachmentText.DONE)
+        self.assertEqual(entry.text, 'Регламент инвентаризации\nсклада')
+        self.assertEqual(entry.extractor_version, EXTRACTOR_VERSION)
+        self.assertIn('командировках', AttachmentText.objects.get(document=odt).text)
+
+        backend = get_search_backend()
+        self.assertEqual(list(backend.search(Document.objects.all(), 'инвентаризация')), [docx])
+        self.assertEqual(list(backend.search(Document.objects.all(), 'командировки')), [odt])
+
+    def test_list_query_does_not_load_text(self):
+        self.create_document('a.docx', make_docx())
+        self.extract()
+        with self.assertNumQueries(1) as queries:
+            list(Document.objects.all())
+        self.assertNotIn('kb_attachmenttext', queries.captured_queries[0]['sql'])
+
+    def test_corrupt_file_is_retried_with_backoff(self):
+        document = self.create_document('broken.docx', b'PK\x03\x04word/' + b'\x00' * 64)
+        self.extract()
+
+        entry = AttachmentText.objects.get(document=document)
+        self.assertEqual((entry.status, entry.attempts), (AttachmentText.PENDING, 1))
+        self.assertIn('BadZipFile', entry.last_error)
+        self.assertGreater(entry.next_attempt_at, timezone.now() + timedelta(seconds=30))
+
+        # Следующая попытка еще не наступила
+        self.extract()
+        self.assertEqual(AttachmentText.objects.get(document=document).attempts, 1)
+
+        AttachmentText.objects.filter(document=document).update(next_attempt_at=timezone.now())
+        self.extract()
+        entry = AttachmentText.objects.get(document=document)
+        self.assertEqual((entry.status, entry.attempts), (AttachmentText.FAILED, 2))
+
+    @override_settings(KB_EXTRACTION_MAX_MEMBER_SIZE=10_000)
+    def test_oversized_archive_member_is_not_inflated(self):
+        paragraph = '<w:p><w:r><w:t>склад</w:t></w:r></w:p>'
+        bomb = make_docx(
+            f'<w:document xmlns:w="{W}"><w:body>{paragraph * 1000}</w:body></w:document>', zipfile.ZIP_DEFLATED,
+        )
+        self.assertLess(len(bomb), 10_000)
+        document = self.create_document('bomb.docx', bomb)
+        self.extract()
+
+        entry = AttachmentText.objects.get(document=document)
+        self.assertEqual(entry.status, AttachmentText.UNSUPPORTED)
+        self.assertIn('слишком большая', entry.last_error)
+
+    @override_settings(KB_EXTRACTION_MAX_CHARS=100)
+    def test_text_collection_stops_at_limit(self):
+        paragraph = '<w:p><w:r><w:t>склад</w:t></w:r></w:p>'
+        data = make_docx(f'<w:document xmlns:w="{W}"><w:body>{paragraph * 1000}</w:body></w:document>')
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertLessEqual(len(extract_docx(archive)), 100)
+
+    def test_images_are_not_retried(self):
+        document = self.create_document('photo.png', b'\x89PNG\r\n\x1a\n' + b'\x00' * 32)
+        self.extract()
+        self.assertEqual(AttachmentText.objects.get(document=document).status, AttachmentText.UNSUPPORTED)
+
+    def test_reextract_requeues_everything(self):
+        document = self.create_document('a.docx', make_docx())
+        self.extract()
+        AttachmentText.objects.filter(document=document).delete()
+        legacy = self.create_document('b.docx', make_docx(), title='Другое')
+        AttachmentText.objects.filter(document=legacy).update(status=AttachmentText.DONE)
+
+        call_command('extract_attachments', workers=0, reextract=True, stdout=StringIO())
+
+        self.assertEqual(
+            set(AttachmentText.objects.values_list('status', flat=True)), {AttachmentText.DONE},
+        )
+        self.assertEqual(AttachmentText.objects.count(), 2)
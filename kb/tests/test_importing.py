@@ -0,0 +1,155 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from kb.importing import SlugAllocator
+from kb.models import Category, Department, Document
+from kb.search import get_search_backend
+
+User = get_user_model()
+
+
+class SlugAllocatorTest(TestCase):
+    def test_allocates_unique_transliterated_slugs(self):
+        slugs = SlugAllocator(taken={'otchet', 'otchet-2'})
+        self.assertEqual(slugs.allocate('Отчет'), 'otchet-3')
+        self.assertEqual(slugs.allocate('Отчет'), 'otchet-4')
+        self.assertEqual(slugs.allocate('План работ'), 'plan-rabot')
+        self.assertEqual(slugs.allocate('!!!'), 'document')
+
+
+class ImportDocumentsCommandTest(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='kb-import-')
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        self.department = Department.objects.create(name='Финансы', slug='finance')
+        self.category = Category.objects.create(name='Отчеты', department=self.department)
+        self.author = User.objects.create_user(username='archivist', password='testpass123')
+        Document.objects.create(
+            title='Отчет', content='Старый', author=self.author,
+            category=self.category, department=self.department,
+        )
+
+    def write_jsonl(self, records):
+        path = os.path.join(self.tmp, 'archive.jsonl')
+        with open(path, 'w', encoding='utf-8') as target:
+            for record in records:
+                target.write(json.dumps(record, ensure_ascii=False) + '\n')
+        return path
+
+    def record(self, index, **extra):
+        return {
+            'title': 'Отчет', 'content': f'Квартальный баланс номер {index}',
+            'department': 'finance', 'category': 'Отчеты', 'author': 'archivist', **extra,
+        }
+
+    def test_jsonl_import_in_batches(self):
+        path = self.write_jsonl([self.record(i) for i in range(50)] + [{'title': 'Без отдела'}])
+        out, err = StringIO(), StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('import_documents', path, batch_size=20, stdout=out, stderr=err)
+
+        # Число запросов зависит от числа пачек, а не документов
+        self.assertLess(len(queries), 30)
+        imported = Document.objects.exclude(content='Старый')
+        self.assertEqual(imported.count(), 50)
+        self.assertEqual(len(set(imported.values_list('slug', flat=True))), 50)
+        self.assertFalse(imported.filter(slug='otchet').exists())
+        document = imported.get(content='Квартальный баланс номер 7')
+        self.assertEqual(document.excerpt, 'Квартальный баланс номер 7')
+        self.assertTrue(document.content_html)
+        self.assertIn('Позиция 51: Не указан отдел', err.getvalue())
+        self.assertIn('импортировано 50, пропущено 1', out.getvalue())
+        self.assertFalse(os.path.exists(path + '.checkpoint'))
+        self.assertIn(document, get_search_backend().filter(Document.objects.all(), 'баланс'))
+
+    def test_malformed_jsonl_lines_are_skipped(self):
+        path = self.write_jsonl([self.record(1)])
+        with open(path, 'a', encoding='utf-8') as target:
+            target.write('{"title": "Обрыв\n')
+            target.write('["не объект"]\n')
+            target.write(json.dumps(self.record(2), ensure_ascii=False) + '\n')
+        out, err = StringIO(), StringIO()
+        call_command('import_documents', path, stdout=out, stderr=err)
+
+        self.assertEqual(Document.objects.exclude(content='Старый').count(), 2)
+        self.assertIn('Позиция 2: Некорректный JSON', err.getvalue())
+        self.assertIn('Позиция 3: Запись должна быть JSON-объектом', err.getvalue())
+        self.assertIn('импортировано 2, пропущено 2', out.getvalue())
+
+    def test_non_string_fields(self):
+        path = self.write_jsonl([
+            self.record(1, content=123),
+            self.record(2, content={'text': 'x'}),
+            self.record(3, author=['archivist']),
+        ])
+        out, err = StringIO(), StringIO()
+        call_command('import_documents', path, stdout=out, stderr=err)
+
+        self.assertEqual(Document.objects.get(content='123').excerpt, '123')
+        self.assertIn('Позиция 2: Поле content должно быть строкой', err.getvalue())
+        self.assertIn('Позиция 3: Поле author должно быть строкой', err.getvalue())
+        self.assertIn('импортировано 1, пропущено 2', out.getvalue())
+
+    def test_resume_after_checkpoint(self):
+        path = self.write_jsonl([self.record(i) for i in range(5)])
+        with open(path + '.checkpoint', 'w') as checkpoint:
+            json.dump({'position': 3}, checkpoint)
+
+        call_command('import_documents', path, stdout=StringIO())
+
+        self.assertEqual(
+            sorted(Document.objects.exclude(content='Старый').values_list('content', flat=True)),
+            ['Квартальный баланс номер 3', 'Квартальный баланс номер 4'],
+        )
+
+    def test_csv_with_missing_categories(self):
+        path = os.path.join(self.tmp, 'archive.csv')
+        with open(path, 'w', encoding='utf-8') as target:
+            target.write('title,content,department,category,is_published\n')
+            target.write('Инструкция,Текст,Склад,Приемка,0\n')
+
+        call_command(
+            'import_documents', path, default_author='archivist', create_missing=True, stdout=StringIO(),
+        )
+
+        document = Document.objects.get(title='Инструкция')
+        self.assertEqual((document.department.name, document.category.name), ('Склад', 'Приемка'))
+        self.assertFalse(document.is_published)
+        self.assertEqual(document.author, self.author)
+
+    def test_directory_tree(self):
+        folder = os.path.join(self.tmp, 'tree', 'Финансы', 'Отчеты')
+        os.makedirs(folder)
+        with open(os.path.join(folder, 'Годовой_отчет.md'), 'w', encoding='utf-8') as target:
+            target.write('Итоги года')
+
+        call_command('import_documents', os.path.join(self.tmp, 'tree'), default_author='archivist', stdout=StringIO())
+
+        document = Document.objects.get(title='Годовой отчет')
+        self.assertEqual((document.slug, document.category), ('godovoi-otchet', self.category))
+
+    def test_directory_skips_unreadable_files(self):
+        folder = os.path.join(self.tmp, 'tree', 'Финансы', 'Отчеты')
+        os.makedirs(folder)
+        with open(os.path.join(folder, 'Старый.txt'), 'wb') as target:
+            target.write('Итоги'.encode('cp1251'))
+        with open(os.path.join(folder, 'Новый.txt'), 'w', encoding='utf-8') as target:
+            target.write('Итоги года')
+        out, err = StringIO(), StringIO()
+
+        call_command(
+            'import_documents', os.path.join(self.tmp, 'tree'), default_author='archivist', stdout=out, stderr=err,
+        )
+
+        self.assertTrue(Document.objects.filter(title='Новый').exists())
+        self.assertIn('не удалось прочитать файл', err.getvalue())
+        self.assertIn('импортировано 1, пропущено 1', out.getvalue())
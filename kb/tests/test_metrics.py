@@ -0,0 +1,95 @@
+import multiprocessing
+import re
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from kb import metrics
+from kb.cache import get_cache
+from kb.models import Category, Department, Document
+
+User = get_user_model()
+
+PAYLOAD = b'%PDF-1.4 ' + b'0' * 1000
+
+
+def sample(text, line):
+    match = re.search(rf'^{re.escape(line)} (\S+)$', text, re.M)
+    return float(match.group(1)) if match else None
+
+
+class MetricsTestMixin:
+    def setUp(self):
+        super().setUp()
+        self.root = tempfile.mkdtemp(prefix='kb-metrics-')
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        override = override_settings(KB_METRICS_DIR=self.root, KB_METRICS_FLUSH_INTERVAL=0, MEDIA_ROOT=self.root)
+        override.enable()
+        self.addCleanup(override.disable)
+        get_cache().clear()
+
+
+class MetricsEndpointTest(MetricsTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.department = Department.objects.create(name='Support')
+        self.user = User.objects.create_user(username='reader', password='pass', department=self.department)
+        self.document = Document.objects.create(
+            title='Guide', content='Text', author=self.user, department=self.department,
+            category=Category.objects.create(name='FAQ', department=self.department),
+            file=SimpleUploadedFile('guide.pdf', PAYLOAD, content_type='application/pdf'),
+        )
+        self.client.force_login(self.user)
+
+    def test_exposition(self):
+        for _ in range(2):
+            self.client.get(reverse('document_list'))
+        self.client.get(reverse('document_download', args=[self.document.slug]))
+        text = self.client.get(reverse('metrics')).content.decode()
+
+        self.assertIn('# TYPE kb_http_request_duration_seconds histogram', text)
+        self.assertEqual(sample(text, 'kb_http_request_duration_seconds_bucket{view="document_list",le="+Inf"}'), 2)
+        self.assertEqual(sample(text, 'kb_http_request_duration_seconds_count{view="document_list"}'), 2)
+        self.assertEqual(sample(text, 'kb_http_requests_total{status="2xx",view="document_list"}'), 2)
+        self.assertGreater(sample(text, 'kb_db_queries_total{view="document_list"}'), 0)
+        self.assertEqual(sample(text, 'kb_fragment_cache_requests_total{fragment="document_rows",result="miss"}'), 1)
+        self.assertEqual(sample(text, 'kb_fragment_cache_requests_total{fragment="document_rows",result="hit"}'), 1)
+        self.assertEqual(sample(text, 'kb_download_bytes_total'), len(PAYLOAD))
+        self.assertEqual(sample(text, 'kb_department_documents{department="Support"}'), 1)
+
+    @override_settings(KB_METRICS_TOKEN='secret')
+    def test_token_required(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(KB_METRICS_ALLOWED_IPS=[])
+    def test_other_hosts_forbidden(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+
+def _worker(amount):
+    metrics.inc('kb_upload_bytes_total', amount)
+    metrics.observe('kb_http_request_duration_seconds', 0.2, view='document_list')
+    metrics.flush(force=True)
+
+
+class MultiprocessTest(MetricsTestMixin, SimpleTestCase):
+    def test_processes_are_summed(self):
+        metrics.inc('kb_upload_bytes_total', 1)
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=_worker, args=(amount,)) for amount in (10, 100)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        totals = metrics.get_store().collect()
+        self.assertEqual(totals[metrics._key('kb_upload_bytes_total', {})], 111)
+        bucket = metrics._key('kb_http_request_duration_seconds_bucket', {'view': 'document_list', 'le': 0.25})
+        self.assertEqual(totals[bucket], 2)
+        self.assertNotIn(metrics._key('kb_http_request_duration_seconds_bucket', {'view': 'document_list', 'le': 0.1}), totals)
@@ -1,7 +1,13 @@
+from io import StringIO
+from unittest import mock
+
 from django.test import TestCase
+from django.core.management import call_command
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth import get_user_model
+from kb.cache import get_version
 from kb.models import Department, Category, Document, Comment
+from kb.rendering import render_batch, renderer_key
 import os
 
 User = get_user_model()
@@ -78,6 +84,23 @@ class DocumentModelTest(TestCase):
         self.assertTrue(self.document.is_published)
         self.assertEqual(self.document.author.username, 'doccreator')
 
+    def test_excerpt_and_word_count(self):
+        self.assertEqual(self.document.excerpt, 'Step by step guide')
+        self.assertEqual(self.document.word_count, 4)
+
+        self.document.content = ' '.join(['слово'] * 40)
+        self.document.save(update_fields=['content'])
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.excerpt, ' '.join(['слово'] * 30) + ' …')
+        self.assertEqual(self.document.word_count, 40)
+
+    def test_backfill_excerpts_command(self):
+        Document.objects.update(excerpt='', word_count=0)
+        call_command('backfill_excerpts', stdout=StringIO())
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.excerpt, 'Step by step guide')
+        self.assertEqual(self.document.word_count, 4)
+
     def test_file_upload(self):
         test_file = SimpleUploadedFile(
             'test.pdf',
@@ -124,4 +147,67 @@ class CommentModelTest(TestCase):
         self.assertEqual(self.comment.text, 'Great campaign!')
         self.assertEqual(self.comment.link, 'https://example.com')
         self.assertTrue(self.comment.is_active)
-        self.assertEqual(str(self.comment), f'Комментарий {self.comment.id} к документу Summer Campaign')
\ No newline at end of file
+        self.assertEqual(str(self.comment), f'Комментарий {self.comment.id} к документу Summer Campaign')
+
+class DocumentRenderingTest(TestCase):
+    def setUp(self):
+        self.department = Department.objects.create(name='Legal')
+        self.user = User.objects.create_user(
+            username='lawyer',
+            password='testpass123'
+        )
+        self.category = Category.objects.create(
+            name='Contracts',
+            department=self.department
+        )
+        self.document = Document.objects.create(
+            title='NDA',
+            content='<script>alert(1)</script>\n\nSecond paragraph',
+            author=self.user,
+            category=self.category,
+            department=self.department
+        )
+
+    def test_html_rendered_on_save(self):
+        self.assertEqual(
+            self.document.content_html,
+            '<p>&lt;script&gt;alert(1)&lt;/script&gt;</p>\n\n<p>Second paragraph</p>'
+        )
+        self.assertEqual(self.document.content_renderer, renderer_key())
+
+    def test_stale_renderer_is_rerendered_on_read(self):
+        Document.objects.update(content_html='old', content_renderer='plain-0')
+        document = Document.objects.defer('content').get(pk=self.document.pk)
+        self.assertIn('Second paragraph', document.get_content_html())
+        self.assertEqual(
+            Document.objects.values_list('content_renderer', flat=True).get(),
+            renderer_key()
+        )
+
+    def test_render_documents_command(self):
+        Document.objects.update(content_html='', content_renderer='')
+        call_command('render_documents', workers=0, stdout=StringIO())
+        self.document.refresh_from_db()
+        self.assertIn('Second paragraph', self.document.content_html)
+        self.assertEqual(self.document.content_renderer, renderer_key())
+
+    def test_render_documents_all_invalidates_cache(self):
+        version = get_version(self.department.id)
+        call_command('render_documents', workers=0, all=True, stdout=StringIO())
+        self.assertNotEqual(get_version(self.department.id), version)
+
+    def test_render_documents_keeps_concurrent_edit(self):
+        Document.objects.update(content_html='', content_renderer='')
+
+        def render_then_edit(items, content_format):
+            rendered = render_batch(items, content_format)
+            # Документ отредактирован, пока пачка рендерилась
+            document = Document.objects.get(pk=self.document.pk)
+            document.content = 'Edited'
+            document.save()
+            return rendered
+
+        with mock.patch('kb.management.commands.render_documents.render_batch', render_then_edit):
+            call_command('render_documents', workers=0, stdout=StringIO())
+        self.document.refresh_from_db()
+        self.assertIn('Edited', self.document.content_html)
@@ -0,0 +1,154 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.contrib.auth import get_user_model
+
+from kb.models import Department, Category, Document, Comment
+from kb.cache import get_cache
+from kb.pagination import EstimatedCountPaginator, KeysetPaginator, encode_cursor
+
+User = get_user_model()
+
+
+class KeysetPaginatorTest(TestCase):
+    def setUp(self):
+        self.department = Department.objects.create(name='Archive')
+        self.category = Category.objects.create(name='Letters', department=self.department)
+        self.user = User.objects.create_user(
+            username='archivist',
+            password='testpass123',
+            department=self.department
+        )
+        for number in range(7):
+            Document.objects.create(
+                title=f'Letter {number}',
+                content='Content',
+                author=self.user,
+                category=self.category,
+                department=self.department
+            )
+        # Одинаковое время создания проверяет разрешение «ничьих» по id
+        Document.objects.update(created_at=timezone.now())
+        self.ordered = list(Document.objects.order_by('-created_at', '-id'))
+        self.paginator = KeysetPaginator(Document.objects.order_by('-created_at', '-id'), per_page=3)
+
+    def test_walk_forward_and_back(self):
+        first = self.paginator.get_page()
+        self.assertEqual(list(first), self.ordered[:3])
+        self.assertFalse(first.has_previous)
+
+        second = self.paginator.get_page(first.next_cursor)
+        self.assertEqual(list(second), self.ordered[3:6])
+
+        third = self.paginator.get_page(second.next_cursor)
+        self.assertEqual(list(third), self.ordered[6:])
+        self.assertFalse(third.has_next)
+
+        back = self.paginator.get_page(third.previous_cursor)
+        self.assertEqual(list(back), self.ordered[3:6])
+        self.assertTrue(back.has_next)
+
+        start = self.paginator.get_page(back.previous_cursor)
+        self.assertEqual(list(start), self.ordered[:3])
+        self.assertFalse(start.has_previous)
+
+    def test_page_query_is_bounded(self):
+        first = self.paginator.get_page()
+        with self.assertNumQueries(1):
+            self.paginator.get_page(first.next_cursor)
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        self.assertEqual(list(self.paginator.get_page('garbage')), self.ordered[:3])
+        self.assertEqual(list(self.paginator.get_page(encode_cursor([1], 'next'))), self.ordered[:3])
+        # Значения подходящей длины, но не тех типов
+        for values in (['garbage', 'x'], [{'a': 1}, 1], [None, None], [self.ordered[0].created_at, 'x']):
+            page = self.paginator.get_page(encode_cursor(values, 'prev'))
+            self.assertEqual(list(page), self.ordered[:3], values)
+            self.assertFalse(page.has_previous)
+
+    def test_requires_ordering(self):
+        with self.assertRaises(ValueError):
+            KeysetPaginator(Document.objects.all(), per_page=3)
+
+
+@override_settings(KB_ADMIN_EXACT_COUNT_LIMIT=3)
+class EstimatedCountPaginatorTest(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.department = Department.objects.create(name='Archive')
+        self.category = Category.objects.create(name='Letters', department=self.department)
+        self.user = User.objects.create_user(username='archivist', password='testpass123', department=self.department)
+        Document.objects.bulk_create([
+            Document(
+                title=f'Letter {number}', slug=f'letter-{number}', content='Content',
+                author=self.user, category=self.category, department=self.department,
+            )
+            for number in range(5)
+        ])
+
+    def test_exact_below_limit(self):
+        queryset = Document.objects.filter(title__in=['Letter 1', 'Letter 2']).order_by('pk')
+        self.assertEqual(EstimatedCountPaginator(queryset, 2).count, 2)
+
+    def test_cached_count_above_limit(self):
+        queryset = Document.objects.filter(is_published=True).order_by('pk')
+        self.assertEqual(EstimatedCountPaginator(queryset, 2).count, 5)
+
+        Document.objects.filter(title='Letter 0').delete()
+        # Без оценки планировщика число берется из кэша до истечения таймаута
+        with self.assertNumQueries(1):
+            self.assertEqual(EstimatedCountPaginator(queryset, 2).count, 5)
+
+    def test_table_statistics_for_unfiltered_list(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        paginator = EstimatedCountPaginator(Document.objects.order_by('pk'), 2)
+        with self.assertNumQueries(2):
+            self.assertEqual(paginator.count, 5)
+        self.assertEqual(paginator.num_pages, 3)
+
+
+@override_settings(KB_DOCUMENTS_PER_PAGE=2, KB_COMMENTS_PER_PAGE=2)
+class PaginatedViewsTest(TestCase):
+    def setUp(self):
+        self.department = Department.objects.create(name='Support')
+        self.category = Category.objects.create(name='FAQ', department=self.department)
+        self.user = User.objects.create_user(
+            username='supporter',
+            password='testpass123',
+            department=self.department
+        )
+        self.documents = [
+            Document.objects.create(
+                title=f'Answer {number}',
+                content='Content',
+                author=self.user,
+                category=self.category,
+                department=self.department
+            )
+            for number in range(3)
+        ]
+        self.client.login(username='supporter', password='testpass123')
+
+    def test_document_list_next_page_keeps_filters(self):
+        response = self.client.get(reverse('document_list'), {'category': self.category.id})
+        page = response.context['page']
+        self.assertEqual(len(page), 2)
+        self.assertIn(f'category={self.category.id}', page.next_url)
+
+        response = self.client.get(reverse('document_list') + page.next_url)
+        self.assertEqual(list(response.context['documents']), [self.documents[0]])
+
+    def test_comment_pages(self):
+        document = self.documents[0]
+        comments = [
+            Comment.objects.create(document=document, author=self.user, text=f'Comment {number}')
+            for number in range(3)
+        ]
+        url = reverse('document_detail', args=[document.slug])
+        page = self.client.get(url).context['comments']
+        self.assertEqual(list(page), comments[:2])
+
+        response = self.client.get(url + page.next_url)
+        self.assertEqual(list(response.context['comments']), comments[2:])
@@ -0,0 +1,129 @@
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+
+from kb import previews
+from kb.models import AttachmentPreview, Category, Department, Document
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+User = get_user_model()
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix='kb-media-')
+
+
+def png_bytes(size=(800, 600)):
+    buffer = io.BytesIO()
+    Image.new('RGBA', size, (200, 30, 30, 128)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class EvictTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='kb-previews-')
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def make(self, digest, size, age):
+        path = os.path.join(self.root, digest[:2], f'{digest}-1.jpg')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as target:
+            target.write(b'x' * size)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_least_recently_requested_are_evicted(self):
+        old = self.make('aa' * 32, 400, age=300)
+        recent = self.make('bb' * 32, 400, age=10)
+        with override_settings(KB_PREVIEW_ROOT=self.root):
+            self.assertEqual(previews.evict(max_size=1000), [])
+            self.assertEqual(previews.evict(max_size=700), ['aa' * 32])
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(recent))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, KB_PREVIEW_ROOT=None)
+class PreviewQueueTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.department = Department.objects.create(name='Design')
+        self.category = Category.objects.create(name='Mockups', department=self.department)
+        self.user = User.objects.create_user(
+            username='designer',
+            password='testpass123',
+            department=self.department
+        )
+        self.client.login(username='designer', password='testpass123')
+
+    def create_document(self, name, content):
+        return Document.objects.create(
+            title=name, content='Content', author=self.user,
+            category=self.category, department=self.department,
+            file=SimpleUploadedFile(name, content),
+        )
+
+    def test_upload_is_queued_with_content_hash(self):
+        document = self.create_document('notes.txt', b'plain text')
+        preview = AttachmentPreview.objects.get(file=document.file.name)
+        self.assertEqual(preview.status, AttachmentPreview.PENDING)
+        self.assertEqual(preview.digest, os.path.basename(document.file.name))
+
+    def test_unsupported_type(self):
+        document = self.create_document('notes.txt', b'plain text')
+        call_command('render_previews', workers=0, stdout=io.StringIO(), stderr=io.StringIO())
+        preview = AttachmentPreview.objects.get(file=document.file.name)
+        self.assertEqual(preview.status, AttachmentPreview.UNSUPPORTED)
+
+    @unittest.skipIf(Image is None, 'Pillow не установлен')
+    def test_rendered_preview_is_listed_and_served(self):
+        document = self.create_document('mockup.png', png_bytes())
+        # До рендеринга список не ссылается на миниатюру
+        self.assertNotContains(self.client.get(reverse('document_list')), '/preview/')
+
+        call_command('render_previews', workers=0, stdout=io.StringIO())
+        preview = AttachmentPreview.objects.get(file=document.file.name)
+        self.assertEqual(preview.status, AttachmentPreview.DONE)
+
+        url = reverse('document_preview', args=[document.slug, previews.preview_key(preview.digest)])
+        self.assertContains(self.client.get(reverse('document_list')), url)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        with Image.open(io.BytesIO(b''.join(response.streaming_content))) as image:
+            self.assertEqual(image.format, 'JPEG')
+            self.assertLessEqual(max(image.size), previews.preview_size())
+
+    @unittest.skipIf(Image is None, 'Pillow не установлен')
+    def test_evicted_preview_is_requeued(self):
+        document = self.create_document('mockup.png', png_bytes())
+        call_command('render_previews', workers=0, stdout=io.StringIO())
+        preview = AttachmentPreview.objects.get(file=document.file.name)
+        key = previews.preview_key(preview.digest)
+        os.remove(previews.preview_path(key))
+
+        response = self.client.get(reverse('document_preview', args=[document.slug, key]))
+        self.assertEqual(response.status_code, 404)
+        preview.refresh_from_db()
+        self.assertEqual(preview.status, AttachmentPreview.PENDING)
+
+    def test_unknown_key_is_not_served(self):
+        document = self.create_document('notes.txt', b'plain text')
+        response = self.client.get(reverse('document_preview', args=[document.slug, 'ff' * 32 + '-1']))
+        self.assertEqual(response.status_code, 404)
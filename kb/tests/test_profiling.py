@@ -0,0 +1,77 @@
+import pstats
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from kb import profiling
+from kb.models import Category, Department, Document
+
+User = get_user_model()
+
+
+class ProfilingTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='kb-profiles-')
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        override = override_settings(KB_PROFILE_ROOT=self.root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.department = Department.objects.create(name='Support')
+        self.employee = User.objects.create_user(username='reader', password='pass', department=self.department)
+        self.admin = User.objects.create_user(
+            username='root', password='pass', user_type='ADMIN', is_staff=True, department=self.department,
+        )
+        Document.objects.create(
+            title='Guide', content='Text', author=self.employee, department=self.department,
+            category=Category.objects.create(name='FAQ', department=self.department),
+        )
+
+    def test_staff_flag_profiles_request(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('document_list'), {'q': 'guide', '_profile': '1'})
+        name = response[profiling.PROFILE_HEADER]
+        [profile] = profiling.list_profiles()
+        self.assertEqual(profile['name'], name)
+        self.assertEqual(profile['view'], 'document_list')
+        self.assertEqual(profile['reason'], 'requested')
+        self.assertTrue(pstats.Stats(profiling.profile_path(name)).total_calls)
+
+        response = self.client.get(reverse('kb_profile_download', args=[name, 'collapsed']))
+        stacks = response.content.decode()
+        self.assertIn('document_list', stacks)
+        self.assertRegex(stacks.splitlines()[0], r' \d+$')
+
+        response = self.client.get(reverse('kb_profiles'))
+        self.assertContains(response, name)
+
+    def test_flag_ignored_for_non_staff(self):
+        self.client.force_login(self.employee)
+        response = self.client.get(reverse('document_list'), HTTP_X_KB_PROFILE='1')
+        self.assertNotIn(profiling.PROFILE_HEADER, response)
+        self.assertEqual(profiling.list_profiles(), [])
+
+    @override_settings(KB_PROFILE_SAMPLE_RATE=1, KB_PROFILE_MAX_COUNT=2)
+    def test_sampling_by_department_is_bounded(self):
+        self.client.force_login(self.employee)
+        with override_settings(KB_PROFILE_DEPARTMENTS=[self.department.pk + 1]):
+            self.client.get(reverse('document_list'))
+        self.assertEqual(profiling.list_profiles(), [])
+
+        with override_settings(KB_PROFILE_DEPARTMENTS=[self.department.pk]):
+            for _ in range(3):
+                self.client.get(reverse('document_list'))
+        profiles = profiling.list_profiles()
+        self.assertEqual(len(profiles), 2)
+        self.assertEqual({profile['reason'] for profile in profiles}, {'sampled'})
+
+    def test_admin_page_only_for_admins(self):
+        self.employee.is_staff = True
+        self.employee.save()
+        self.client.force_login(self.employee)
+        self.assertEqual(self.client.get(reverse('kb_profiles')).status_code, 403)
+        response = self.client.get(reverse('kb_profile_download', args=['passwd', 'prof']))
+        self.assertIn(response.status_code, (403, 404))
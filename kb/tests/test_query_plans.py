@@ -0,0 +1,166 @@
+"""Планы запросов горячих страниц.
+
+Страницы открываются тестовым клиентом на синтетическом корпусе, все
+выполненные SELECT перехватываются и прогоняются через EXPLAIN. Тест
+падает, если большая таблица читается полным просмотром или если выдача
+по дате сортируется отдельно, а не читается в порядке индекса. Проход по
+первичному ключу с LIMIT (сортировка админки по умолчанию) полным
+просмотром не считается: он останавливается после страницы; так же и
+ограниченный подсчет строк в админке (COUNT по подзапросу с LIMIT). На
+PostgreSQL последовательный просмотр запрещается на время EXPLAIN:
+на маленьком корпусе он дешевле индекса, а проверяется наличие
+подходящего индекса.
+"""
+import re
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.db import connection, models
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from kb.corpus import ADMIN_USERNAME, CorpusSpec, seed_corpus
+from kb.models import Category, Comment, Document
+
+User = get_user_model()
+
+SPEC = CorpusSpec(departments=3, categories=3, users=4, documents=300, comments=3000, seed=3)
+# Таблицы, которые в рабочей базе малы: их полный просмотр допустим
+SMALL_TABLES = {
+    'kb_department', 'kb_category', 'django_session', 'django_content_type',
+    'auth_permission', 'auth_group', 'auth_group_permissions',
+    'kb_customuser', 'kb_customuser_groups', 'kb_customuser_user_permissions',
+    # Подзапрос с LIMIT в подсчете EstimatedCountPaginator
+    'subquery',
+}
+SQLITE_SCAN_RE = re.compile(r'^SCAN (\w+)$')
+# Проход по всему индексу без LIMIT (DISTINCT по дате, COUNT): тоже полный просмотр
+SQLITE_INDEX_SCAN_RE = re.compile(r'^SCAN (\w+) USING (?:COVERING )?INDEX')
+POSTGRES_SCAN_RE = re.compile(r'Seq Scan on (\w+)')
+ALIAS_RE = re.compile(r'(?:FROM|JOIN) "(\w+)" (\w+)')
+PK_ORDER_RE = re.compile(r'ORDER BY "(\w+)"\."id" (?:ASC|DESC) LIMIT')
+# Выдача по дате: должна читаться в порядке индекса
+DATE_ORDER_RE = re.compile(r'ORDER BY "kb_(?:document|comment)"\."created_at"')
+
+
+def explain(sql):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN {sql}')
+            return [row[0] for row in cursor.fetchall()]
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def problems(sql):
+    plan = explain(sql)
+    pk_order = PK_ORDER_RE.search(sql)
+    # В подзапросах Django таблицы получают псевдонимы (U0, T5): план называет их так
+    aliases = dict((alias, table) for table, alias in ALIAS_RE.findall(sql))
+    found = []
+    for line in plan:
+        match = (POSTGRES_SCAN_RE if connection.vendor == 'postgresql' else SQLITE_SCAN_RE).search(line.strip())
+        table = match and aliases.get(match.group(1), match.group(1))
+        if match and table not in SMALL_TABLES and not (pk_order and pk_order.group(1) == table):
+            found.append(f'полный просмотр {table}')
+        match = SQLITE_INDEX_SCAN_RE.search(line.strip())
+        table = match and aliases.get(match.group(1), match.group(1))
+        if match and table not in SMALL_TABLES and ' LIMIT ' not in sql:
+            found.append(f'просмотр всего индекса {table}')
+        if DATE_ORDER_RE.search(sql) and ('TEMP B-TREE FOR ORDER BY' in line or line.strip().startswith('Sort')):
+            found.append('сортировка без индекса')
+    return found, plan
+
+
+class QueryPlanTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_corpus(SPEC)
+        cls.admin = User.objects.get(username=ADMIN_USERNAME)
+        cls.manager = User.objects.filter(user_type='MANAGER').order_by('pk').first()
+        # Менеджер работает в админке со списками своего отдела
+        cls.manager.is_staff = True
+        cls.manager.save()
+        cls.manager.user_permissions.add(
+            *Permission.objects.filter(codename__in=['view_document', 'view_comment']),
+        )
+        cls.employee = User.objects.filter(user_type='EMPLOYEE', department=cls.manager.department).first()
+        cls.document = (
+            Document.objects.filter(department=cls.manager.department, is_published=True)
+            .order_by('-comment_count').first()
+        )
+        cls.category = Category.objects.filter(department=cls.manager.department).first()
+
+    def assertIndexed(self, user, url):
+        """Все SELECT страницы используют индексы."""
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        report = []
+        for query in context.captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            found, plan = problems(sql)
+            if found:
+                report.append('\n'.join([', '.join(found), sql, *plan]))
+        self.assertFalse(report, f'{url}:\n\n' + '\n\n'.join(report))
+
+    def test_document_list(self):
+        self.assertIndexed(self.employee, reverse('document_list'))
+
+    def test_document_list_by_category(self):
+        url = reverse('document_list') + f'?category={self.category.pk}'
+        self.assertIndexed(self.employee, url)
+
+    def test_document_list_for_admin(self):
+        self.assertIndexed(self.admin, reverse('document_list'))
+
+    def test_search(self):
+        self.assertIndexed(self.employee, reverse('document_list') + '?q=отчет')
+
+    def test_document_detail(self):
+        self.assertIndexed(self.employee, reverse('document_detail', args=[self.document.slug]))
+
+    def test_comment_pages(self):
+        self.client.force_login(self.employee)
+        response = self.client.get(reverse('document_detail', args=[self.document.slug]))
+        self.assertIndexed(self.employee, response.context['more_comments_url'])
+
+    def test_admin_documents(self):
+        self.assertIndexed(self.admin, reverse('admin:kb_document_changelist'))
+        self.assertIndexed(self.manager, reverse('admin:kb_document_changelist'))
+
+    def test_admin_documents_filtered(self):
+        url = reverse('admin:kb_document_changelist') + '?is_published__exact=1&comments=11%2B'
+        self.assertIndexed(self.admin, url)
+
+    def test_admin_comments(self):
+        self.assertIndexed(self.admin, reverse('admin:kb_comment_changelist'))
+        self.assertIndexed(self.manager, reverse('admin:kb_comment_changelist') + '?is_active__exact=0')
+
+    def test_admin_search(self):
+        self.assertIndexed(self.admin, reverse('admin:kb_document_changelist') + '?q=отчет')
+        self.assertIndexed(self.admin, reverse('admin:kb_comment_changelist') + '?q=отчет')
+
+    def test_admin_date_hierarchy(self):
+        first = Comment.objects.order_by('created_at').first().created_at
+        url = reverse('admin:kb_comment_changelist')
+        self.assertIndexed(self.admin, url)
+        self.assertIndexed(self.admin, url + f'?created_at__year={first.year}')
+        self.assertIndexed(self.admin, url + f'?created_at__year={first.year}&created_at__month={first.month}')
+
+    def test_probed_dates_match_distinct(self):
+        first = Comment.objects.order_by('created_at').first().created_at
+        by_kind = {
+            'year': Comment.objects.filter(is_active=True),
+            'month': Comment.objects.filter(created_at__year=first.year),
+            'day': Comment.objects.filter(created_at__year=first.year, created_at__month=first.month),
+        }
+        for kind, queryset in by_kind.items():
+            expected = list(models.QuerySet.datetimes(queryset, 'created_at', kind))
+            self.assertTrue(expected)
+            self.assertEqual(queryset.datetimes('created_at', kind), expected)
@@ -0,0 +1,92 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from kb import cache
+from kb.models import Category, Department, Document
+from kb.routers import PRIMARY_COOKIE, ReplicaRouter, current_replica, reading_from_replica, replica_reads
+
+User = get_user_model()
+
+
+@override_settings(KB_DATABASE_REPLICAS=['replica1'])
+class ReplicaRouterTest(SimpleTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def test_reads_from_replica_inside_marked_view(self):
+        with reading_from_replica(self.factory.get('/')):
+            self.assertEqual(self.router.db_for_read(Document), 'replica1')
+        self.assertIsNone(self.router.db_for_read(Document))
+
+    def test_sessions_and_users_stay_on_primary(self):
+        with reading_from_replica(self.factory.get('/')):
+            self.assertIsNone(self.router.db_for_read(Session))
+            self.assertIsNone(self.router.db_for_read(User))
+
+    def test_unsafe_methods_and_pinned_users_read_primary(self):
+        with reading_from_replica(self.factory.post('/')):
+            self.assertIsNone(self.router.db_for_read(Document))
+        request = self.factory.get('/')
+        request.COOKIES[PRIMARY_COOKIE] = '1'
+        with reading_from_replica(request):
+            self.assertIsNone(self.router.db_for_read(Document))
+
+    def test_write_pins_rest_of_request(self):
+        with reading_from_replica(self.factory.get('/')):
+            self.assertEqual(self.router.db_for_write(Document), 'default')
+            self.assertIsNone(self.router.db_for_read(Document))
+
+    def test_no_migrations_on_replicas(self):
+        self.assertFalse(self.router.allow_migrate('replica1', 'kb'))
+        self.assertIsNone(self.router.allow_migrate('default', 'kb'))
+
+    @override_settings(KB_DATABASE_REPLICAS=[])
+    def test_without_replicas(self):
+        with reading_from_replica(self.factory.get('/')):
+            self.assertIsNone(self.router.db_for_read(Document))
+
+    async def test_async_view(self):
+        @replica_reads
+        async def view(request):
+            return current_replica()
+
+        self.assertEqual(await view(self.factory.get('/')), 'replica1')
+
+    def test_recently_changed_fragment_expires_with_lag(self):
+        backend = cache.get_cache()
+        backend.clear()
+        cache.bump_version(1)
+        with mock.patch.object(backend, 'set', wraps=backend.set) as cache_set:
+            with reading_from_replica(self.factory.get('/')):
+                cache.cached_fragment(1, 'rows', (), lambda: 'fresh')
+            cache.cached_fragment(1, 'other', (), lambda: 'fresh')
+        self.assertEqual(cache_set.call_args_list[0].args[2], 10)
+        self.assertEqual(cache_set.call_args_list[1].args[2], 600)
+
+
+class PrimaryAfterWriteMiddlewareTest(TestCase):
+    def setUp(self):
+        department = Department.objects.create(name='Support')
+        self.user = User.objects.create_user(username='writer', password='pass', department=department)
+        self.document = Document.objects.create(
+            title='Guide', content='Text', author=self.user, department=department,
+            category=Category.objects.create(name='FAQ', department=department),
+        )
+        self.client.force_login(self.user)
+
+    @override_settings(KB_DATABASE_REPLICAS=['default'], KB_REPLICA_LAG=7)
+    def test_write_sets_cookie(self):
+        response = self.client.post(reverse('add_comment', args=[self.document.slug]), {'text': 'Спасибо'})
+        self.assertEqual(response.cookies[PRIMARY_COOKIE]['max-age'], 7)
+        response = self.client.get(reverse('document_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(PRIMARY_COOKIE, response.cookies)
+
+    def test_no_cookie_without_replicas(self):
+        response = self.client.post(reverse('add_comment', args=[self.document.slug]), {'text': 'Спасибо'})
+        self.assertNotIn(PRIMARY_COOKIE, response.cookies)
@@ -0,0 +1,147 @@
+from io import StringIO
+
+from django.test import TestCase
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+
+from kb.models import Department, Category, Comment, Document
+from kb.pagination import KeysetPaginator
+from kb.search import PostgresSearchBackend, SQLiteFTSSearchBackend, get_search_backend, stem_prefix
+
+User = get_user_model()
+
+
+class StemPrefixTest(TestCase):
+    def test_russian_endings_are_stripped(self):
+        self.assertEqual(stem_prefix('отчеты'), 'отчет')
+        self.assertEqual(stem_prefix('инструкциями'), 'инструкц')
+
+    def test_short_and_latin_terms_are_kept(self):
+        self.assertEqual(stem_prefix('акт'), 'акт')
+        self.assertEqual(stem_prefix('policy'), 'policy')
+
+
+class PostgresSearchSQLTest(TestCase):
+    def test_filter_unions_indexed_matches(self):
+        # OR с подзапросом не использует GIN-индекс: кандидаты собираются через UNION
+        queryset = PostgresSearchBackend().filter(Document.objects.all(), 'отчет')
+        sql = str(queryset.query)
+        self.assertIn('"kb_document"."id" IN (SELECT id FROM kb_document WHERE', sql)
+        self.assertIn(' UNION SELECT document_id FROM kb_attachmenttext', sql)
+        self.assertNotIn(' OR ', sql)
+
+
+class FTSSearchTest(TestCase):
+    def setUp(self):
+        self.department = Department.objects.create(name='Логистика')
+        self.category = Category.objects.create(name='Склад', department=self.department)
+        self.user = User.objects.create_user(
+            username='searcher',
+            password='testpass123',
+            department=self.department
+        )
+        self.in_title = self.create_document('Годовой отчет склада', 'Итоги года')
+        self.in_content = self.create_document('Итоги', 'Подробные отчеты по складу')
+        self.other = self.create_document('Delivery policy', 'Shipping rules')
+
+    def create_document(self, title, content):
+        return Document.objects.create(
+            title=title,
+            content=content,
+            author=self.user,
+            category=self.category,
+            department=self.department
+        )
+
+    def search(self, query):
+        return list(get_search_backend().search(Document.objects.all(), query))
+
+    def test_backend_for_sqlite(self):
+        self.assertIsInstance(get_search_backend(), SQLiteFTSSearchBackend)
+
+    def test_ranked_results_with_russian_forms(self):
+        self.assertEqual(self.search('отчеты'), [self.in_title, self.in_content])
+
+    def test_prefix_and_english_stemming(self):
+        self.assertEqual(self.search('ship'), [self.other])
+        self.assertEqual(self.search('policies'), [self.other])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.other.content = 'Правила отчетности'
+        self.other.save()
+        self.assertNotIn(self.other, self.search('shipping'))
+        self.assertIn(self.other, self.search('отчетность'))
+        self.in_title.delete()
+        self.assertEqual(self.search('годовой'), [])
+
+    def test_ranked_results_paginate_by_rank(self):
+        paginator = KeysetPaginator(get_search_backend().search(Document.objects.all(), 'отчеты'), per_page=1)
+        first = paginator.get_page()
+        second = paginator.get_page(first.next_cursor)
+        self.assertEqual(list(first) + list(second), [self.in_title, self.in_content])
+        self.assertFalse(second.has_next)
+
+    def test_query_without_terms(self):
+        self.assertEqual(self.search('!!!'), [])
+
+    def test_rebuild_command_reinstalls_index(self):
+        get_search_backend().uninstall()
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search('shipping'), [self.other])
+
+    def test_admin_search_uses_index_for_content(self):
+        admin = User.objects.create_superuser(
+            username='root', password='testpass123', email='root@example.com', user_type='ADMIN'
+        )
+        self.client.force_login(admin)
+        response = self.client.get(reverse('admin:kb_document_changelist'), {'q': 'складу'})
+        self.assertEqual(
+            set(response.context['cl'].result_list), {self.in_title, self.in_content}
+        )
+
+    def test_admin_comment_search_uses_index(self):
+        admin = User.objects.create_superuser(
+            username='root', password='testpass123', email='root@example.com', user_type='ADMIN'
+        )
+        found = Comment.objects.create(document=self.other, author=self.user, text='Где лежат отчеты?')
+        Comment.objects.create(document=self.in_title, author=admin, text='Спасибо')
+        self.client.force_login(admin)
+        url = reverse('admin:kb_comment_changelist')
+        response = self.client.get(url, {'q': 'лежат'})
+        self.assertEqual(list(response.context['cl'].result_list), [found])
+        response = self.client.get(url, {'q': 'searcher'})
+        self.assertEqual(list(response.context['cl'].result_list), [found])
+        # Заголовок документа, а не его текст
+        response = self.client.get(url, {'q': 'годового'})
+        self.assertEqual(
+            [comment.text for comment in response.context['cl'].result_list], ['Спасибо'],
+        )
+        response = self.client.get(url, {'q': 'подробные'})
+        self.assertEqual(list(response.context['cl'].result_list), [])
+
+    def test_admin_search_matches_name_prefixes(self):
+        admin = User.objects.create_superuser(
+            username='root', password='testpass123', email='root@example.com', user_type='ADMIN'
+        )
+        found = Comment.objects.create(document=self.other, author=self.user, text='Спасибо')
+        Comment.objects.create(document=self.in_title, author=admin, text='Принято')
+        self.client.force_login(admin)
+        url = reverse('admin:kb_document_changelist')
+        response = self.client.get(url, {'q': 'SEARCH'})
+        self.assertEqual(len(response.context['cl'].result_list), 3)
+        response = self.client.get(url, {'q': 'Скл'})
+        self.assertEqual(len(response.context['cl'].result_list), 3)
+
+        url = reverse('admin:kb_comment_changelist')
+        for term in ('Search', 'Delivery-Pol'):
+            response = self.client.get(url, {'q': term})
+            self.assertEqual(list(response.context['cl'].result_list), [found])
+        # Только начало, а не подстрока
+        response = self.client.get(url, {'q': 'earcher'})
+        self.assertEqual(list(response.context['cl'].result_list), [])
+
+    def test_document_list_uses_index(self):
+        self.client.login(username='searcher', password='testpass123')
+        response = self.client.get(reverse('document_list'), {'q': 'складу'})
+        self.assertEqual(list(response.context['documents']), [self.in_title, self.in_content])
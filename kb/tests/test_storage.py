@@ -0,0 +1,170 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from kb.models import Blob, Category, Department, Document
+from kb.storage import attachment_storage, blob_name
+
+User = get_user_model()
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix='kb-media-')
+POLICY = b'%PDF-1.4 policy' * 100
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ContentAddressableStorageTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='author', password='testpass123', user_type='ADMIN')
+        self.departments = [Department.objects.create(name=name) for name in ('HR', 'Finance')]
+        self.categories = [
+            Category.objects.create(name='Policies', department=department)
+            for department in self.departments
+        ]
+        self.digest = hashlib.sha256(POLICY).hexdigest()
+
+    def create_document(self, index, filename='policy.pdf', content=POLICY):
+        return Document.objects.create(
+            title=f'Policy {index}',
+            content='Content',
+            author=self.user,
+            category=self.categories[index % 2],
+            department=self.departments[index % 2],
+            file=SimpleUploadedFile(filename, content, content_type='application/pdf'),
+        )
+
+    def test_same_content_stored_once(self):
+        first = self.create_document(0)
+        second = self.create_document(1, filename='Политика.pdf')
+
+        self.assertEqual(first.file.name, blob_name(self.digest))
+        self.assertEqual(second.file.name, first.file.name)
+        self.assertEqual(first.file_name, 'policy.pdf')
+        self.assertEqual(second.file_name, 'Политика.pdf')
+        self.assertEqual(second.extension(), 'pdf')
+        blob = Blob.objects.get(name=first.file.name)
+        self.assertEqual((blob.ref_count, blob.size), (2, len(POLICY)))
+
+    def test_blob_removed_with_last_reference(self):
+        first = self.create_document(0)
+        second = self.create_document(1)
+        path = first.file.path
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(Blob.objects.get(name=second.file.name).ref_count, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(Blob.objects.exists())
+
+    def test_reupload_before_deferred_delete_keeps_file(self):
+        path = self.create_document(0).file.path
+        # Последняя ссылка ушла, но удаление файла еще не выполнено
+        with self.captureOnCommitCallbacks() as callbacks:
+            Document.objects.get().delete()
+        second = self.create_document(1)
+        for callback in callbacks:
+            callback()
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(Blob.objects.get(name=second.file.name).ref_count, 1)
+
+        # Файл уже сохранен в хранилище, а ссылка на него еще не добавлена
+        with self.captureOnCommitCallbacks() as callbacks:
+            second.delete()
+        name = attachment_storage.save('policy.pdf', SimpleUploadedFile('policy.pdf', POLICY))
+        for callback in callbacks:
+            callback()
+        self.assertTrue(attachment_storage.exists(name))
+
+        # Так и не подхваченный blob удаляет cleanup_uploads
+        Blob.objects.update(released_at=timezone.now() - timedelta(days=2))
+        call_command('cleanup_uploads', stdout=StringIO())
+        self.assertFalse(attachment_storage.exists(name))
+        self.assertFalse(Blob.objects.exists())
+
+    def test_replacing_file_releases_old_blob(self):
+        document = Document.objects.get(pk=self.create_document(0).pk)
+        old_path = document.file.path
+        document.file = SimpleUploadedFile('v2.pdf', b'%PDF-1.4 v2', content_type='application/pdf')
+        with self.captureOnCommitCallbacks(execute=True):
+            document.save()
+
+        self.assertFalse(os.path.exists(old_path))
+        self.assertEqual(document.file_name, 'v2.pdf')
+        self.assertEqual(list(Blob.objects.values_list('ref_count', flat=True)), [1])
+
+    def test_download_uses_original_filename(self):
+        document = self.create_document(0, filename='Политика.pdf')
+        self.client.login(username='author', password='testpass123')
+        response = self.client.get(reverse('document_download', args=[document.slug]))
+
+        self.assertEqual(b''.join(response.streaming_content), POLICY)
+        self.assertIn("filename*=utf-8''%D0%9F", response['Content-Disposition'])
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class MigrateAttachmentsCommandTest(TestCase):
+    def setUp(self):
+        self.addCleanup(shutil.rmtree, MEDIA_ROOT, ignore_errors=True)
+        user = User.objects.create_user(username='author', password='testpass123')
+        department = Department.objects.create(name='HR')
+        category = Category.objects.create(name='Policies', department=department)
+        legacy = FileSystemStorage()
+        self.names = [
+            legacy.save('documents/hr/Policies/policy.pdf', SimpleUploadedFile('a', POLICY)),
+            legacy.save('documents/it/Guides/policy-copy.pdf', SimpleUploadedFile('b', POLICY)),
+            legacy.save('documents/it/Guides/other.pdf', SimpleUploadedFile('c', b'other')),
+        ]
+        self.documents = [
+            Document.objects.create(
+                title=f'Legacy {index}', content='Content', author=user,
+                category=category, department=department,
+            )
+            for index in range(len(self.names))
+        ]
+        for document, name in zip(self.documents, self.names):
+            Document.objects.filter(pk=document.pk).update(file=name)
+
+    def test_moves_files_and_reports_savings(self):
+        out = StringIO()
+        call_command('migrate_attachments', workers=2, stdout=out)
+
+        files = dict(Document.objects.values_list('title', 'file'))
+        policy = blob_name(hashlib.sha256(POLICY).hexdigest())
+        self.assertEqual(files['Legacy 0'], policy)
+        self.assertEqual(files['Legacy 1'], policy)
+        self.assertTrue(attachment_storage.exists(files['Legacy 2']))
+        self.assertEqual(Document.objects.get(title='Legacy 1').file_name, 'policy-copy.pdf')
+        self.assertEqual(Blob.objects.get(name=policy).ref_count, 2)
+        for name in self.names:
+            self.assertFalse(attachment_storage.exists(name))
+        self.assertFalse(os.path.exists(attachment_storage.path('documents/it')))
+        self.assertIn(f'сэкономлено {len(POLICY)} байт', out.getvalue())
+
+    def test_dry_run_keeps_files(self):
+        out = StringIO()
+        call_command('migrate_attachments', dry_run=True, stdout=out)
+
+        self.assertIn(f'сэкономлено {len(POLICY)} байт', out.getvalue())
+        for name in self.names:
+            self.assertTrue(attachment_storage.exists(name))
+        self.assertFalse(Blob.objects.exists())
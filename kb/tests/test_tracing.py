@@ -0,0 +1,94 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from kb import tracing
+from kb.models import Category, Department, Document
+
+User = get_user_model()
+
+TRACE_DIR = tempfile.mkdtemp(prefix='kb-trace-')
+TRACE_FILE = os.path.join(TRACE_DIR, 'trace.jsonl')
+
+
+@override_settings(KB_REQUEST_TIMING=True, KB_REQUEST_TRACE_FILE=TRACE_FILE, KB_REQUEST_TRACE_SAMPLE_RATE=1)
+class RequestTimingMiddlewareTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TRACE_DIR, ignore_errors=True)
+
+    def setUp(self):
+        department = Department.objects.create(name='Support')
+        self.user = User.objects.create_user(username='timer', password='pass', department=department)
+        self.document = Document.objects.create(
+            title='Guide', content='Text', author=self.user, department=department,
+            category=Category.objects.create(name='FAQ', department=department),
+        )
+        self.client.force_login(self.user)
+        self.async_client.force_login(self.user)
+
+    def tearDown(self):
+        logger = logging.getLogger('kb.trace')
+        for handler in logger.handlers[:]:
+            handler.close()
+            logger.removeHandler(handler)
+        if os.path.exists(TRACE_FILE):
+            os.remove(TRACE_FILE)
+
+    def metrics(self, response):
+        return {
+            part.split(';')[0].strip(): part for part in response['Server-Timing'].split(',')
+        }
+
+    def test_server_timing_and_trace(self):
+        response = self.client.get(reverse('document_detail', args=[self.document.slug]))
+        metrics = self.metrics(response)
+        self.assertEqual(set(metrics), {'total', 'sql', 'template', 'policy'})
+        self.assertRegex(metrics['sql'], r'desc="[1-9]\d* SQL"')
+
+        with open(TRACE_FILE, encoding='utf-8') as trace:
+            record = json.loads(trace.readline())
+        self.assertEqual(record['view'], 'document_detail')
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(record['bytes'], len(response.content))
+        self.assertGreater(record['sql_count'], 0)
+        self.assertGreater(record['template_ms'], 0)
+
+    @override_settings(KB_REQUEST_TRACE_SAMPLE_RATE=0)
+    def test_unsampled_requests_not_written(self):
+        response = self.client.get(reverse('document_list'))
+        self.assertIn('Server-Timing', response)
+        self.assertFalse(os.path.exists(TRACE_FILE) and os.path.getsize(TRACE_FILE))
+
+    @override_settings(ROOT_URLCONF='kb.tests.urls_async')
+    async def test_async_view_queries_counted(self):
+        response = await self.async_client.get(reverse('document_list'))
+        self.assertRegex(self.metrics(response)['sql'], r'desc="[1-9]\d* SQL"')
+
+    @override_settings(KB_REQUEST_TIMING=False)
+    def test_disabled(self):
+        response = self.client.get(reverse('document_list'))
+        self.assertNotIn('Server-Timing', response)
+
+
+class SpanTest(SimpleTestCase):
+    def test_outside_request_is_noop(self):
+        with tracing.span('sql'):
+            self.assertIsNone(tracing.current_trace())
+
+    def test_nested_span_counted_once(self):
+        with tracing.tracing() as trace:
+            with tracing.span('template'):
+                with tracing.span('template'):
+                    pass
+                outer_open = 'template' in trace._open
+        self.assertTrue(outer_open)
+        self.assertGreater(trace.durations['template'], 0)
+        self.assertEqual(trace.durations['sql'], 0)
@@ -0,0 +1,188 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.utils import timezone
+
+from kb.filetypes import sniff_mime_type
+from kb.models import Department, Category, Document, UploadSession
+from kb.uploads import ChunkOutOfOrder, staging_path, write_chunk
+
+User = get_user_model()
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix='kb-media-')
+PDF = b'%PDF-1.7\n' + os.urandom(5000)
+
+
+class SniffMimeTypeTest(TestCase):
+    def test_signatures(self):
+        self.assertEqual(sniff_mime_type(PDF), 'application/pdf')
+        self.assertEqual(sniff_mime_type(b'\x89PNG\r\n\x1a\n....'), 'image/png')
+        self.assertEqual(sniff_mime_type(b'RIFF\x00\x00\x00\x00WEBPVP8 '), 'image/webp')
+        self.assertEqual(
+            sniff_mime_type(b'PK\x03\x04' + b'\x00' * 26 + b'[Content_Types].xml...word/document.xml'),
+            'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+        )
+        self.assertEqual(sniff_mime_type(b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'old.xls'), 'application/vnd.ms-excel')
+
+    def test_text(self):
+        self.assertEqual(sniff_mime_type('имя;сумма\n'.encode(), 'report.csv'), 'text/csv')
+        self.assertEqual(sniff_mime_type('BMW отчет'.encode()), 'text/plain')
+        # Блок оборван посреди двухбайтового символа
+        self.assertEqual(sniff_mime_type('текст'.encode()[:-1]), 'text/plain')
+
+    def test_unknown_binary(self):
+        self.assertIsNone(sniff_mime_type(b'MZ\x90\x00\x03\x00\x00\x00'))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, KB_UPLOAD_CHUNK_SIZE=4096)
+class ChunkedUploadTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.department = Department.objects.create(name='Archive')
+        self.category = Category.objects.create(name='Scans', department=self.department)
+        self.user = User.objects.create_user(
+            username='scanner',
+            password='testpass123',
+            department=self.department
+        )
+        self.document = Document.objects.create(
+            title='Scan',
+            content='Content',
+            author=self.user,
+            category=self.category,
+            department=self.department
+        )
+        self.client.login(username='scanner', password='testpass123')
+
+    def init(self, payload=PDF, filename='scan.pdf'):
+        response = self.client.post(
+            reverse('upload_init'),
+            {'document': self.document.slug, 'filename': filename, 'size': len(payload)},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()['id']
+
+    def put(self, upload_id, payload, start, end):
+        return self.client.put(
+            reverse('upload_detail', args=[upload_id]),
+            payload[start:end],
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end - 1}/{len(payload)}'
+        )
+
+    def test_upload_in_chunks(self):
+        upload_id = self.init()
+        staged = staging_path(UploadSession.objects.get())
+        self.assertEqual(self.put(upload_id, PDF, 0, 4096).json()['received'], 4096)
+        self.assertEqual(self.put(upload_id, PDF, 4096, len(PDF)).json()['content_type'], 'application/pdf')
+
+        response = self.client.post(reverse('upload_finalize', args=[upload_id]))
+        self.assertEqual(response.json()['sha256'], hashlib.sha256(PDF).hexdigest())
+
+        self.document.refresh_from_db()
+        with self.document.file.open('rb') as attached:
+            self.assertEqual(attached.read(), PDF)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(staged))
+
+    def test_resume_reports_received_offset(self):
+        upload_id = self.init()
+        self.put(upload_id, PDF, 0, 4096)
+        response = self.client.get(reverse('upload_detail', args=[upload_id]))
+        self.assertEqual(response.json()['received'], 4096)
+
+        conflict = self.put(upload_id, PDF, 0, 4096)
+        self.assertEqual(conflict.status_code, 409)
+        self.assertEqual(conflict.json()['received'], 4096)
+
+    def test_duplicate_chunk_does_not_touch_staged_file(self):
+        upload_id = self.init()
+        # Второй запрос с тем же куском прочитал сессию до того, как первый ее обновил
+        stale = UploadSession.objects.get()
+        self.put(upload_id, PDF, 0, 4096)
+        with self.assertRaises(ChunkOutOfOrder):
+            write_chunk(stale, 0, io.BytesIO(b'x' * 4096), 4096)
+        with open(staging_path(stale), 'rb') as staged:
+            self.assertEqual(staged.read(), PDF[:4096])
+
+        self.put(upload_id, PDF, 4096, len(PDF))
+        response = self.client.post(reverse('upload_finalize', args=[upload_id]))
+        self.assertEqual(response.json()['sha256'], hashlib.sha256(PDF).hexdigest())
+
+    def test_hash_survives_other_process(self):
+        from kb.uploads import _hashers
+        upload_id = self.init()
+        self.put(upload_id, PDF, 0, 4096)
+        _hashers.discard(UploadSession.objects.get().pk)
+        self.put(upload_id, PDF, 4096, len(PDF))
+        response = self.client.post(reverse('upload_finalize', args=[upload_id]))
+        self.assertEqual(response.json()['sha256'], hashlib.sha256(PDF).hexdigest())
+
+    def test_type_is_sniffed_from_first_chunk(self):
+        payload = b'MZ\x90\x00' + os.urandom(100)
+        upload_id = self.init(payload, filename='innocent.pdf')
+        response = self.put(upload_id, payload, 0, len(payload))
+        self.assertEqual(response.status_code, 415)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_html_and_svg_are_rejected(self):
+        html = b'<html><script>alert(1)</script></html>'
+        svg = b'<svg xmlns="http://www.w3.org/2000/svg"><script>alert(1)</script></svg>'
+        for payload, filename in ((html, 'evil.html'), (svg, 'evil.svg')):
+            response = self.client.post(
+                reverse('upload_init'),
+                {'document': self.document.slug, 'filename': filename, 'size': len(payload)},
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 415, filename)
+
+        # Разрешенное расширение, но содержимое другого типа
+        for payload, filename in ((html, 'evil.pdf'), (svg, 'evil.png')):
+            upload_id = self.init(payload, filename=filename)
+            self.assertEqual(self.put(upload_id, payload, 0, len(payload)).status_code, 415, filename)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_chunk_limits(self):
+        upload_id = self.init()
+        self.assertEqual(self.put(upload_id, PDF, 0, 4097).status_code, 413)
+        response = self.client.post(reverse('upload_finalize', args=[upload_id]))
+        self.assertEqual(response.status_code, 409)
+
+    def test_only_editors_can_upload(self):
+        User.objects.create_user(
+            username='reader',
+            password='testpass123',
+            department=self.department
+        )
+        upload_id = self.init()
+        self.client.login(username='reader', password='testpass123')
+        response = self.client.post(
+            reverse('upload_init'),
+            {'document': self.document.slug, 'filename': 'x.pdf', 'size': 10},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.get(reverse('upload_detail', args=[upload_id])).status_code, 404)
+
+    def test_cleanup_command(self):
+        upload_id = self.init()
+        self.put(upload_id, PDF, 0, 4096)
+        session = UploadSession.objects.get()
+        UploadSession.objects.update(updated_at=timezone.now() - timedelta(days=2))
+        call_command('cleanup_uploads', stdout=StringIO())
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(staging_path(session)))
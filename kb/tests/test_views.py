@@ -1,4 +1,4 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth import get_user_model
@@ -33,6 +33,13 @@ class DocumentListViewTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, 'Sales Contract')
 
+    def test_document_list_defers_content(self):
+        self.client.login(username='salesuser', password='testpass123')
+        response = self.client.get(reverse('document_list'))
+        doc = list(response.context['documents'])[0]
+        self.assertIn('content', doc.get_deferred_fields())
+        self.assertContains(response, doc.excerpt)
+
     def test_document_list_view_unauthenticated(self):
         response = self.client.get(reverse('document_list'))
         self.assertRedirects(response, f"{reverse('login')}?next={reverse('document_list')}")
@@ -121,4 +128,124 @@ class CommentViewTest(TestCase):
             reverse('delete_comment', args=[comment.id])
         )
         self.assertEqual(response.status_code, 302)
-        self.assertEqual(Comment.objects.count(), 0)
\ No newline at end of file
+        self.assertEqual(Comment.objects.count(), 0)
+
+    def test_add_comment_json(self):
+        self.client.login(username='financeuser', password='testpass123')
+        url = reverse('add_comment', args=[self.document.slug])
+        response = self.client.post(url, {'text': 'Inline'}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 201)
+        comment = Comment.objects.get()
+        self.assertEqual(response.json()['comment']['id'], comment.pk)
+        self.assertIn(f'data-comment-id="{comment.pk}"', response.json()['html'])
+
+        response = self.client.post(url, {'text': ' '}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(KB_COMMENTS_PER_PAGE=2)
+class CommentThreadTest(TestCase):
+    def setUp(self):
+        self.department = Department.objects.create(name='Support')
+        self.user = User.objects.create_user(username='reader', password='testpass123', department=self.department)
+        self.document = Document.objects.create(
+            title='FAQ', content='Content', author=self.user, department=self.department,
+            category=Category.objects.create(name='Guides', department=self.department),
+        )
+        self.comments = [
+            Comment.objects.create(document=self.document, author=self.user, text=f'Comment {n}')
+            for n in range(5)
+        ]
+        Comment.objects.create(document=self.document, author=self.user, text='Hidden', is_active=False)
+        self.client.login(username='reader', password='testpass123')
+
+    def test_first_page_rendered_rest_loaded_by_cursor(self):
+        response = self.client.get(reverse('document_detail', args=[self.document.slug]))
+        self.assertEqual([c.pk for c in response.context['comments']], [c.pk for c in self.comments[:2]])
+        url = response.context['more_comments_url']
+
+        loaded = []
+        while url:
+            # Сессия, пользователь, документ и одна выборка комментариев вместе с авторами
+            with self.assertNumQueries(4):
+                data = self.client.get(url).json()
+            loaded += [comment['id'] for comment in data['comments']]
+            url = data['next']
+        self.assertEqual(loaded, [c.pk for c in self.comments[2:]])
+
+    def test_other_department_forbidden(self):
+        User.objects.create_user(
+            username='outsider', password='testpass123', department=Department.objects.create(name='IT'),
+        )
+        self.client.login(username='outsider', password='testpass123')
+        response = self.client.get(reverse('document_comments', args=[self.document.slug]))
+        self.assertEqual(response.status_code, 403)
+
+
+class DocumentDetailConditionalGetTest(TestCase):
+    def setUp(self):
+        self.department = Department.objects.create(name='Legal')
+        self.user = User.objects.create_user(
+            username='lawyer',
+            password='testpass123',
+            department=self.department
+        )
+        self.category = Category.objects.create(
+            name='Contracts',
+            department=self.department
+        )
+        self.document = Document.objects.create(
+            title='NDA',
+            content='Content',
+            author=self.user,
+            category=self.category,
+            department=self.department
+        )
+        self.url = reverse('document_detail', args=[self.document.slug])
+        self.client.login(username='lawyer', password='testpass123')
+        # Первый ответ выдает CSRF-cookie, секрет которой входит в ETag
+        self.client.get(self.url)
+
+    def revalidate(self, response):
+        return self.client.get(
+            self.url,
+            HTTP_IF_NONE_MATCH=response['ETag'],
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified'],
+        )
+
+    def test_not_modified_without_rendering(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        with self.assertTemplateNotUsed('kb/document_detail.html'):
+            revalidated = self.revalidate(response)
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.content, b'')
+
+    def test_new_comment_changes_etag(self):
+        response = self.client.get(self.url)
+        Comment.objects.create(document=self.document, author=self.user, text='Approved')
+        self.assertEqual(self.revalidate(response).status_code, 200)
+
+    def test_deleted_comment_changes_etag(self):
+        comment = Comment.objects.create(document=self.document, author=self.user, text='Draft')
+        response = self.client.get(self.url)
+        comment.delete()
+        self.assertEqual(self.revalidate(response).status_code, 200)
+
+    def test_other_user_gets_own_etag(self):
+        response = self.client.get(self.url)
+        User.objects.create_user(
+            username='colleague',
+            password='testpass123',
+            department=self.department
+        )
+        self.client.login(username='colleague', password='testpass123')
+        self.assertEqual(self.revalidate(response).status_code, 200)
+
+    def test_no_access_is_not_revalidated(self):
+        response = self.client.get(self.url)
+        self.document.is_published = False
+        self.document.save()
+        self.assertEqual(self.revalidate(response).status_code, 403)
@@ -0,0 +1,100 @@
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.auth import get_user_model
+
+from kb.models import Department, Category, Document, Comment
+
+User = get_user_model()
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix='kb-media-')
+PAYLOAD = bytes(range(256)) * 1024
+
+
+@override_settings(ROOT_URLCONF='kb.tests.urls_async', MEDIA_ROOT=MEDIA_ROOT)
+class AsyncViewsTest(TestCase):
+    """Шаблоны async-представлений не должны обращаться к БД: иначе Django
+    бросает SynchronousOnlyOperation и тест падает."""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.department = Department.objects.create(name='Support')
+        self.category = Category.objects.create(name='FAQ', department=self.department)
+        self.user = User.objects.create_user(
+            username='supporter',
+            password='testpass123',
+            department=self.department
+        )
+        self.document = Document.objects.create(
+            title='Reset password',
+            content='Content',
+            author=self.user,
+            category=self.category,
+            department=self.department,
+            file=SimpleUploadedFile('guide.pdf', PAYLOAD, content_type='application/pdf')
+        )
+        Comment.objects.create(document=self.document, author=self.user, text='Helpful')
+        self.async_client.force_login(self.user)
+
+    async def test_document_list(self):
+        response = await self.async_client.get(reverse('document_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Reset password')
+        self.assertContains(response, 'Support')
+
+    async def test_login_required(self):
+        self.async_client.cookies.clear()
+        response = await self.async_client.get(reverse('document_list'))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/accounts/login/', response['Location'])
+
+    async def test_document_detail_conditional(self):
+        url = reverse('document_detail', args=[self.document.slug])
+        # Первый ответ выдает CSRF-cookie, секрет которой входит в ETag
+        await self.async_client.get(url)
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Helpful')
+        self.assertIn('private', response['Cache-Control'])
+
+        response = await self.async_client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_add_comment(self):
+        url = reverse('add_comment', args=[self.document.slug])
+        response = await self.async_client.post(url, {'text': 'Thanks'})
+        self.assertRedirects(
+            response, reverse('document_detail', args=[self.document.slug]), fetch_redirect_response=False,
+        )
+        self.assertTrue(await Comment.objects.filter(text='Thanks', author=self.user).aexists())
+        document = await Document.objects.aget(pk=self.document.pk)
+        self.assertEqual(document.comment_count, 2)
+
+    async def test_comments_json(self):
+        url = reverse('add_comment', args=[self.document.slug])
+        response = await self.async_client.post(url, {'text': 'Inline'}, headers={'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('Support', response.json()['html'])
+
+        response = await self.async_client.get(reverse('document_comments', args=[self.document.slug]))
+        self.assertEqual([c['text'] for c in response.json()['comments']], ['Helpful', 'Inline'])
+        self.assertIsNone(response.json()['next'])
+
+    async def test_download_is_streamed_asynchronously(self):
+        url = reverse('document_download', args=[self.document.slug])
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        self.assertEqual(response['Content-Length'], str(len(PAYLOAD)))
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), PAYLOAD)
+
+        response = await self.async_client.get(url, headers={'Range': 'bytes=100-199'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), PAYLOAD[100:200])
@@ -0,0 +1,21 @@
+"""URL-схема проекта с async-представлениями, как при KB_ASYNC_VIEWS = True."""
+import copy
+
+from django.urls import include, path
+
+from kb import urls, views_async
+from knowledgebasesrc.urls import urlpatterns as project_patterns
+
+
+def _async_pattern(pattern):
+    view = getattr(views_async, getattr(pattern, 'name', None) or '', None)
+    if view is None:
+        return pattern
+    pattern = copy.copy(pattern)
+    pattern.callback = view
+    return pattern
+
+
+urlpatterns = [
+    pattern for pattern in project_patterns if getattr(pattern, 'urlconf_name', None) is not urls
+] + [path('', include([_async_pattern(pattern) for pattern in urls.urlpatterns]))]
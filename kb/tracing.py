@@ -0,0 +1,172 @@
+"""Замеры одного запроса: SQL, шаблоны, проверки доступа.
+
+``RequestTimingMiddleware`` открывает ``Trace`` на время запроса; код
+приложения отмечает этапы через ``span(name)``. Вне запроса и при
+выключенных замерах ``span`` ничего не делает (одна проверка ContextVar).
+SQL считается обработчиком из ``connection.execute_wrapper``, который
+ставится на соединения один раз и тоже смотрит только на ContextVar:
+так запросы учитываются и в потоках ``sync_to_async`` async-представлений.
+Время этапов включающее: SQL внутри проверки прав входит и в ``sql``, и
+в ``policy``.
+"""
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+_trace = ContextVar('kb_trace', default=None)
+
+# Этапы, которые попадают в Server-Timing, и их описания (заголовок допускает только ASCII)
+STAGES = {
+    'sql': 'SQL',
+    'template': 'Templates',
+    'policy': 'Access checks',
+}
+
+
+class Trace:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = dict.fromkeys(STAGES, 0.0)
+        self.sql_count = 0
+        self._open = set()
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def current_trace():
+    return _trace.get()
+
+
+@contextmanager
+def tracing():
+    """Замеры текущего запроса; вложенный вызов продолжает уже открытые."""
+    trace = _trace.get()
+    if trace is not None:
+        yield trace
+        return
+    token = _trace.set(Trace())
+    try:
+        yield _trace.get()
+    finally:
+        _trace.reset(token)
+
+
+@contextmanager
+def span(name):
+    """Добавляет время блока к этапу ``name``; вложенные блоки того же этапа не считаются дважды."""
+    trace = _trace.get()
+    if trace is None or name in trace._open:
+        yield
+        return
+    trace._open.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace._open.discard(name)
+        trace.durations[name] += time.perf_counter() - started
+
+
+def sql_wrapper(execute, sql, params, many, context):
+    trace = _trace.get()
+    if trace is None:
+        return execute(sql, params, many, context)
+    trace.sql_count += 1
+    with span('sql'):
+        return execute(sql, params, many, context)
+
+
+def _instrument(connection, **kwargs):
+    if sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_wrapper)
+
+
+def instrument_connections():
+    """Ставит счетчик на уже открытые соединения текущего потока."""
+    for connection in connections.all(initialized_only=True):
+        _instrument(connection)
+
+
+def _instrumented_render(render):
+    def wrapper(self, context):
+        with span('template'):
+            return render(self, context)
+    wrapper._kb_traced = True
+    return wrapper
+
+
+def install():
+    """Подключает счетчики SQL и время шаблонов. Вызывается один раз при включенных замерах."""
+    from django.template.base import Template
+
+    # Соединения открываются заново в каждом потоке и после CONN_MAX_AGE
+    connection_created.connect(_instrument, dispatch_uid='kb.tracing')
+    instrument_connections()
+    if not getattr(Template.render, '_kb_traced', False):
+        Template.render = _instrumented_render(Template.render)
+
+
+def server_timing(trace, total):
+    """Значение заголовка Server-Timing, длительности в миллисекундах."""
+    metrics = [f'total;dur={total * 1000:.1f}']
+    for name, description in STAGES.items():
+        if name == 'sql':
+            description = f'{trace.sql_count} SQL'
+        metrics.append(f'{name};dur={trace.durations[name] * 1000:.1f};desc="{description}"')
+    return ', '.join(metrics)
+
+
+def response_size(response):
+    if not response.streaming:
+        return len(response.content)
+    # Размер потокового ответа известен, только если его объявил сам ответ (вложения)
+    length = response.get('Content-Length')
+    return int(length) if length else None
+
+
+def trace_record(request, response, trace, total):
+    match = getattr(request, 'resolver_match', None)
+    return {
+        'time': time.time(),
+        'method': request.method,
+        'path': request.path,
+        'view': match.view_name if match else None,
+        'status': response.status_code,
+        'duration_ms': round(total * 1000, 2),
+        'sql_count': trace.sql_count,
+        **{f'{name}_ms': round(value * 1000, 2) for name, value in trace.durations.items()},
+        'bytes': response_size(response),
+    }
+
+
+def trace_logger():
+    """Логгер JSONL-трассы с ротацией по размеру; None, если файл не задан."""
+    path = getattr(settings, 'KB_REQUEST_TRACE_FILE', None)
+    if not path:
+        return None
+    logger = logging.getLogger('kb.trace')
+    if not any(getattr(handler, 'baseFilename', None) == str(path) for handler in logger.handlers):
+        handler = RotatingFileHandler(
+            path,
+            maxBytes=getattr(settings, 'KB_REQUEST_TRACE_MAX_BYTES', 50 * 1024 * 1024),
+            backupCount=getattr(settings, 'KB_REQUEST_TRACE_BACKUP_COUNT', 5),
+            encoding='utf-8',
+        )
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        # Трасса пишется только в свой файл, а не в общие обработчики
+        logger.propagate = False
+    return logger
+
+
+def write_record(logger, record):
+    logger.info(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
@@ -0,0 +1,249 @@
+"""Загрузка вложений частями с записью прямо на диск.
+
+Каждый кусок — отдельный короткий запрос: тело читается из потока блоками
+и дописывается в staging-файл, поэтому память воркера не зависит от размера
+файла. Расширение имени должно входить в список допустимых расширений поля
+``Document.file``, а тип, определенный по сигнатуре первого куска, — совпадать
+с расширением: иначе под видом текста или SVG можно загрузить HTML со
+скриптом. SHA-256 считается
+инкрементально: состояние хеша хранится в процессе между кусками, а если
+следующий кусок пришел в другой процесс, хеш восстанавливается чтением уже
+записанной части файла. Запись куска идет под блокировкой файла сессии:
+повтор того же куска параллельным запросом ждет ее и получает 409, а не
+перемешивает байты в staging-файле.
+"""
+import fcntl
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files import File
+from django.core.validators import FileExtensionValidator
+from django.utils import timezone
+
+from . import metrics
+from .filetypes import SNIFF_SIZE, sniff_mime_type
+from .models import Document, UploadSession
+
+COPY_BLOCK = 64 * 1024
+
+# Тип содержимого, который должен соответствовать расширению вложения
+EXTENSION_TYPES = {
+    'pdf': 'application/pdf',
+    'doc': 'application/msword',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+}
+
+
+class UploadError(Exception):
+    status = 400
+
+
+class ChunkOutOfOrder(UploadError):
+    status = 409
+
+
+class ChunkTooLarge(UploadError):
+    status = 413
+
+
+class UnsupportedFileType(UploadError):
+    status = 415
+
+
+def allowed_extensions():
+    """Расширения из FileExtensionValidator поля Document.file."""
+    for validator in Document._meta.get_field('file').validators:
+        if isinstance(validator, FileExtensionValidator):
+            return [extension for extension in validator.allowed_extensions if extension in EXTENSION_TYPES]
+    return list(EXTENSION_TYPES)
+
+
+def check_filename(filename):
+    """Отклоняет имя с расширением вне списка допустимых; возвращает расширение."""
+    extension = os.path.splitext(filename)[1][1:].lower()
+    if extension not in allowed_extensions():
+        raise UnsupportedFileType(f'Недопустимое расширение файла: {", ".join(allowed_extensions())}')
+    return extension
+
+
+def check_content_type(filename, content_type):
+    if content_type != EXTENSION_TYPES[check_filename(filename)]:
+        raise UnsupportedFileType('Содержимое файла не соответствует его расширению')
+
+
+def staging_root():
+    return getattr(settings, 'KB_UPLOAD_STAGING_ROOT', None) or os.path.join(settings.MEDIA_ROOT, 'staging')
+
+
+def staging_path(session):
+    return os.path.join(staging_root(), f'{session.pk}.part')
+
+
+@contextmanager
+def _locked(session):
+    """Исключительная блокировка сессии между процессами на время записи куска."""
+    os.makedirs(staging_root(), exist_ok=True)
+    with open(staging_path(session) + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class _HasherCache:
+    """Незавершенные хеши загрузок текущего процесса (LRU)."""
+
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, offset, path):
+        """Хеш первых ``offset`` байт файла; из кэша, если он актуален."""
+        with self._lock:
+            cached = self._items.pop(key, None)
+        if cached and cached[0] == offset:
+            return cached[1]
+        hasher = hashlib.sha256()
+        if offset:
+            with open(path, 'rb') as staged:
+                remaining = offset
+                while remaining:
+                    block = staged.read(min(COPY_BLOCK, remaining))
+                    if not block:
+                        break
+                    hasher.update(block)
+                    remaining -= len(block)
+        return hasher
+
+    def put(self, key, offset, hasher):
+        with self._lock:
+            self._items[key] = (offset, hasher)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+
+_hashers = _HasherCache()
+
+
+class StagedFile(File):
+    """Готовый staging-файл: FileSystemStorage перемещает его, а не копирует."""
+
+    def __init__(self, path, sha256):
+        super().__init__(open(path, 'rb'), name=os.path.basename(path))
+        self.path = path
+        self.sha256 = sha256
+
+    def temporary_file_path(self):
+        return self.path
+
+
+def write_chunk(session, start, stream, length):
+    """Дописывает кусок ``[start, start + length)`` из потока ``stream``."""
+    if start != session.received:
+        raise ChunkOutOfOrder(f'Ожидался кусок с позиции {session.received}')
+    if length <= 0 or start + length > session.size:
+        raise UploadError('Кусок выходит за пределы файла')
+    if length > settings.KB_UPLOAD_CHUNK_SIZE:
+        raise ChunkTooLarge(f'Кусок больше {settings.KB_UPLOAD_CHUNK_SIZE} байт')
+
+    with _locked(session):
+        # Пока ждали блокировку, этот же кусок мог записать другой запрос
+        received = UploadSession.objects.filter(pk=session.pk).values_list('received', flat=True).first()
+        if received != start:
+            raise ChunkOutOfOrder('Кусок уже был записан другим запросом')
+        _write_chunk(session, start, stream, length)
+    metrics.inc('kb_upload_bytes_total', length)
+
+
+def _write_chunk(session, start, stream, length):
+    path = staging_path(session)
+    hasher = _hashers.take(session.pk, start, path)
+
+    written = 0
+    with open(path, 'r+b' if start else 'wb') as staged:
+        # Отбрасываем хвост оборванной предыдущей попытки
+        staged.seek(start)
+        staged.truncate()
+        while written < length:
+            block = stream.read(min(COPY_BLOCK, length - written))
+            if not block:
+                break
+            staged.write(block)
+            hasher.update(block)
+            written += len(block)
+        if written != length:
+            staged.truncate(start)
+
+    if written != length:
+        raise UploadError('Тело запроса короче заявленного куска')
+
+    if start == 0:
+        with open(path, 'rb') as staged:
+            content_type = sniff_mime_type(staged.read(SNIFF_SIZE), session.filename)
+        try:
+            check_content_type(session.filename, content_type)
+        except UnsupportedFileType:
+            abort_upload(session)
+            raise
+        session.content_type = content_type
+
+    # Условное обновление — вторая защита от двух запросов с одним куском
+    updated = UploadSession.objects.filter(pk=session.pk, received=start).update(
+        received=start + length, content_type=session.content_type, updated_at=timezone.now(),
+    )
+    if not updated:
+        _hashers.discard(session.pk)
+        raise ChunkOutOfOrder('Кусок уже был записан другим запросом')
+    session.received = start + length
+    _hashers.put(session.pk, session.received, hasher)
+
+
+def finalize_upload(session):
+    """Прикрепляет собранный файл к документу и возвращает его SHA-256."""
+    if not session.is_complete:
+        raise ChunkOutOfOrder(f'Получено {session.received} из {session.size} байт')
+    path = staging_path(session)
+    # Тип проверяется заново по собранному файлу: сессия могла быть создана до проверки
+    with open(path, 'rb') as staged:
+        content_type = sniff_mime_type(staged.read(SNIFF_SIZE), session.filename)
+    try:
+        check_content_type(session.filename, content_type)
+    except UnsupportedFileType:
+        abort_upload(session)
+        raise
+    sha256 = _hashers.take(session.pk, session.received, path).hexdigest()
+    staged = StagedFile(path, sha256)
+    try:
+        session.document.file_name = session.filename
+        session.document.file.save(session.filename, staged, save=True)
+    finally:
+        staged.close()
+    session.delete()
+    try:
+        os.remove(path + '.lock')
+    except FileNotFoundError:
+        pass
+    return sha256
+
+
+def abort_upload(session):
+    _hashers.discard(session.pk)
+    for path in (staging_path(session), staging_path(session) + '.lock'):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    UploadSession.objects.filter(pk=session.pk).delete()
@@ -1,5 +1,6 @@
+from django.conf import settings
 from django.urls import path, include
-from . import views
+from . import views, views_uploads
 from django.contrib.auth.decorators import login_required
 from .views_class_based import (
     DocumentCreateView,
@@ -7,17 +8,31 @@ from .views_class_based import (
     DocumentDeleteView
 )
 
+# Под ASGI основные страницы обслуживают async-версии представлений
+if getattr(settings, 'KB_ASYNC_VIEWS', False):
+    from . import views_async as document_views
+else:
+    document_views = views
+
 urlpatterns = [
     #path('', views.home, name='home'),
     path('select-department/', views.select_department, name='select_department'),
-    path('documents/', views.document_list, name='document_list'),
+    path('documents/', document_views.document_list, name='document_list'),
     path('documents/create/', DocumentCreateView.as_view(), name='document_create'),
     path('documents/<slug:slug>/edit/', DocumentUpdateView.as_view(), name='document_update'),
     path('documents/<slug:slug>/delete/', DocumentDeleteView.as_view(), name='document_delete'),
-    path('documents/<slug:slug>/add_comment/', views.add_comment, name='add_comment'),
-    path('documents/<slug:slug>/', views.document_detail, name='document_detail'),
+    path('documents/<slug:slug>/add_comment/', document_views.add_comment, name='add_comment'),
+    path('documents/<slug:slug>/comments/', document_views.document_comments, name='document_comments'),
+    path('documents/<slug:slug>/file/', document_views.document_download, name='document_download'),
+    path('documents/<slug:slug>/preview/<str:key>.jpg', views.document_preview, name='document_preview'),
+    path('documents/<slug:slug>/', document_views.document_detail, name='document_detail'),
     path('comments/<int:pk>/delete/', views.delete_comment, name='delete_comment'),
 
+    # Загрузка вложений частями
+    path('uploads/', views_uploads.upload_init, name='upload_init'),
+    path('uploads/<uuid:upload_id>/', views_uploads.upload_detail, name='upload_detail'),
+    path('uploads/<uuid:upload_id>/finalize/', views_uploads.upload_finalize, name='upload_finalize'),
+
     path('', login_required(views.home), name='home'),
     # Страницы входа и выхода
     path('accounts/', include('django.contrib.auth.urls')),
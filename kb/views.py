@@ -1,9 +1,24 @@
+from urllib.parse import urlencode
+
 from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
+from django.template.loader import render_to_string
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied
+from django.http import FileResponse, Http404, JsonResponse
 from django.contrib import messages
-from .models import Document, Comment, Department, Category
-from django.db.models import Q
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from .access import get_policy
+from .cache import GLOBAL_SCOPE, cached_fragment
+from .conditional import document_etag, document_last_modified
+from .downloads import serve_attachment
+from .models import AttachmentPreview, Document, Comment, Department, Category
+from .pagination import paginate
+from .previews import known_digest, preview_key, preview_path, touch
+from .routers import replica_reads
+from .search import get_search_backend
 
 
 @login_required(login_url='/accounts/login/')
@@ -30,6 +45,7 @@ def select_department(request):
     return redirect('home')
 
 
+@replica_reads
 @login_required
 def document_list(request):
     """Список документов с фильтрацией и поиском"""
@@ -38,22 +54,24 @@ def document_list(request):
             'message': 'Ваш аккаунт не привязан к отделу. Обратитесь к администратору.'
         })
 
+    policy = get_policy(request)
     query = request.GET.get('q', '')
     category_id = request.GET.get('category')
 
-    if request.user.user_type == 'ADMIN':
-        documents = Document.objects.filter(is_published=True)
-    else:
-        documents = Document.objects.filter(
-            is_published=True,
-            department=request.user.department
-        )
+    # Для списка хватает анонса: полный текст не загружаем
+    documents = (
+        Document.objects.visible_to(request.user)
+        .filter(is_published=True)
+        .defer('content', 'content_html')
+        .select_related('author', 'category')
+        .with_preview()
+    )
 
-    # Поиск по тексту
+    # Полнотекстовый поиск с ранжированием
     if query:
-        documents = documents.filter(
-            Q(title__icontains=query) | Q(content__icontains=query)
-        )
+        documents = get_search_backend().search(documents, query)
+    else:
+        documents = documents.order_by('-created_at', '-id')
 
     # Фильтр по категории
     selected_category = None
@@ -64,61 +82,135 @@ def document_list(request):
         except (ValueError, Category.DoesNotExist):
             selected_category = None
 
-    categories = Category.objects.filter(department=request.user.department) if request.user.department else Category.objects.all()
+    # Выпадающий список категорий и строки списка кэшируются по версии отдела
+    if policy.department_id:
+        categories_scope = policy.department_id
+        categories = Category.objects.filter(department_id=policy.department_id)
+    else:
+        categories_scope = GLOBAL_SCOPE
+        categories = Category.objects.all()
+    categories = cached_fragment(
+        categories_scope, 'categories', (),
+        lambda: list(categories.values('id', 'name')),
+    )
+
+    documents_scope = GLOBAL_SCOPE if policy.is_admin else policy.department_id
+    page = cached_fragment(
+        documents_scope, 'document_rows', sorted(request.GET.lists()),
+        lambda: render_document_rows(request, documents),
+    )
 
     return render(request, 'kb/document_list.html', {
-        'documents': documents,
+        'documents': page,
+        'page': page,
         'categories': categories,
         'selected_category': selected_category,
-        'can_add_document': request.user.has_perm('kb.manage_documents') or
-                            request.user.user_type in ['MANAGER', 'ADMIN'],
+        'can_add_document': policy.can_add_document,
         'query': query
     })
 
 
+@replica_reads
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=document_etag, last_modified_func=document_last_modified)
 def document_detail(request, slug):
     """Детали документа"""
-    document = get_object_or_404(Document, slug=slug)
-
-    if request.user.user_type != 'ADMIN':
-        if not document.is_published and not request.user.has_perm('kb.manage_documents'):
-            raise PermissionDenied
-        if request.user.department != document.department:
-            raise PermissionDenied
+    # Текст выводится из готового content_html, исходник нужен только для перерендера
+    document = get_object_or_404(
+        Document.objects.defer('content').select_related('author', 'category', 'department'), slug=slug,
+    )
+    policy = get_policy(request)
 
-    if not check_document_access(request.user, document):
+    if not policy.can_view_document(document):
         raise PermissionDenied
 
     if request.method == 'POST':
         return handle_post_requests(request, document)
 
-    comments = document.comments.filter(is_active=True)
-
-    can_delete_comments = (
-        request.user.user_type == 'ADMIN' or
-        (request.user.user_type == 'MANAGER' and request.user.department == document.department)
+    # Сервер выводит первую страницу, остальные страница подгружает из document_comments;
+    # ссылка «Вперед» остается для браузеров без JavaScript
+    comments = cached_fragment(
+        document.department_id, 'comments', (document.pk, sorted(request.GET.lists())),
+        lambda: paginate(
+            request, active_comments(document), settings.KB_COMMENTS_PER_PAGE, param='comments_cursor',
+        ),
     )
 
-    can_manage_documents = request.user.has_perm('kb.manage_documents')
-
     return render(request, 'kb/document_detail.html', {
         'document': document,
         'comments': comments,
-        'can_delete_comments': can_delete_comments,
-        'can_add_comment': request.user.department == document.department,
+        'more_comments_url': more_comments_url(document, comments),
+        'can_delete_comments': policy.can_moderate_comments(document),
+        'can_add_comment': policy.in_department(document.department_id),
+        'can_edit_document': policy.can_edit_document(document),
         'user': request.user,
-        'can_manage_documents': can_manage_documents,
+        'can_manage_documents': policy.can_manage_documents,
     })
 
 
+@replica_reads
+@login_required
+def document_comments(request, slug):
+    """Следующая страница комментариев в JSON: курсор в параметре cursor"""
+    document = get_object_or_404(Document.objects.only('id', 'slug', 'department_id', 'is_published'), slug=slug)
+    policy = get_policy(request)
+    if not policy.can_view_document(document):
+        raise PermissionDenied
+
+    page = cached_fragment(
+        document.department_id, 'comments_json', (document.pk, sorted(request.GET.lists())),
+        lambda: paginate(request, active_comments(document), settings.KB_COMMENTS_PER_PAGE),
+    )
+    return JsonResponse(comments_payload(request, page, policy.can_moderate_comments(document)))
+
+
+@login_required
+def document_download(request, slug):
+    """Скачивание вложения с проверкой доступа"""
+    document = get_object_or_404(Document.objects.defer('content', 'content_html'), slug=slug)
+
+    if not get_policy(request).can_view_document(document):
+        raise PermissionDenied
+    if not document.file:
+        raise Http404('У документа нет вложения')
+
+    return serve_attachment(request, document.file, document.get_file_name())
+
+
+@login_required
+def document_preview(request, slug, key):
+    """Миниатюра вложения из дискового кэша; сама миниатюра здесь не рендерится."""
+    document = get_object_or_404(
+        Document.objects.only('id', 'department_id', 'is_published', 'file'), slug=slug,
+    )
+    if not get_policy(request).can_view_document(document):
+        raise PermissionDenied
+    name = document.file.name
+    digest = known_digest(name) if name else ''
+    if name and not digest:
+        digest = AttachmentPreview.objects.filter(file=name).values_list('digest', flat=True).first()
+    if not digest or key != preview_key(digest):
+        raise Http404('Миниатюра не найдена')
+
+    path = preview_path(key)
+    if not touch(path):
+        # Вытеснена из кэша: рендерится заново в фоне, страница покажет ее позже
+        AttachmentPreview.requeue(name)
+        raise Http404('Миниатюра еще не готова')
+    response = FileResponse(open(path, 'rb'), content_type='image/jpeg')
+    # Имя миниатюры содержит хеш вложения: при замене файла меняется и URL
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
+
 @login_required
 def add_comment(request, slug):
     """Добавить комментарий"""
-    document = get_object_or_404(Document, slug=slug)
-    
-    if not (request.user.user_type == 'ADMIN' or 
-            (request.user.department and request.user.department == document.department)):
+    document = get_object_or_404(Document.objects.only('id', 'slug', 'department_id'), slug=slug)
+    policy = get_policy(request)
+
+    if not policy.can_comment(document):
         raise PermissionDenied
 
     if request.method == 'POST':
@@ -126,26 +218,30 @@ def add_comment(request, slug):
         link = request.POST.get('link', '').strip()
         
         if text:  # Комментарий не может быть пустым
-            Comment.objects.create(
+            comment = Comment.objects.create(
                 document=document,
                 author=request.user,
                 text=text,
                 link=link if link else None  # Сохраняем ссылку, если она есть
             )
+            if wants_json(request):
+                # Страница дописывает комментарий в ленту без перезагрузки
+                return JsonResponse({
+                    'comment': comment_payload(comment),
+                    'html': render_comments(request, [comment], policy.can_moderate_comments(document)),
+                }, status=201)
             messages.success(request, 'Комментарий добавлен')
+        elif wants_json(request):
+            return JsonResponse({'error': 'Комментарий не может быть пустым'}, status=400)
     
     return redirect('document_detail', slug=document.slug)
 
 @login_required
 def delete_comment(request, pk):
-    comment = get_object_or_404(Comment, id=pk)
+    comment = get_object_or_404(Comment.objects.select_related('document'), id=pk)
     document = comment.document
 
-    if not (
-        request.user.user_type == 'ADMIN' or
-        (request.user.user_type == 'MANAGER' and request.user.department == document.department) or
-        (request.user == comment.author)
-    ):
+    if not get_policy(request).can_delete_comment(comment, document):
         raise PermissionDenied
 
     comment.delete()
@@ -155,13 +251,56 @@ def delete_comment(request, pk):
 
 # Вспомогательные функции
 
-def check_document_access(user, document):
-    """Проверка доступа к документу"""
-    if user.user_type == 'ADMIN':
-        return True
-    if not document.is_published and not user.has_perm('kb.manage_documents'):
-        return False
-    return user.department == document.department
+def render_document_rows(request, documents):
+    """Страница списка вместе с готовым HTML строк (значение для кэша)."""
+    page = paginate(request, documents, settings.KB_DOCUMENTS_PER_PAGE)
+    page.rows_html = render_to_string('includes/document_rows.html', {'documents': page})
+    return page
+
+
+def active_comments(document):
+    """Лента комментариев документа: авторы и их отделы загружаются тем же запросом."""
+    return (
+        document.comments.filter(is_active=True)
+        .select_related('author__department').order_by('created_at', 'id')
+    )
+
+
+def more_comments_url(document, page):
+    if not page.has_next:
+        return None
+    return f"{reverse('document_comments', args=[document.slug])}?{urlencode({'cursor': page.next_cursor})}"
+
+
+def wants_json(request):
+    return request.headers.get('Accept', '').startswith('application/json')
+
+
+def comment_payload(comment):
+    return {
+        'id': comment.pk,
+        'author': comment.author.get_full_name() or comment.author.username,
+        'created_at': comment.created_at.isoformat(),
+        'text': comment.text,
+        'link': comment.link,
+    }
+
+
+def render_comments(request, comments, can_delete_comments):
+    return render_to_string('includes/comments.html', {
+        'comments': comments,
+        'user': request.user,
+        'can_delete_comments': can_delete_comments,
+    }, request=request)
+
+
+def comments_payload(request, page, can_delete_comments):
+    """JSON страницы комментариев: данные, готовый HTML строк и адрес следующей страницы."""
+    return {
+        'comments': [comment_payload(comment) for comment in page],
+        'html': render_comments(request, page, can_delete_comments),
+        'next': f'{request.path}{page.next_url}' if page.has_next else None,
+    }
 
 
 def handle_post_requests(request, document):
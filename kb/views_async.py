@@ -0,0 +1,239 @@
+"""Async-версии основных представлений для запуска под ASGI.
+
+Повторяют представления из ``views`` и подключаются вместо них при
+``KB_ASYNC_VIEWS = True`` (см. ``urls``). Данные читаются асинхронным ORM и
+асинхронным API кэша, вложения отдаются асинхронным итератором, поэтому
+медленный клиент не занимает поток. Все, что должно быть доступно шаблону
+(пользователь, его отдел, права), загружается до рендеринга: шаблоны в
+async-контексте не должны обращаться к БД.
+"""
+from calendar import timegm
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.views import redirect_to_login
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, JsonResponse
+from django.shortcuts import redirect, render
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from .access import aget_policy
+from .cache import GLOBAL_SCOPE, acached_fragment
+from .conditional import adocument_validators
+from .downloads import serve_attachment
+from .models import Category, Comment, Document
+from .pagination import apaginate
+from .rendering import renderer_key
+from .routers import replica_reads
+from .search import get_search_backend
+from .views import (
+    active_comments, comment_payload, comments_payload, handle_post_requests, more_comments_url, render_comments,
+    wants_json,
+)
+
+NO_DEPARTMENT_MESSAGE = 'Ваш аккаунт не привязан к отделу. Обратитесь к администратору.'
+
+
+def alogin_required(view):
+    """login_required для корутин. Загруженная политика доступа передается
+    представлению вторым аргументом."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        policy = await aget_policy(request)
+        if not policy.user_id:
+            return redirect_to_login(request.get_full_path())
+        return await view(request, policy, *args, **kwargs)
+    return wrapper
+
+
+async def aget_or_404(queryset, **kwargs):
+    try:
+        return await queryset.aget(**kwargs)
+    except queryset.model.DoesNotExist:
+        raise Http404(f'{queryset.model._meta.object_name} не найден')
+
+
+@replica_reads
+@alogin_required
+async def document_list(request, policy):
+    """Список документов с фильтрацией и поиском"""
+    if policy.user_type == 'EMPLOYEE' and not policy.department_id:
+        return render(request, 'kb/access_denied.html', {'message': NO_DEPARTMENT_MESSAGE})
+
+    query = request.GET.get('q', '')
+    category_id = request.GET.get('category')
+
+    documents = (
+        policy.filter_documents(Document.objects.all())
+        .filter(is_published=True)
+        .defer('content', 'content_html')
+        .select_related('author', 'category')
+        .with_preview()
+    )
+    if query:
+        documents = get_search_backend().search(documents, query)
+    else:
+        documents = documents.order_by('-created_at', '-id')
+
+    selected_category = None
+    if category_id:
+        try:
+            documents = documents.filter(category_id=category_id)
+            selected_category = await Category.objects.aget(id=category_id)
+        except (ValueError, Category.DoesNotExist):
+            selected_category = None
+
+    if policy.department_id:
+        categories_scope = policy.department_id
+        categories = Category.objects.filter(department_id=policy.department_id)
+    else:
+        categories_scope = GLOBAL_SCOPE
+        categories = Category.objects.all()
+
+    async def build_categories():
+        return [category async for category in categories.values('id', 'name')]
+
+    async def build_rows():
+        page = await apaginate(request, documents, settings.KB_DOCUMENTS_PER_PAGE)
+        page.rows_html = render_to_string('includes/document_rows.html', {'documents': page})
+        return page
+
+    categories = await acached_fragment(categories_scope, 'categories', (), build_categories)
+    documents_scope = GLOBAL_SCOPE if policy.is_admin else policy.department_id
+    page = await acached_fragment(
+        documents_scope, 'document_rows', sorted(request.GET.lists()), build_rows,
+    )
+
+    return render(request, 'kb/document_list.html', {
+        'documents': page,
+        'page': page,
+        'categories': categories,
+        'selected_category': selected_category,
+        'can_add_document': policy.can_add_document,
+        'query': query,
+    })
+
+
+@replica_reads
+@alogin_required
+async def document_detail(request, policy, slug):
+    """Детали документа"""
+    # Те же проверки, что делают декораторы condition и cache_control синхронной версии
+    etag, last_modified = await adocument_validators(request, slug)
+    etag = quote_etag(etag) if etag else None
+    last_modified = timegm(last_modified.utctimetuple()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = await _document_detail(request, policy, slug)
+        if request.method in ('GET', 'HEAD'):
+            if last_modified and not response.has_header('Last-Modified'):
+                response.headers['Last-Modified'] = http_date(last_modified)
+            if etag:
+                response.headers.setdefault('ETag', etag)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+async def _document_detail(request, policy, slug):
+    document = await aget_or_404(
+        Document.objects.defer('content').select_related('author', 'category', 'department'), slug=slug,
+    )
+    if not policy.can_view_document(document):
+        raise PermissionDenied
+
+    if request.method == 'POST':
+        return await sync_to_async(handle_post_requests)(request, document)
+
+    if document.content_renderer != renderer_key():
+        # Устаревший HTML перестраивается из исходника с записью в БД
+        await sync_to_async(document.get_content_html)()
+
+    async def build_comments():
+        return await apaginate(
+            request, active_comments(document), settings.KB_COMMENTS_PER_PAGE, param='comments_cursor',
+        )
+
+    comments = await acached_fragment(
+        document.department_id, 'comments', (document.pk, sorted(request.GET.lists())), build_comments,
+    )
+
+    return render(request, 'kb/document_detail.html', {
+        'document': document,
+        'comments': comments,
+        'more_comments_url': more_comments_url(document, comments),
+        'can_delete_comments': policy.can_moderate_comments(document),
+        'can_add_comment': policy.in_department(document.department_id),
+        'can_edit_document': policy.can_edit_document(document),
+        'user': request.user,
+        'can_manage_documents': policy.can_manage_documents,
+    })
+
+
+@replica_reads
+@alogin_required
+async def document_comments(request, policy, slug):
+    """Следующая страница комментариев в JSON: курсор в параметре cursor"""
+    document = await aget_or_404(
+        Document.objects.only('id', 'slug', 'department_id', 'is_published'), slug=slug,
+    )
+    if not policy.can_view_document(document):
+        raise PermissionDenied
+
+    async def build_page():
+        return await apaginate(request, active_comments(document), settings.KB_COMMENTS_PER_PAGE)
+
+    page = await acached_fragment(
+        document.department_id, 'comments_json', (document.pk, sorted(request.GET.lists())), build_page,
+    )
+    return JsonResponse(comments_payload(request, page, policy.can_moderate_comments(document)))
+
+
+@alogin_required
+async def document_download(request, policy, slug):
+    """Скачивание вложения с проверкой доступа"""
+    document = await aget_or_404(Document.objects.defer('content', 'content_html'), slug=slug)
+
+    if not policy.can_view_document(document):
+        raise PermissionDenied
+    if not document.file:
+        raise Http404('У документа нет вложения')
+
+    # Проверка размера и времени изменения файла — обращения к диску, уводим их из цикла событий
+    return await sync_to_async(serve_attachment, thread_sensitive=False)(
+        request, document.file, document.get_file_name(), asynchronous=True,
+    )
+
+
+@alogin_required
+async def add_comment(request, policy, slug):
+    """Добавить комментарий"""
+    document = await aget_or_404(Document.objects.only('id', 'slug', 'department_id'), slug=slug)
+
+    if not policy.can_comment(document):
+        raise PermissionDenied
+
+    if request.method == 'POST':
+        text = request.POST.get('text', '').strip()
+        link = request.POST.get('link', '').strip()
+
+        if text:
+            comment = await Comment.objects.acreate(
+                document=document,
+                author=request.user,
+                text=text,
+                link=link if link else None,
+            )
+            if wants_json(request):
+                return JsonResponse({
+                    'comment': comment_payload(comment),
+                    'html': render_comments(request, [comment], policy.can_moderate_comments(document)),
+                }, status=201)
+            messages.success(request, 'Комментарий добавлен')
+        elif wants_json(request):
+            return JsonResponse({'error': 'Комментарий не может быть пустым'}, status=400)
+
+    return redirect('document_detail', slug=document.slug)
@@ -3,10 +3,23 @@ from django.urls import reverse_lazy
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.core.exceptions import PermissionDenied
 
+from .access import get_policy
 from .models import Document, Category
 from .forms import DocumentForm
 
 
+class DocumentPermissionMixin(UserPassesTestMixin):
+    """Проверка прав по политике доступа; документ загружается один раз."""
+
+    def get_object(self, queryset=None):
+        if not hasattr(self, '_document'):
+            self._document = super().get_object(queryset)
+        return self._document
+
+    def test_func(self):
+        return get_policy(self.request).can_edit_document(self.get_object())
+
+
 class DocumentCreateView(LoginRequiredMixin, CreateView):
     model = Document
     form_class = DocumentForm
@@ -14,12 +27,13 @@ class DocumentCreateView(LoginRequiredMixin, CreateView):
 
     def get_form(self, form_class=None):
         form = super().get_form(form_class)
-        if self.request.user.department:
+        department_id = get_policy(self.request).department_id
+        if department_id:
             form.fields['category'].queryset = Category.objects.filter(
-                department=self.request.user.department
+                department_id=department_id
             )
             # Установим department по умолчанию из пользователя
-            form.fields['department'].initial = self.request.user.department
+            form.fields['department'].initial = department_id
         return form
 
     def form_valid(self, form):
@@ -40,40 +54,24 @@ class DocumentCreateView(LoginRequiredMixin, CreateView):
         return reverse_lazy('document_detail', kwargs={'slug': self.object.slug})
 
 
-class DocumentUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class DocumentUpdateView(LoginRequiredMixin, DocumentPermissionMixin, UpdateView):
     model = Document
     form_class = DocumentForm
     slug_field = "slug"
     slug_url_kwarg = "slug"
     template_name = "kb/document_form.html"
 
-    def test_func(self):
-        doc = self.get_object()
-        return (
-            self.request.user.user_type == 'ADMIN' or
-            self.request.user == doc.author or
-            self.request.user.has_perm('kb.manage_documents')
-        )
-
     def get_success_url(self):
         return reverse_lazy('document_detail', kwargs={'slug': self.object.slug})
 
 
-class DocumentDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
+class DocumentDeleteView(LoginRequiredMixin, DocumentPermissionMixin, DeleteView):
     model = Document
     slug_field = "slug"
     slug_url_kwarg = "slug"
     template_name = 'kb/document_confirm_delete.html'
     success_url = reverse_lazy('document_list')
 
-    def test_func(self):
-        doc = self.get_object()
-        return (
-            self.request.user.user_type == 'ADMIN' or
-            self.request.user == doc.author or
-            self.request.user.has_perm('kb.manage_documents')
-        )
-
     def delete(self, request, *args, **kwargs):
         self.object = self.get_object()
         # Удаляем связанные комментарии перед удалением документа
@@ -0,0 +1,26 @@
+"""Метрики для Prometheus (см. kb.metrics)."""
+import hmac
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse
+
+from . import metrics as kb_metrics
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def check_access(request):
+    token = getattr(settings, 'KB_METRICS_TOKEN', None)
+    if token:
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            raise PermissionDenied
+    elif request.META.get('REMOTE_ADDR') not in getattr(settings, 'KB_METRICS_ALLOWED_IPS', ()):
+        raise PermissionDenied
+
+
+def metrics(request):
+    if not kb_metrics.metrics_dir():
+        raise Http404('Метрики выключены: задайте KB_METRICS_DIR')
+    check_access(request)
+    return HttpResponse(kb_metrics.render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,41 @@
+"""Страница админки со снятыми профилями запросов (см. kb.profiling)."""
+import os
+
+from django.contrib import admin
+from django.core.exceptions import PermissionDenied
+from django.http import FileResponse, Http404, HttpResponse
+from django.template.response import TemplateResponse
+
+from .access import get_policy
+from .profiling import collapsed_stacks, list_profiles, profile_path
+
+
+def check_access(request):
+    # В профилях пути и пользователи всех отделов: только администраторам
+    if not (request.user.is_superuser or get_policy(request).is_admin):
+        raise PermissionDenied
+
+
+def profile_list(request):
+    check_access(request)
+    return TemplateResponse(request, 'admin/kb/profiles.html', {
+        **admin.site.each_context(request),
+        'title': 'Профили запросов',
+        'profiles': list_profiles(),
+    })
+
+
+def profile_download(request, name, format):
+    check_access(request)
+    try:
+        path = profile_path(name)
+    except ValueError:
+        raise Http404('Профиль не найден')
+    if format not in ('prof', 'collapsed') or not os.path.exists(path):
+        raise Http404('Профиль не найден')
+
+    if format == 'collapsed':
+        response = HttpResponse(collapsed_stacks(path), content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{name}.collapsed.txt"'
+        return response
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{name}.prof')
@@ -0,0 +1,117 @@
+import json
+import os
+import re
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import require_http_methods, require_POST
+
+from .models import Document, UploadSession
+from .uploads import UploadError, abort_upload, check_filename, finalize_upload, write_chunk
+from .access import get_policy
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+def session_payload(session):
+    return {
+        'id': str(session.pk),
+        'document': session.document.slug,
+        'filename': session.filename,
+        'size': session.size,
+        'received': session.received,
+        'content_type': session.content_type,
+        'chunk_size': settings.KB_UPLOAD_CHUNK_SIZE,
+    }
+
+
+def error_response(message, status, session=None):
+    payload = {'error': message}
+    if session is not None:
+        payload['received'] = session.received
+    return JsonResponse(payload, status=status)
+
+
+@login_required
+@require_POST
+def upload_init(request):
+    """Начало загрузки: {"document": slug, "filename": ..., "size": ...}"""
+    try:
+        data = json.loads(request.body or b'{}')
+        size = int(data['size'])
+        filename = os.path.basename(str(data['filename'])).strip()
+    except (ValueError, KeyError, TypeError):
+        return error_response('Ожидается JSON с полями document, filename и size', 400)
+
+    document = get_object_or_404(Document.objects.defer('content', 'content_html'), slug=data.get('document'))
+    if not get_policy(request).can_edit_document(document):
+        raise PermissionDenied
+    if not filename:
+        return error_response('Не указано имя файла', 400)
+    try:
+        check_filename(filename)
+    except UploadError as error:
+        return error_response(str(error), error.status)
+    if not 0 < size <= settings.KB_UPLOAD_MAX_SIZE:
+        return error_response(f'Размер файла должен быть от 1 до {settings.KB_UPLOAD_MAX_SIZE} байт', 413)
+
+    session = UploadSession.objects.create(
+        user=request.user,
+        document=document,
+        filename=filename,
+        size=size,
+    )
+    return JsonResponse(session_payload(session), status=201)
+
+
+@login_required
+@require_http_methods(['GET', 'PUT', 'DELETE'])
+def upload_detail(request, upload_id):
+    """GET — состояние (для возобновления), PUT — очередной кусок, DELETE — отмена"""
+    session = get_object_or_404(
+        UploadSession.objects.select_related('document'), pk=upload_id, user=request.user
+    )
+
+    if request.method == 'GET':
+        return JsonResponse(session_payload(session))
+
+    if request.method == 'DELETE':
+        abort_upload(session)
+        return HttpResponse(status=204)
+
+    match = CONTENT_RANGE_RE.match(request.headers.get('Content-Range', ''))
+    if not match or int(match.group(3)) != session.size:
+        return error_response('Нужен заголовок Content-Range: bytes start-end/size', 400, session)
+    start, end = int(match.group(1)), int(match.group(2))
+    length = end - start + 1
+    if request.headers.get('Content-Length') != str(length):
+        return error_response('Content-Length не совпадает с Content-Range', 400, session)
+
+    try:
+        # Тело читается из потока запроса блоками, не через request.body
+        write_chunk(session, start, request, length)
+    except UploadError as error:
+        return error_response(str(error), error.status, session)
+    return JsonResponse(session_payload(session))
+
+
+@login_required
+@require_POST
+def upload_finalize(request, upload_id):
+    """Завершение: файл прикрепляется к документу"""
+    session = get_object_or_404(
+        UploadSession.objects.select_related('document'), pk=upload_id, user=request.user
+    )
+    document = session.document
+    try:
+        sha256 = finalize_upload(session)
+    except UploadError as error:
+        return error_response(str(error), error.status, session)
+    return JsonResponse({
+        'document': document.slug,
+        'file': document.file.name,
+        'sha256': sha256,
+    })
@@ -5,12 +5,15 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+By default it uses ``knowledgebasesrc.settings_asgi`` with the async views
+enabled; see ``gunicorn_asgi.py`` for the server configuration.
 """
 
 import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'knowledgebasesrc.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'knowledgebasesrc.settings_asgi')
 
 application = get_asgi_application()
@@ -0,0 +1,18 @@
+"""Конфигурация gunicorn с воркерами uvicorn для ASGI-приложения:
+
+    gunicorn knowledgebasesrc.asgi:application -c knowledgebasesrc/gunicorn_asgi.py
+
+Каждый воркер — отдельный процесс с циклом событий; медленные клиенты и
+скачивания не занимают поток, поэтому воркеров нужно меньше, чем для WSGI.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('KB_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('KB_WORKERS', multiprocessing.cpu_count()))
+# uvicorn.workers устарел: воркер для gunicorn вынесен в пакет uvicorn-worker
+worker_class = 'uvicorn_worker.UvicornWorker'
+# Скачивание больших вложений медленным клиентом может длиться долго
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
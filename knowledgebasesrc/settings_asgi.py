@@ -0,0 +1,5 @@
+"""Настройки для запуска под ASGI (uvicorn): основные страницы
+обслуживаются async-представлениями из kb.views_async."""
+from .settings import *  # noqa: F401,F403
+
+KB_ASYNC_VIEWS = True
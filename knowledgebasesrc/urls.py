@@ -1,15 +1,22 @@
 from django.contrib import admin
 from django.urls import path, include
-from django.conf import settings
-from django.conf.urls.static import static
 from django.contrib.auth import views as auth_views  # Добавлено
+from kb import views_metrics, views_profiles
 
 urlpatterns = [
+    # Профили запросов: до admin.site.urls, иначе адрес перехватит админка
+    path('admin/kb/profiles/', admin.site.admin_view(views_profiles.profile_list), name='kb_profiles'),
+    path(
+        'admin/kb/profiles/<str:name>.<str:format>',
+        admin.site.admin_view(views_profiles.profile_download),
+        name='kb_profile_download',
+    ),
     path('admin/', admin.site.urls),
+    path('metrics', views_metrics.metrics, name='metrics'),
     path('accounts/login/', auth_views.LoginView.as_view(template_name='registration/login.html'), name='login'),  # Добавлено
     path('accounts/logout/', auth_views.LogoutView.as_view(), name='logout'),  # Добавлено
     path('', include('kb.urls')),
 ]
 
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+# Вложения из MEDIA_ROOT отдаются только через kb.views.document_download
+# с проверкой прав, поэтому static() для медиа не подключается.